@@ -1,6 +1,30 @@
-from .memory_ingestion import ingest_message
-from .summarizer import summarize_memories
-from .embedding_utils import init_faiss, search_memory
-from .models import MemoryEvent, UserProfile
-from .db_setup import SessionLocal, engine
-from .init_db import Base
+import importlib
+
+# Public names resolve lazily so `import Threadly_SDK` stays cheap and free of I/O;
+# the owning module (and its heavy dependencies) load on first attribute access.
+# Names must not collide with submodules (e.g. init_db), which Python binds on the package when imported.
+_LAZY_ATTRS = {
+    "ingest_message": ".memory_ingestion",
+    "summarize_memories": ".summarizer",
+    "init_faiss": ".embedding_utils",
+    "search_memory": ".embedding_utils",
+    "MemoryEvent": ".models",
+    "UserProfile": ".models",
+    "SessionLocal": ".db_setup",
+    "engine": ".db_setup",
+    "Base": ".db_setup",
+    "get_openai_client": ".clients",
+}
+
+__all__ = list(_LAZY_ATTRS)
+
+def __getattr__(name):
+    module = _LAZY_ATTRS.get(name)
+    if module is None:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(module, __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | set(__all__))
@@ -0,0 +1,265 @@
+# activity_logger.py
+#
+# Buffered activity log for the Streamlit UI.
+# log_action() only puts the row on a bounded in-memory queue, so a user action never waits on
+# the disk; one flusher thread per process drains it in batches (up to FLUSH_ROWS rows or
+# FLUSH_SECONDS after the first one) and appends each batch with a single write. The file
+# rotates once it reaches THREADLY_ACTIVITY_LOG_MB or a new THREADLY_ACTIVITY_LOG_HOURS period
+# starts; rotated files keep their last write time in the name.
+#
+# Formats (THREADLY_ACTIVITY_LOG_FORMAT):
+#   csv     — timestamp, user_id, action, content, meta; the historical activity_log.csv layout
+#   ndjson  — one JSON object per line, meta kept as structured JSON
+#   parquet — needs pyarrow (falls back to ndjson without it). A Parquet file can't take
+#             appends from two writers, so each process writes its own file, readable once
+#             it rotates or the process exits
+# csv and ndjson files are shared by every process on the host: batches are written under an
+# flock, so rows from different sessions never interleave mid-line.
+
+import os
+import io
+import csv
+import json
+import time
+import queue
+import fcntl
+import atexit
+import threading
+from datetime import datetime
+
+ACTIVITY_LOG_FORMAT = os.getenv("THREADLY_ACTIVITY_LOG_FORMAT", "csv")  # csv | ndjson | parquet
+ACTIVITY_LOG_PATH = os.getenv("THREADLY_ACTIVITY_LOG", "")              # default: activity_log.<format>
+ROTATE_BYTES = int(float(os.getenv("THREADLY_ACTIVITY_LOG_MB", "64")) * 1024 * 1024)
+ROTATE_SECONDS = float(os.getenv("THREADLY_ACTIVITY_LOG_HOURS", "24")) * 3600  # 0 = size only
+QUEUE_SIZE = 10000     # rows buffered before new ones are dropped (and counted)
+FLUSH_ROWS = 500
+FLUSH_SECONDS = 1.0
+
+FIELDS = ("timestamp", "user_id", "action", "content", "meta")
+FORMATS = ("csv", "ndjson", "parquet")
+
+_logger = None
+_logger_lock = threading.Lock()
+_STOP = object()
+
+def timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+def _rotated_path(path, written_at):
+    root, ext = os.path.splitext(path)
+    stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(written_at))
+    candidate, n = f"{root}.{stamp}{ext}", 1
+    while os.path.exists(candidate):
+        candidate, n = f"{root}.{stamp}-{n}{ext}", n + 1
+    return candidate
+
+# ---------------------------
+# Writers
+# ---------------------------
+def _encode_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([
+            row["timestamp"], row["user_id"], row["action"], row["content"],
+            str(row["meta"]) if row["meta"] else "",
+        ])
+    return buffer.getvalue()
+
+def _encode_ndjson(rows):
+    return "".join(json.dumps(row, default=str, ensure_ascii=False) + "\n" for row in rows)
+
+class AppendWriter:
+    """csv / ndjson: appends each batch to one file shared by every process."""
+
+    def __init__(self, path, encode, rotate_bytes=ROTATE_BYTES, rotate_seconds=ROTATE_SECONDS):
+        self.path = path
+        self.encode = encode
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+
+    def _maybe_rotate(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            return
+        stale = self.rotate_seconds and stat.st_mtime // self.rotate_seconds < time.time() // self.rotate_seconds
+        if stat.st_size >= self.rotate_bytes or stale:
+            os.replace(self.path, _rotated_path(self.path, stat.st_mtime))
+
+    def write(self, rows):
+        data = self.encode(rows)
+        with open(self.path + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._maybe_rotate()
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                f.write(data)
+
+    def close(self):
+        pass
+
+class ParquetWriter:
+    """parquet: one row group per batch, in a file of this process's own."""
+
+    def __init__(self, path, rotate_bytes=ROTATE_BYTES, rotate_seconds=ROTATE_SECONDS):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.pa, self.pq = pa, pq
+        self.schema = pa.schema([(field, pa.string()) for field in FIELDS])
+        self.root = os.path.splitext(path)[0]
+        self.rotate_bytes = rotate_bytes
+        self.rotate_seconds = rotate_seconds
+        self._writer = None
+        self._path = None
+        self._opened_at = 0.0
+
+    def _open(self):
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        self._path = f"{self.root}.{stamp}-{os.getpid()}.parquet"
+        self._writer = self.pq.ParquetWriter(self._path, self.schema)
+        self._opened_at = time.time()
+
+    def write(self, rows):
+        if self._writer is not None and (
+            os.path.getsize(self._path) >= self.rotate_bytes
+            or (self.rotate_seconds and time.time() - self._opened_at >= self.rotate_seconds)
+        ):
+            self.close()
+        if self._writer is None:
+            self._open()
+        columns = {
+            field: [None if row[field] is None else
+                    json.dumps(row[field], default=str) if field == "meta" else str(row[field])
+                    for row in rows]
+            for field in FIELDS
+        }
+        self._writer.write_table(self.pa.table(columns, schema=self.schema))
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+def make_writer(fmt=ACTIVITY_LOG_FORMAT, path=None):
+    if fmt not in FORMATS:
+        raise ValueError(f"❌ Unknown activity log format '{fmt}' (expected one of {FORMATS}).")
+    if fmt == "parquet":
+        try:
+            return ParquetWriter(path or "activity_log.parquet")
+        except ImportError:
+            print(f"[{timestamp()}] ⚠️ pyarrow not installed; activity log falls back to ndjson", flush=True)
+            fmt, path = "ndjson", None
+    path = path or f"activity_log.{fmt}"
+    return AppendWriter(path, _encode_csv if fmt == "csv" else _encode_ndjson)
+
+# ---------------------------
+# Logger
+# ---------------------------
+class ActivityLogger:
+    def __init__(self, writer, queue_size=QUEUE_SIZE):
+        self.writer = writer
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def log(self, user_id, action, content="", meta=None):
+        """Queue one row; never blocks. Rows beyond the queue's capacity are dropped and counted."""
+        self._start()
+        row = {
+            "timestamp": datetime.utcnow().isoformat() + "Z",
+            "user_id": user_id,
+            "action": action,
+            "content": content,
+            "meta": meta,
+        }
+        try:
+            self.queue.put_nowait(row)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _start(self):
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="activity-log", daemon=True)
+                    self._thread.start()
+
+    def _next_batch(self):
+        first = self.queue.get()
+        if first is _STOP:
+            return None
+        batch = [first]
+        flush_at = time.monotonic() + FLUSH_SECONDS
+        while len(batch) < FLUSH_ROWS:
+            remaining = flush_at - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                row = self.queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if row is _STOP:
+                self.queue.put(_STOP)  # handled once this batch is written
+                self.queue.task_done()
+                break
+            batch.append(row)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                self.writer.close()
+                self.queue.task_done()
+                return
+            try:
+                self.writer.write(batch)
+                with self._lock:
+                    self.written += len(batch)
+            except Exception as e:
+                with self._lock:
+                    self.failed += len(batch)
+                print(f"[{timestamp()}] ⚠️ Activity log write failed ({len(batch)} rows): {e}", flush=True)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def flush(self):
+        """Block until every row queued so far is written."""
+        if self._thread is not None:
+            self.queue.join()
+
+    def close(self):
+        """Write what's queued, finalize the current file and stop the flusher."""
+        if self._thread is not None and self._thread.is_alive():
+            self.queue.put(_STOP)
+            self._thread.join()
+        else:
+            self.writer.close()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "queued": self.queue.qsize(),
+                "written": self.written,
+                "dropped": self.dropped,
+                "failed": self.failed,
+            }
+
+def get_activity_logger():
+    global _logger
+    if _logger is None:
+        with _logger_lock:
+            if _logger is None:
+                _logger = ActivityLogger(make_writer(ACTIVITY_LOG_FORMAT, ACTIVITY_LOG_PATH or None))
+                atexit.register(_logger.close)
+    return _logger
+
+def log_action(user_id, action, content="", meta=None):
+    """Record a UI action in the shared activity log without blocking the caller."""
+    get_activity_logger().log(user_id, action, content, meta)
@@ -1,52 +1,36 @@
 from flask import Flask, request, jsonify
 from .memory_ingestion import ingest_message
-from .embedding_utils import init_faiss, search_memory, print_vector_count
+from .embedding_utils import search_memory
 from .summarizer import summarize_memories
-from .db_setup import SessionLocal
+from .db_setup import ReadSessionLocal
+from .unit_of_work import unit_of_work
+from .records import ContextEntry
 from .models import UserProfile, MemoryEvent
-from sqlalchemy import func
+from .init_db import init_db
+from .deadline import request_deadline
+from .rate_limiter import OPTIONAL
+from . import wild_card as wild_card_cache
+from . import jobs
+from . import ingest_log
+from . import history
+from . import deletion
+from . import working_set
+from .sharding import user_shard
 from collections import defaultdict
 from datetime import datetime, timedelta
-from openai import OpenAI
-import os
 
 app = Flask(__name__)
-init_faiss()
-print_vector_count()
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+@app.before_request
+def ensure_db():
+    # Tables are created on the first request rather than at import time
+    init_db()
+    jobs.start()  # resume durable post-ingest jobs left by a previous run
+    ingest_log.schedule_recovery()  # embed any logged events the vector stores are missing
 
 # ---------------------------
 # Wild Card Helpers
 # ---------------------------
-def generate_wild_card(structured_entries, topic):
-    prompt = f"""
-The user has been journaling. Here are their last 5 entries summarized:
-
-{chr(10).join(f"- {m}" for m in structured_entries)}
-
-Topic focus: {topic}
-
-Recommend ONE real consumer product or sponsorship category that the user could realistically purchase online or in a store.
-- Base it on recurring topics, subtopics, and emotions across the 5 entries (not just the most recent one).
-- Suggest well-known, practical categories: fitness gear, creator tools, home office gadgets, kitchen tools, wellness items, travel accessories, or books.
-- Avoid novelty, joke, or fantasy products.
-- Keep the output short and simple, just the product or category name.
-
-Examples: "Adjustable dumbbells", "Noise-canceling headphones", "A standing desk mat", "Ring light kit", "Video editing software".
-Only output the product suggestion, nothing else.
-"""
-    try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0.5,
-        )
-        return response.choices[0].message.content.strip()
-    except Exception as e:
-        print(f"[⚠️ Wild Card Error] {e}", flush=True)
-        return None
-
 def get_countdown_text(remaining):
     simple_map = {
         4: "4 messages until a product recommendation.",
@@ -63,6 +47,7 @@ def get_roast_message(entry_count):
         3: "Getting closer. Try switching topics entirely — we’ll still stitch context together.",
         4: "Now go back to your earlier theme. See how we carry continuity across separate threads?",
         5: "Finally. After all this waiting, here comes our most questionable feature: a product recommendation. Don’t expect genius.",
+        "pending": "Finally. Our most questionable feature is still thinking: your product recommendation lands with your next entry.",
     }
     return roast_map.get(entry_count, "")
 
@@ -74,6 +59,16 @@ def handle_message():
     print("✅ REQUEST RECEIVED", flush=True)
     data = request.json
 
+    # ⏱️ Per-request latency budget; stages that would overrun fall back to local heuristics
+    budget_ms = data.get("latency_budget_ms")
+    # 💾 One unit of work for the whole request: ingestion, routing and the response build share
+    # a session (on the user's shard), writes land in one commit, and the connection is released even on errors
+    with user_shard(data.get("user_id", "anonymous")), \
+            request_deadline(float(budget_ms) / 1000.0 if budget_ms else None) as deadline, \
+            unit_of_work() as uow:
+        return _handle_message(data, deadline, uow)
+
+def _handle_message(data, deadline, uow):
     user_id = data.get("user_id", "anonymous")
     message = data.get("message", "")
     tags = data.get("tags", [])
@@ -98,21 +93,37 @@ def handle_message():
     debug_log.update(debug_meta)
     classified_topic = debug_meta.get("classified_topic", "unknown")
 
-    session = SessionLocal()
+    session = uow.session
+
+    # 🗂️ Counts and profile come from the user's working set (kept current by ingestion)
+    ws = working_set.get(user_id, session)
 
     # 🔍 Count total reflections by this user (global, across all threads)
-    user_entry_count = (
-        session.query(func.count(MemoryEvent.id))
-        .filter_by(user_id=user_id)
-        .scalar()
-    )
+    user_entry_count = ws.event_count
     debug_log["user_entry_count"] = user_entry_count
 
+    # 🎁 Kick off the wild card refresh now so it overlaps with the summary calls below
+    structured_last_five = []
+    if user_entry_count >= 5:
+        # Last 5 entries as structured Topic/Subtopics/Emotion (for product recs only)
+        recent_events = (
+            session.query(MemoryEvent.topic, MemoryEvent.subtopics, MemoryEvent.sentiment)
+            .filter_by(user_id=user_id)
+            .order_by(MemoryEvent.timestamp.desc())
+            .limit(5)
+            .all()
+        )
+        structured_last_five = [
+            f"Topic: {ev.topic} | Subtopics: {ev.subtopics or 'N/A'} | Emotion: {ev.sentiment}"
+            for ev in reversed(recent_events)
+        ]
+        wild_card_cache.prefetch(user_id, structured_last_five, classified_topic)
+
     # 🔍 Get all messages in this thread (for summarization/context continuity)
     thread_events = []
     if message.strip():
         thread_events = (
-            session.query(MemoryEvent)
+            session.query(MemoryEvent.message_text)
             .filter_by(user_id=user_id, thread_id=thread_id)
             .order_by(MemoryEvent.timestamp.asc())
             .all()
@@ -120,14 +131,14 @@ def handle_message():
         debug_log["thread_memory_hits"] = len(thread_events)
 
     # Collect raw messages for summarization
-    past_memories = [e.message_text for e in thread_events if e.message_text]
+    past_memories = [text for (text,) in thread_events if text]
 
     # 🧠 Topic-matched fallback messages
     topic_matched_messages = []
     if classified_topic and message.strip():
         recent_cutoff = datetime.utcnow() - timedelta(days=30)
         topic_entries = (
-            session.query(MemoryEvent)
+            session.query(MemoryEvent.message_text)
             .filter(MemoryEvent.user_id == user_id)
             .filter(MemoryEvent.topic == classified_topic)
             .filter(MemoryEvent.thread_id != thread_id)
@@ -150,15 +161,17 @@ def handle_message():
         extra_results = [m[0] for m in global_mem if m[0] not in past_memories]
         past_memories += extra_results
         debug_log["additional_past_memories"] = len(extra_results)
+        debug_log["memory_retrievers"] = sorted({m[1]["retriever"] for m in global_mem})
 
     # 🧠 Resolved thread summaries
-    resolved_history = (
-        session.query(MemoryEvent)
+    resolved_history = ContextEntry.all(
+        ContextEntry.query(session)
         .filter_by(user_id=user_id, topic=classified_topic, resolved=True)
         .order_by(MemoryEvent.timestamp.desc())
         .limit(10)
-        .all()
     )
+    uow.release()  # don't hold a pooled connection through the summary calls below
+
     threads = defaultdict(list)
     for m in resolved_history:
         threads[m.thread_id].append(
@@ -166,7 +179,7 @@ def handle_message():
         )
     threadwise_summaries = []
     for tid, entries in threads.items():
-        summary = summarize_memories(entries, user_id)
+        summary = summarize_memories(entries, user_id, priority=OPTIONAL)
         threadwise_summaries.append(f"[Thread {tid}]\n{summary['reflection_summary']}")
     if threadwise_summaries:
         past_memories += threadwise_summaries
@@ -180,23 +193,11 @@ def handle_message():
     roast_message = get_roast_message(user_entry_count)
 
     if user_entry_count >= 5:
-        # Last 5 entries as structured Topic/Subtopics/Emotion (for product recs only)
-        recent_events = (
-            session.query(MemoryEvent)
-            .filter_by(user_id=user_id)
-            .order_by(MemoryEvent.timestamp.desc())
-            .limit(5)
-            .all()
+        wild_card, debug_log["wild_card_cache"] = wild_card_cache.get_wild_card(
+            user_id, structured_last_five, classified_topic
         )
-        structured_last_five = []
-        for ev in reversed(recent_events):
-            if not ev:
-                continue
-            structured_last_five.append(
-                f"Topic: {ev.topic} | Subtopics: {ev.subtopics or 'N/A'} | Emotion: {ev.sentiment}"
-            )
-
-        wild_card = generate_wild_card(structured_last_five, classified_topic) or ""
+        if debug_log["wild_card_cache"] == "pending" and user_entry_count == 5:
+            roast_message = get_roast_message("pending")
         print(f"🎁 Product recommendation triggered (global entries={user_entry_count})", flush=True)
     else:
         remaining = 5 - user_entry_count
@@ -211,13 +212,8 @@ def handle_message():
         behavioral_insight = ""
         topic_freq = []
     else:
-        profile = session.query(UserProfile).filter_by(user_id=user_id).first()
-        topic_counts = (
-            session.query(MemoryEvent.topic, func.count(MemoryEvent.topic))
-            .filter_by(user_id=user_id)
-            .group_by(MemoryEvent.topic)
-            .all()
-        )
+        profile = ws.profile
+        topic_counts = ws.topic_histogram()
         topic_freq = [t for t, c in topic_counts if t and t != "unknown"]
 
         behavioral_insight = ""
@@ -226,25 +222,23 @@ def handle_message():
             if top_count >= 3:
                 behavioral_insight = (
                     f"Your reflections often return to **{top_topic}**, especially in recent sessions. "
-                    f"Overall, your tone has leaned **{profile.dominant_emotion}**, with a steady presence of this theme across threads."
+                    f"Overall, your tone has leaned **{profile['dominant_emotion']}**, with a steady presence of this theme across threads."
                 )
             else:
                 behavioral_insight = (
                     f"You're exploring a variety of topics right now. "
-                    f"Emotionally, your reflections feel mostly **{profile.dominant_emotion}**, with no single dominant pattern yet."
+                    f"Emotionally, your reflections feel mostly **{profile['dominant_emotion']}**, with no single dominant pattern yet."
                 )
 
         user_profile = {
-            "dominant_emotion": profile.dominant_emotion,
-            "active_topic_streak": profile.active_topic_streak,
-            "repetition_count": profile.repetition_count,
-            "most_common_topic": profile.most_common_topic,
-            "total_threads": profile.total_threads,
-            "unresolved_threads": profile.unresolved_threads
+            "dominant_emotion": profile["dominant_emotion"],
+            "active_topic_streak": profile["active_topic_streak"],
+            "repetition_count": profile["repetition_count"],
+            "most_common_topic": profile["most_common_topic"],
+            "total_threads": profile["total_threads"],
+            "unresolved_threads": profile["unresolved_threads"]
         } if profile else {}
 
-    session.close()
-
     context = {
         "user_id": user_id,
         "thread_id": thread_id,
@@ -257,7 +251,8 @@ def handle_message():
         "topic_list": topic_freq,
         "behavioral_insight": behavioral_insight,
         "wild_card": wild_card,
-        "roast_message": roast_message
+        "roast_message": roast_message,
+        "degraded_stages": deadline.degraded
     }
 
     if debug_mode:
@@ -267,9 +262,10 @@ def handle_message():
 
 @app.route("/profile/<user_id>", methods=["GET"])
 def get_user_profile(user_id):
-    session = SessionLocal()
-    profile = session.query(UserProfile).filter_by(user_id=user_id).first()
-    session.close()
+    with user_shard(user_id):
+        session = ReadSessionLocal()
+        profile = session.query(UserProfile).filter_by(user_id=user_id).first()
+        session.close()
 
     if not profile:
         return jsonify({"error": "User profile not found"}), 404
@@ -285,6 +281,71 @@ def get_user_profile(user_id):
         "repetition_count": profile.repetition_count
     })
 
+# ---------------------------
+# History (keyset-paginated; pass `next_cursor` back as ?cursor= for the next page)
+# ---------------------------
+def _paged(fetch, **kwargs):
+    try:
+        return jsonify(fetch(limit=request.args.get("limit"), cursor=request.args.get("cursor"), **kwargs))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+def _parse_time(name):
+    value = request.args.get(name)
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"'{name}' must be an ISO 8601 timestamp")
+
+@app.route("/users/<user_id>/threads", methods=["GET"])
+def list_user_threads(user_id):
+    return _paged(history.list_threads, user_id=user_id)
+
+@app.route("/users/<user_id>/threads/<thread_id>/messages", methods=["GET"])
+def list_user_thread_messages(user_id, thread_id):
+    return _paged(history.list_thread_messages, user_id=user_id, thread_id=thread_id)
+
+@app.route("/users/<user_id>/events", methods=["GET"])
+def list_user_events(user_id):
+    try:
+        since, until = _parse_time("since"), _parse_time("until")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return _paged(history.list_events, user_id=user_id, topic=request.args.get("topic"), since=since, until=until)
+
+# ---------------------------
+# Deletion (vectors stop matching at once; their space is reclaimed by background compaction)
+# ---------------------------
+@app.route("/users/<user_id>", methods=["DELETE"])
+def delete_user(user_id):
+    return jsonify(deletion.delete_user(user_id))
+
+@app.route("/users/<user_id>/threads/<thread_id>", methods=["DELETE"])
+def delete_user_thread(user_id, thread_id):
+    result = deletion.delete_thread(user_id, thread_id)
+    if not result["events"]:
+        return jsonify({"error": "Thread not found"}), 404
+    return jsonify(result)
+
+@app.route("/users/<user_id>/events/<int:event_id>", methods=["DELETE"])
+def delete_user_event(user_id, event_id):
+    result = deletion.delete_event(user_id, event_id)
+    if not result["events"]:
+        return jsonify({"error": "Event not found"}), 404
+    return jsonify(result)
+
+@app.route("/stats", methods=["GET"])
+def get_stats():
+    from .topic_classifier import classifier_stats
+    from .rate_limiter import limiter_stats
+    return jsonify({
+        "topic_classifier": classifier_stats(),
+        "rate_limits": limiter_stats(),
+        "working_set": working_set.working_set_stats()
+    })
+
 @app.route("/ping")
 def ping():
     return "Flask is alive on port 5050!"
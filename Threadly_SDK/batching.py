@@ -0,0 +1,83 @@
+# batching.py
+#
+# Micro-batching for concurrent /message requests.
+# The first caller to arrive becomes the batch leader: it waits up to the batching window for
+# other requests' items, then runs one upstream call for all of them (e.g. a multi-input
+# embeddings call) and hands each caller its own result. A caller alone in the window pays at
+# most the window in extra latency; a burst of callers shares one round trip.
+# Items only share a batch with items submitted under the same `group` (classification passes
+# the user id, so one prompt never mixes two users' messages). Each batch runs in its first
+# caller's context under the tightest latency budget among its callers.
+
+import os
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+from .deadline import current_deadline, use_deadline
+
+BATCH_WINDOW_MS = float(os.getenv("THREADLY_BATCH_WINDOW_MS", "5"))  # 0 disables batching
+
+_overflow = ThreadPoolExecutor(max_workers=4, thread_name_prefix="batch-overflow")
+
+
+class MicroBatcher:
+    def __init__(self, batch_fn, max_batch: int = 16, window_ms: float = None, name: str = "batch"):
+        """`batch_fn(items) -> results` must return one result per item, in order."""
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.window = (BATCH_WINDOW_MS if window_ms is None else window_ms) / 1000.0
+        self.name = name
+        self._queues = {}     # group → [(item, future, caller context, caller deadline)]
+        self._leaders = set()  # groups with a leader collecting a batch
+        self._cond = threading.Condition()
+        self.stats = {"calls": 0, "items": 0}
+
+    def submit(self, item, group=None):
+        if self.window <= 0:
+            return self._run_direct([item])[0]
+
+        future = Future()
+        with self._cond:
+            queue = self._queues.setdefault(group, [])
+            queue.append((item, future, contextvars.copy_context(), current_deadline()))
+            lead = group not in self._leaders
+            self._leaders.add(group)
+            self._cond.notify_all()
+
+        if lead:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._queues[group]) >= self.max_batch, timeout=self.window)
+                queue = self._queues.pop(group)
+                self._leaders.discard(group)
+            batch, leftover = queue[:self.max_batch], queue[self.max_batch:]
+            self._run(batch)
+            # More arrived than one call takes: send the rest without holding up this caller
+            for i in range(0, len(leftover), self.max_batch):
+                _overflow.submit(self._run, leftover[i:i + self.max_batch])
+
+        return future.result()
+
+    def _run_direct(self, items):
+        self.stats["calls"] += 1
+        self.stats["items"] += len(items)
+        return self.batch_fn(items)
+
+    def _run(self, batch):
+        # The first caller's context (shard, etc.), but no caller waits past its own budget
+        deadlines = [deadline for *_, deadline in batch if deadline is not None]
+        tightest = min(deadlines, key=lambda d: d.expires_at, default=None)
+        batch[0][2].run(self._run_with_deadline, batch, tightest)
+
+    def _run_with_deadline(self, batch, deadline):
+        items = [item for item, *_ in batch]
+        try:
+            with use_deadline(deadline):
+                results = self._run_direct(items)
+            if len(results) != len(items):
+                raise RuntimeError(f"{self.name}: batch returned {len(results)} results for {len(items)} items")
+        except Exception as e:
+            for _, future, *_ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, *_), result in zip(batch, results):
+            future.set_result(result)
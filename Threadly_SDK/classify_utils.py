@@ -1,37 +1,93 @@
-import os
 import json
-from openai import OpenAI
+from .clients import chat_completion, CHAT_TIMEOUT
+from .rate_limiter import CRITICAL
+from .deadline import run_stage, call_timeout
+from .fallbacks import keyword_topic, lexicon_sentiment
+from .topic_classifier import local_topic_guess, take_local_answer, local_classification, record_llm_topic
+from .batching import MicroBatcher
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+SENTIMENT_MODEL = "gpt-4o-mini"
+TOPIC_MODEL = "gpt-4"
+MAX_CLASSIFY_BATCH = 8
 
-def classify_sentiment(message_text):
-    prompt = f"""
+def _complete(model, prompt, temperature):
+    res = chat_completion(
+        model=model,
+        messages=[{"role": "system", "content": prompt}],
+        temperature=temperature,
+        priority=CRITICAL,
+        timeout=call_timeout(CHAT_TIMEOUT)
+    )
+    return res.choices[0].message.content.strip()
+
+def _numbered(messages):
+    # A message can't close its own quotes and spill into the next one's
+    return "\n".join(f'{i}. """{m.replace(chr(34) * 3, chr(34))}"""' for i, m in enumerate(messages, 1))
+
+def _labelled(parsed, count, field):
+    """The batch answer's objects if it has `count` of them, each with a non-empty `field`; else None."""
+    if not isinstance(parsed, list) or len(parsed) != count:
+        return None
+    if not all(isinstance(p, dict) and isinstance(p.get(field), str) and p[field].strip() for p in parsed):
+        return None
+    return parsed
+
+# ---------------------------
+# Sentiment
+# ---------------------------
+def _sentiment_prompt(message_text):
+    return f"""
 You are an emotion detection system. Given the message below, classify the dominant customer emotion in ONE WORD (e.g., neutral, frustrated, angry, confused, happy, grateful).
 
 Message: "{message_text}"
 
 Respond in JSON with a single field:
 {{"sentiment": "..."}}.
+"""
+
+def _classify_sentiments(messages):
+    """One chat call for the user's messages that arrived in the same batching window."""
+    if len(messages) == 1:
+        parsed = json.loads(_complete(SENTIMENT_MODEL, _sentiment_prompt(messages[0]), 0.2))
+        return [parsed.get("sentiment", "neutral").lower()]
+
+    prompt = f"""
+You are an emotion detection system. For EACH message below, classify the dominant customer emotion in ONE WORD (e.g., neutral, frustrated, angry, confused, happy, grateful).
+
+Messages:
+{_numbered(messages)}
+
+Respond only with a JSON array of exactly {len(messages)} objects, one per message and in the same order:
+[{{"sentiment": "..."}}]
 """
     try:
-        res = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0.2
-        )
-        text = res.choices[0].message.content.strip()
-        sentiment = json.loads(text).get("sentiment", "neutral")
-        return sentiment.lower()
+        parsed = _labelled(json.loads(_complete(SENTIMENT_MODEL, prompt, 0.2)), len(messages), "sentiment")
+        if parsed is not None:
+            return [p["sentiment"].lower() for p in parsed]
+    except ValueError:
+        pass
+    # Malformed batch answer: fall back to one call per message rather than failing them all
+    return [_classify_sentiments([m])[0] for m in messages]
+
+_sentiment_batcher = MicroBatcher(_classify_sentiments, max_batch=MAX_CLASSIFY_BATCH, name="classify_sentiment")
+
+def classify_sentiment(message_text, user_id=None):
+    def call_model():
+        if user_id is None:
+            return _classify_sentiments([message_text])[0]
+        return _sentiment_batcher.submit(message_text, group=user_id)
+
+    try:
+        return run_stage("classify_sentiment", call_model, lambda: lexicon_sentiment(message_text))
     except Exception as e:
         print(f"[⚠️ Sentiment Error] {e}")
         return "neutral"
 
-def classify_topic(message_text, past_topic_nuances=None):
-    past_summary = ""
-    if past_topic_nuances:
-        past_summary = "\n".join(f"- {item}" for item in past_topic_nuances[:3])
-
-    prompt = f"""
+# ---------------------------
+# Topic
+# ---------------------------
+def _topic_prompt(message_text, past_summary=""):
+    return f"""
 You are an assistant that tags journal entries with topic, nuance, and subtopics.
 
 Message:
@@ -54,20 +110,78 @@ Respond only in this JSON format:
   "subtopics": ["...", "..."],
   "reference_past_issue": true
 }}
+"""
+
+def _parse_topic(parsed):
+    return {
+        "topic": parsed.get("topic", "unknown").lower(),
+        "topic_nuance": parsed.get("topic_nuance", ""),
+        "subtopics": parsed.get("subtopics", []),
+        "reference_past_issue": parsed.get("reference_past_issue", False),
+        "source": "llm"
+    }
+
+def _classify_topics(messages):
+    """One chat call for the user's messages that arrived in the same batching window."""
+    if len(messages) == 1:
+        return [_parse_topic(json.loads(_complete(TOPIC_MODEL, _topic_prompt(messages[0]), 0.3)))]
+
+    prompt = f"""
+You are an assistant that tags journal entries with topic, nuance, and subtopics.
+Tag each message below on its own.
+
+Messages:
+{_numbered(messages)}
+
+Instructions, for EACH message:
+- Extract the most likely primary topic (e.g., sleep, work, relationships, fitness).
+- Add a 'topic_nuance' that captures what’s specific about this message.
+- Extract 2–3 short subtopics (e.g., “caffeine”, “late nights”, “mood swings”) as a list.
+- Decide whether the message references a past issue (true/false).
+
+Respond only with a JSON array of exactly {len(messages)} objects, one per message and in the same order:
+[
+  {{"topic": "...", "topic_nuance": "...", "subtopics": ["...", "..."], "reference_past_issue": true}}
+]
 """
     try:
-        res = client.chat.completions.create(
-            model="gpt-4",
-            messages=[{"role": "system", "content": prompt}],
-            temperature=0.3
-        )
-        parsed = json.loads(res.choices[0].message.content.strip())
-        return {
-            "topic": parsed.get("topic", "unknown").lower(),
-            "topic_nuance": parsed.get("topic_nuance", ""),
-            "subtopics": parsed.get("subtopics", []),
-            "reference_past_issue": parsed.get("reference_past_issue", False)
-        }
+        parsed = _labelled(json.loads(_complete(TOPIC_MODEL, prompt, 0.3)), len(messages), "topic")
+        if parsed is not None:
+            return [_parse_topic(p) for p in parsed]
+    except ValueError:
+        pass
+    # Malformed batch answer: fall back to one call per message rather than failing them all
+    return [_classify_topics([m])[0] for m in messages]
+
+_topic_batcher = MicroBatcher(_classify_topics, max_batch=MAX_CLASSIFY_BATCH, name="classify_topic")
+
+def classify_topic(message_text, past_topic_nuances=None, user_id=None):
+    # 🎯 Confidently-classified messages are answered from local topic centroids, no chat call
+    guess = local_topic_guess(message_text)
+    if take_local_answer(guess):
+        return local_classification(message_text, guess["topic"], guess)
+
+    def call_model():
+        if past_topic_nuances:
+            # Per-message context can't share a batched prompt
+            past_summary = "\n".join(f"- {item}" for item in past_topic_nuances[:3])
+            return _parse_topic(json.loads(_complete(TOPIC_MODEL, _topic_prompt(message_text, past_summary), 0.3)))
+        if user_id is None:
+            return _classify_topics([message_text])[0]
+        # Only the same user's messages share a prompt
+        return _topic_batcher.submit(message_text, group=user_id)
+
+    def fallback():
+        # Over budget: a low-confidence centroid guess still beats keywords
+        if guess and guess["topic"]:
+            return local_classification(message_text, guess["topic"], guess)
+        return {**keyword_topic(message_text), "source": "keyword"}
+
+    try:
+        result = run_stage("classify_topic", call_model, fallback)
+        if result["source"] == "llm":
+            record_llm_topic(guess, result["topic"])
+        return result
     except Exception as e:
         print(f"[⚠️ Topic Error] {e}")
         return {
@@ -0,0 +1,141 @@
+# clients.py
+#
+# One shared, lazily built client per upstream service. Nothing here runs at import time:
+# the .env file is read and the client constructed on the first call.
+#
+# Every model call goes through chat_completion() / create_embeddings(), which apply one policy:
+# a pooled keep-alive transport (HTTP/2 when `h2` is installed), per-call timeouts,
+# retries with jittered exponential backoff on transient errors, a cap on in-flight calls,
+# and the per-model rate/token budget from rate_limiter.py. Every attempt, retries included,
+# is charged its estimate up front; a success is settled against its reported usage, and an
+# attempt the model never ran (no free slot, a 429, a connection error, a 5xx) gets its tokens back.
+
+import os
+import threading
+from .rate_limiter import get_limiter, estimate_tokens, NORMAL, CRITICAL, DEFAULT_COMPLETION_TOKENS
+
+# ---------------------------
+# Transport + retry policy (override via env)
+# ---------------------------
+MAX_CONNECTIONS = int(os.getenv("THREADLY_OPENAI_MAX_CONNECTIONS", "20"))
+MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("THREADLY_OPENAI_MAX_KEEPALIVE", "10"))
+KEEPALIVE_EXPIRY = 30.0       # seconds an idle pooled connection stays warm
+CONNECT_TIMEOUT = 5.0
+CHAT_TIMEOUT = float(os.getenv("THREADLY_OPENAI_CHAT_TIMEOUT", "30"))
+EMBEDDING_TIMEOUT = float(os.getenv("THREADLY_OPENAI_EMBEDDING_TIMEOUT", "10"))
+MAX_ATTEMPTS = int(os.getenv("THREADLY_OPENAI_MAX_ATTEMPTS", "3"))
+BACKOFF_MIN = 0.5             # seconds; jittered exponential between these bounds
+BACKOFF_MAX = 8.0
+MAX_IN_FLIGHT = int(os.getenv("THREADLY_OPENAI_MAX_IN_FLIGHT", "16"))
+QUEUE_TIMEOUT = 10.0          # seconds to wait for a free slot before giving up
+
+_lock = threading.Lock()
+_openai_client = None
+_env_loaded = False
+_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT)
+
+def load_env():
+    global _env_loaded
+    if not _env_loaded:
+        from dotenv import load_dotenv
+        load_dotenv()
+        _env_loaded = True
+
+def _http2_available():
+    try:
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+def _build_http_client():
+    import httpx
+    from openai import DefaultHttpxClient
+    return DefaultHttpxClient(
+        http2=_http2_available(),
+        limits=httpx.Limits(
+            max_connections=MAX_CONNECTIONS,
+            max_keepalive_connections=MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(CHAT_TIMEOUT, connect=CONNECT_TIMEOUT),
+    )
+
+def get_openai_client():
+    global _openai_client
+    if _openai_client is None:
+        with _lock:
+            if _openai_client is None:
+                load_env()
+                from openai import OpenAI
+                _openai_client = OpenAI(
+                    api_key=os.getenv("OPENAI_API_KEY"),
+                    http_client=_build_http_client(),
+                    max_retries=0,  # retries are handled uniformly by _call_with_policy
+                )
+    return _openai_client
+
+# ---------------------------
+# Call policy
+# ---------------------------
+def _is_retryable(error):
+    import openai
+    return isinstance(error, (
+        openai.APIConnectionError,   # includes APITimeoutError
+        openai.RateLimitError,
+        openai.InternalServerError,
+    ))
+
+def _call_with_policy(fn, model, estimated_tokens, priority, **kwargs):
+    import openai
+    from tenacity import Retrying, retry_if_exception, stop_after_attempt, wait_random_exponential
+
+    limiter = get_limiter(model)
+
+    def attempt():
+        limiter.acquire(estimated_tokens, priority)  # raises RateLimitShed if this class must back off
+        if not _slots.acquire(timeout=QUEUE_TIMEOUT):
+            limiter.refund(estimated_tokens, request=True)  # never sent
+            raise TimeoutError(f"More than {MAX_IN_FLIGHT} model calls in flight for {QUEUE_TIMEOUT}s")
+        try:
+            response = fn(model=model, **kwargs)
+        except openai.RateLimitError:
+            limiter.penalize()
+            limiter.refund(estimated_tokens)
+            raise
+        except (openai.APIConnectionError, openai.InternalServerError) as e:
+            # A timed-out call may have been generating; anything else never reached the model
+            if not isinstance(e, openai.APITimeoutError):
+                limiter.refund(estimated_tokens)
+            raise
+        finally:
+            _slots.release()
+        usage = getattr(response, "usage", None)
+        limiter.settle(estimated_tokens, getattr(usage, "total_tokens", None) or estimated_tokens)
+        return response
+
+    retrying = Retrying(
+        wait=wait_random_exponential(multiplier=BACKOFF_MIN, max=BACKOFF_MAX),
+        stop=stop_after_attempt(MAX_ATTEMPTS),
+        retry=retry_if_exception(_is_retryable),
+        reraise=True,
+    )
+    return retrying(attempt)
+
+def chat_completion(model, messages, timeout=CHAT_TIMEOUT, priority=NORMAL, **kwargs):
+    client = get_openai_client()
+    estimated = estimate_tokens(
+        [m.get("content") for m in messages],
+        kwargs.get("max_tokens") or DEFAULT_COMPLETION_TOKENS
+    )
+    return _call_with_policy(
+        client.chat.completions.create, model, estimated, priority,
+        messages=messages, timeout=timeout, **kwargs
+    )
+
+def create_embeddings(inputs, model, timeout=EMBEDDING_TIMEOUT, priority=CRITICAL, **kwargs):
+    client = get_openai_client()
+    return _call_with_policy(
+        client.embeddings.create, model, estimate_tokens(inputs), priority,
+        input=inputs, timeout=timeout, **kwargs
+    )
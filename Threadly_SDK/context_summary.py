@@ -1,11 +1,6 @@
-import os
 import json
 import re
-from dotenv import load_dotenv
-from openai import OpenAI
-
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from .clients import chat_completion
 
 def build_context_summary(memory_summary, user_message):
     prompt_header = """
@@ -36,7 +31,7 @@ Field guidelines:
 
     memory_block = memory_summary.strip() or "No prior memory available."
 
-    response = client.chat.completions.create(
+    response = chat_completion(
         model="gpt-4o",
         temperature=0.5,
         messages=[
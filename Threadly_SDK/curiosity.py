@@ -1,10 +1,6 @@
-import os
-import json
-from openai import OpenAI
-from dotenv import load_dotenv
-
-load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+from .clients import chat_completion, CHAT_TIMEOUT
+from .deadline import call_timeout
+from .rate_limiter import OPTIONAL
 
 def generate_curiosity_prompt(message_text: str, past_topics: list[str] = []) -> str:
     """
@@ -35,10 +31,12 @@ If no good question can be asked, return a neutral check-in like:
 Respond only with a string. No JSON. No extra explanation.
 """
 
-    response = client.chat.completions.create(
+    response = chat_completion(
         model="gpt-4o-mini",
         messages=[{"role": "system", "content": prompt}],
         temperature=0.5,
+        priority=OPTIONAL,  # shed under pressure; the summarizer has a canned fallback
+        timeout=call_timeout(CHAT_TIMEOUT),
     )
 
     return response.choices[0].message.content.strip()
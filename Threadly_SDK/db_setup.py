@@ -1,13 +1,68 @@
 # db_setup.py
-from sqlalchemy import create_engine
+import os
+import threading
+import contextvars
+from contextlib import contextmanager
+from sqlalchemy import create_engine, event
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import sessionmaker, Session
 
 # SQLite for local dev; swap out with PostgreSQL or other URI as needed
 SQLALCHEMY_DATABASE_URL = "sqlite:///./memory_data.db"
+# Databases of shards 1..N-1 (see sharding.py); shard 0 is always the URL above
+SHARD_URL_TEMPLATE = os.getenv("THREADLY_SHARD_URL", "sqlite:///./memory_data.shard{n}.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+def _create_engine(url):
+    return create_engine(url, connect_args={"check_same_thread": False} if url.startswith("sqlite") else {})
+
+engine = _create_engine(SQLALCHEMY_DATABASE_URL)
 Base = declarative_base()
+
+# ---------------------------
+# 🗂️ Shards
+# ---------------------------
+
+_engines = {0: engine}
+_engines_lock = threading.Lock()
+_current_shard = contextvars.ContextVar("threadly_shard", default=0)
+
+def shard_url(shard):
+    return SQLALCHEMY_DATABASE_URL if shard == 0 else SHARD_URL_TEMPLATE.format(n=shard)
+
+def get_engine(shard=0):
+    """Engine for one shard's database, created on first use."""
+    bind = _engines.get(shard)
+    if bind is None:
+        with _engines_lock:
+            bind = _engines.get(shard)
+            if bind is None:
+                bind = _engines[shard] = _create_engine(shard_url(shard))
+    return bind
+
+def current_shard():
+    """Shard that new sessions open on: 0 unless inside use_shard (or sharding.user_shard)."""
+    return _current_shard.get()
+
+@contextmanager
+def use_shard(shard):
+    token = _current_shard.set(shard)
+    try:
+        yield shard
+    finally:
+        _current_shard.reset(token)
+
+class ShardSession(Session):
+    """Session on the given shard's database, or the current shard's if none is given."""
+    def __init__(self, bind=None, shard=None, **kw):
+        self.shard = current_shard() if shard is None else shard
+        super().__init__(bind=bind if bind is not None else get_engine(self.shard), **kw)
+
+SessionLocal = sessionmaker(class_=ShardSession, autocommit=False, autoflush=False)
+
+# 📖 Read-only sessions for hot read paths: no autoflush, nothing expired on close, and any
+# attempt to write raises. Pair with column-projected queries so no entities enter an identity map.
+ReadSessionLocal = sessionmaker(class_=ShardSession, autoflush=False, expire_on_commit=False)
+
+@event.listens_for(ReadSessionLocal, "before_flush")
+def _reject_writes(session, flush_context, instances):
+    raise RuntimeError("❌ Attempted to write through a read-only session.")
@@ -0,0 +1,133 @@
+# deadline.py
+#
+# Per-request latency budget. handle_message opens a budget; every model-backed stage asks
+# run_stage() whether its expected latency still fits. Stages that would overrun (or time out /
+# get shed mid-flight) switch to a cheap local fallback and are recorded as degraded, so the
+# response says exactly what was approximated and p99 stays bounded by the budget.
+
+import os
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+
+DEFAULT_BUDGET_SECONDS = float(os.getenv("THREADLY_LATENCY_BUDGET_MS", "12000")) / 1000.0
+MIN_CALL_TIMEOUT = 0.5  # never hand a model call less than this; degrade instead
+
+# Starting guesses for each stage's latency; replaced by an EWMA of observed timings
+EXPECTED_STAGE_SECONDS = {
+    "classify_topic": 2.5,
+    "classify_sentiment": 1.0,
+    "routing_embeddings": 1.0,
+    "memory_embedding": 1.0,
+    "summary": 5.0,
+    "curiosity": 1.5,
+    "wild_card": 2.5,
+}
+EWMA_ALPHA = 0.2
+
+_current = contextvars.ContextVar("threadly_deadline", default=None)
+_stats_lock = threading.Lock()
+_observed = dict(EXPECTED_STAGE_SECONDS)
+
+
+class Deadline:
+    def __init__(self, budget_seconds: float):
+        self.budget = budget_seconds
+        self.expires_at = time.monotonic() + budget_seconds
+        self.degraded = []
+
+    def remaining(self) -> float:
+        return self.expires_at - time.monotonic()
+
+    def degrade(self, stage: str, reason: str):
+        self.degraded.append({"stage": stage, "reason": reason})
+        print(f"[⏱️ Degraded] {stage}: {reason} ({self.remaining():.2f}s left of {self.budget:.1f}s)", flush=True)
+
+
+@contextmanager
+def request_deadline(budget_seconds: float = None):
+    deadline = Deadline(budget_seconds if budget_seconds is not None else DEFAULT_BUDGET_SECONDS)
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+@contextmanager
+def use_deadline(deadline):
+    """Run under an existing budget (e.g. another request's), or none when `deadline` is None."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        _current.reset(token)
+
+def current_deadline():
+    return _current.get()
+
+def expected_latency(stage: str) -> float:
+    return _observed.get(stage, 1.0)
+
+def observe(stage: str, seconds: float):
+    with _stats_lock:
+        previous = _observed.get(stage, seconds)
+        _observed[stage] = (1 - EWMA_ALPHA) * previous + EWMA_ALPHA * seconds
+
+def _relax(stage: str):
+    # A skipped stage produces no new timing, so drift its estimate back toward the baseline;
+    # otherwise one latency spike would keep the stage degraded forever
+    with _stats_lock:
+        baseline = EXPECTED_STAGE_SECONDS.get(stage, 1.0)
+        _observed[stage] = _observed.get(stage, baseline) + EWMA_ALPHA * (baseline - _observed.get(stage, baseline))
+
+def stage_fits(stage: str) -> bool:
+    """True when there's no active budget or the stage's expected latency still fits in it."""
+    deadline = _current.get()
+    return deadline is None or deadline.remaining() - expected_latency(stage) >= 0
+
+def call_timeout(default: float) -> float:
+    # Cap a model call's timeout at what's left of the request budget
+    deadline = _current.get()
+    if deadline is None:
+        return default
+    return max(MIN_CALL_TIMEOUT, min(default, deadline.remaining()))
+
+def record_degraded(stage: str, reason: str):
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.degrade(stage, reason)
+
+def _is_overrun(error) -> bool:
+    from .rate_limiter import RateLimitShed
+    if isinstance(error, (TimeoutError, RateLimitShed)):
+        return True
+    try:
+        import openai
+        return isinstance(error, openai.APITimeoutError)
+    except ImportError:
+        return False
+
+def run_stage(stage: str, primary, fallback):
+    """
+    Run `primary()` if it fits the current budget, else `fallback()`.
+    Timeouts and shed calls also fall back; other errors propagate to the caller's own handling.
+    """
+    deadline = _current.get()
+    if deadline is not None and not stage_fits(stage):
+        deadline.degrade(stage, f"expected {expected_latency(stage):.1f}s exceeds budget")
+        _relax(stage)
+        return fallback()
+
+    started = time.monotonic()
+    try:
+        result = primary()
+    except Exception as e:
+        if deadline is None or not _is_overrun(e):
+            raise
+        observe(stage, time.monotonic() - started)
+        deadline.degrade(stage, type(e).__name__)
+        return fallback()
+
+    observe(stage, time.monotonic() - started)
+    return result
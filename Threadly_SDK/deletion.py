@@ -0,0 +1,120 @@
+# deletion.py
+#
+# Deleting a user's, a thread's or a single message's data.
+# Everything goes in one transaction — the events, their ingest-log entries and fingerprints,
+# thread centroid and activity state and the vectors' id-map rows — so searches stop returning a deleted
+# vector the moment the delete commits. The vector bytes stay in their segment files as dead
+# rows until compaction rewrites the segment; a compaction pass is queued after every delete.
+
+from collections import defaultdict
+from sqlalchemy import func
+from .models import (
+    MemoryEvent, UserProfile, IngestLogEntry, ThreadCentroid, ThreadCentroidMember, MessageFingerprint
+)
+from .embedding_utils import (
+    get_memory_store, get_thread_signature_store, remove_from_thread_signature, timestamp
+)
+from .unit_of_work import unit_of_work
+from .sharding import user_scoped
+from . import jobs
+from . import working_set
+from . import thread_activity
+
+def _chunks(values, size=500):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def _drop_vectors(session, user_id, by_thread):
+    """
+    Remove the vectors of the given events ({thread_id: [event_id, ...]}) in the caller's
+    transaction. Threads with no other events lose their signature; threads that go on have
+    the events taken back out of their centroid. Returns (vectors deleted, emptied threads).
+    """
+    memory_store, signature_store = get_memory_store(), get_thread_signature_store()
+    emptied, shrunk = set(), {}
+    for tid, ids in by_thread.items():
+        remaining = (
+            session.query(func.count(MemoryEvent.id))
+            .filter(MemoryEvent.user_id == user_id, MemoryEvent.thread_id == tid)
+            .filter(MemoryEvent.id.notin_(ids))
+            .scalar()
+        )
+        if remaining:
+            shrunk[tid] = ids
+        else:
+            emptied.add(tid)
+
+    if shrunk:
+        vectors = memory_store.get_many([eid for ids in shrunk.values() for eid in ids])
+        for tid, ids in shrunk.items():
+            remove_from_thread_signature(session, tid, ids, [vectors.get(i) for i in ids])
+
+    deleted = memory_store.delete(keys=[eid for ids in by_thread.values() for eid in ids], session=session)
+    for tid in emptied:
+        deleted += signature_store.delete(user_id=user_id, thread_id=tid, session=session)
+    for chunk in _chunks(emptied):
+        session.query(ThreadCentroidMember).filter(ThreadCentroidMember.thread_id.in_(chunk)).delete(synchronize_session=False)
+        session.query(ThreadCentroid).filter(ThreadCentroid.thread_id.in_(chunk)).delete(synchronize_session=False)
+    return deleted, emptied
+
+def _delete(user_id, thread_id=None, event_id=None):
+    with unit_of_work() as uow:
+        session = uow.session
+        query = session.query(MemoryEvent.id, MemoryEvent.thread_id).filter(MemoryEvent.user_id == user_id)
+        if thread_id is not None:
+            query = query.filter(MemoryEvent.thread_id == thread_id)
+        if event_id is not None:
+            query = query.filter(MemoryEvent.id == event_id)
+        by_thread = defaultdict(list)
+        for eid, tid in query:
+            by_thread[tid].append(eid)
+        event_ids = [eid for ids in by_thread.values() for eid in ids]
+
+        vectors_deleted, emptied = _drop_vectors(session, user_id, by_thread)
+        for chunk in _chunks(event_ids):
+            session.query(IngestLogEntry).filter(IngestLogEntry.event_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(MessageFingerprint).filter(MessageFingerprint.event_id.in_(chunk)).delete(synchronize_session=False)
+            session.query(MemoryEvent).filter(MemoryEvent.id.in_(chunk)).delete(synchronize_session=False)
+        thread_activity.refresh(session, by_thread)
+        if thread_id is None and event_id is None:
+            session.query(UserProfile).filter_by(user_id=user_id).delete(synchronize_session=False)
+
+        uow.on_commit(working_set.invalidate, user_id)
+        if vectors_deleted:
+            jobs.enqueue("compact_vector_stores")
+
+    print(f"[{timestamp()}] 🗑️ Deleted {len(event_ids)} events and {vectors_deleted} vectors "
+          f"(user={user_id} thread={thread_id} event={event_id})", flush=True)
+    return {"events": len(event_ids), "threads": len(emptied), "vectors": vectors_deleted}
+
+def discard_orphaned(user_id, thread_id, event_id):
+    """
+    Undo vector writes that landed after their event was deleted (a background write racing
+    the delete), so a reused event id can never inherit them.
+    """
+    with unit_of_work() as uow:
+        _drop_vectors(uow.session, user_id, {thread_id: [event_id]})
+
+@user_scoped
+def delete_user(user_id):
+    """Delete everything stored for a user."""
+    return _delete(user_id)
+
+@user_scoped
+def delete_thread(user_id, thread_id):
+    return _delete(user_id, thread_id=thread_id)
+
+@user_scoped
+def delete_event(user_id, event_id):
+    return _delete(user_id, event_id=event_id)
+
+@jobs.handler("compact_vector_stores")
+def compact_vector_stores():
+    """Rewrite vector segments that deletes have left mostly dead, and quantize old ones."""
+    for store in (get_memory_store(), get_thread_signature_store()):
+        summary = store.compact()
+        if summary.get("segments"):
+            print(f"[{timestamp()}] 🧹 Compacted {store.name} segments {summary['segments']} "
+                  f"({len(summary.get('quantized', []))} quantized): "
+                  f"{summary['moved']} rows kept, {summary['reclaimed']} reclaimed", flush=True)
@@ -1,108 +1,379 @@
 import os
-import faiss
+import threading
+import time
 import numpy as np
-from dotenv import load_dotenv
-from openai import OpenAI
+from collections import OrderedDict, defaultdict
 from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from .db_setup import SessionLocal, current_shard
+from .unit_of_work import read_scope
+from .records import EventMetadata
+from .models import MemoryEvent, VectorRow, ThreadCentroid, ThreadCentroidMember
+from .init_db import init_db
+from .vector_store import MmapVectorStore, VECTOR_STORAGE, VECTOR_STORE_DIR, shard_directory
+from .index_service import RemoteVectorStore, INDEX_SERVICE_URL, remote_store_name
+from .clients import create_embeddings
+from .batching import MicroBatcher
+from .lexical_index import lexical_available, search_lexical
+from .deadline import run_stage
+from .sharding import shard_numbers, user_scoped
 
-# Load environment variables
-load_dotenv()
-api_key = os.getenv("OPENAI_API_KEY")
-
-client = OpenAI(api_key=api_key)
 EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536  # text-embedding-3-small's native size; init_faiss(dim=...) requests shorter vectors
+
+# Recent text → embedding cache: one message is embedded for classification, routing and storage
+EMBEDDING_CACHE_SIZE = 2048
+_embedding_cache = OrderedDict()
+_embedding_cache_lock = threading.Lock()
 
-# Vector index and memory store
-memory_index = None
-memory_data = []
+# Message-level vector store (keyed by MemoryEvent.id); attached lazily on first use.
+# Each shard has its own pair of stores (see sharding.py); get_memory_store() and
+# get_thread_signature_store() return the current shard's. The module globals are shard 0's.
+memory_store = None
+_stores = {}              # shard → (memory store, thread signature store)
+_stores_lock = threading.Lock()
+_store_storage = VECTOR_STORAGE
 
-# Thread-level signature store
-thread_signature_index = None
-thread_signature_data = []
+# search_memory: "hybrid" fuses vector and keyword (FTS5 BM25) hits with reciprocal rank fusion
+MEMORY_RETRIEVERS = ("hybrid", "vector", "lexical")
+MEMORY_RETRIEVER = os.getenv("THREADLY_MEMORY_RETRIEVER", "hybrid")
+RRF_K = 60  # the usual RRF damping constant; larger flattens the gap between top ranks
+
+# Thread-level signature store: one running centroid per thread, keyed by the MemoryEvent.id
+# that created it. SIGNATURE_DECAY < 1 weighs recent messages more (each newer message scales
+# the older ones' weight by it); 1.0 is the plain mean.
+SIGNATURE_DECAY = float(os.getenv("THREADLY_SIGNATURE_DECAY", "1.0"))
+thread_signature_store = None
 
 def normalize_vector(vec):
     vec = np.array(vec, dtype='float32')
     return vec / np.linalg.norm(vec)
 
+def _embed_batch(texts):
+    kwargs = {"dimensions": EMBEDDING_DIM} if EMBEDDING_DIM != 1536 else {}
+    response = create_embeddings(list(texts), EMBEDDING_MODEL, **kwargs)
+    return [d.embedding for d in sorted(response.data, key=lambda d: d.index)]
+
+_embedding_batcher = MicroBatcher(_embed_batch, max_batch=64, name="embeddings")
+
 def get_embedding(text):
     text = (text or "").strip()
     if not text:
         raise ValueError("❌ Cannot embed empty input.")
 
-    response = client.embeddings.create(
-        input=[text],
-        model=EMBEDDING_MODEL
+    cache_key = (EMBEDDING_DIM, text)
+    with _embedding_cache_lock:
+        if cache_key in _embedding_cache:
+            _embedding_cache.move_to_end(cache_key)
+            return _embedding_cache[cache_key]
+
+    # Concurrent requests' texts share one multi-input embeddings call
+    embedding = _embedding_batcher.submit(text)
+
+    with _embedding_cache_lock:
+        _embedding_cache[cache_key] = embedding
+        if len(_embedding_cache) > EMBEDDING_CACHE_SIZE:
+            _embedding_cache.popitem(last=False)
+    return embedding
+
+def cached_embedding(text):
+    """The embedding for `text` if it's already cached; never calls the API."""
+    with _embedding_cache_lock:
+        return _embedding_cache.get((EMBEDDING_DIM, (text or "").strip()))
+
+def init_faiss(dim=1536, storage=VECTOR_STORAGE, reset=False):
+    """
+    Attach to the shared on-disk vector stores (kept under the historical name).
+    Stores persist across restarts and are shared by every worker; pass reset=True to wipe them.
+    dim < 1536 asks the embedding API for shortened vectors; storage="float16"/"int8" keeps
+    compressed codes in memory and re-ranks the final top-k against exact vectors.
+    With THREADLY_INDEX_SERVICE_URL set, adds/searches go through the shared index service and
+    fall back to these in-process stores whenever it is unreachable.
+    """
+    global memory_store, thread_signature_store, EMBEDDING_DIM, _store_storage
+    init_db()
+    with _stores_lock:
+        EMBEDDING_DIM, _store_storage = dim, storage
+        _stores.clear()
+        for shard in shard_numbers():
+            _stores[shard] = _attach_stores(shard, reset)
+        memory_store, thread_signature_store = _stores[0]
+    if INDEX_SERVICE_URL:
+        print(f"[{timestamp()}] 🛰️ Using shared index service at {INDEX_SERVICE_URL}")
+    if reset:
+        print(f"[{timestamp()}] 🧹 Vector stores re-initialized.")
+    else:
+        print(f"[{timestamp()}] 🗂️ Vector stores attached at {VECTOR_STORE_DIR} "
+              f"(dim={dim}, storage={storage}, shards={len(_stores)})")
+
+def _attach_stores(shard, reset=False):
+    stores = tuple(
+        MmapVectorStore(name, dim=EMBEDDING_DIM, directory=shard_directory(shard), storage=_store_storage,
+                        reset=reset, shard=shard)
+        for name in ("memory", "thread_signature")
     )
-    return response.data[0].embedding
+    if INDEX_SERVICE_URL:
+        stores = tuple(
+            RemoteVectorStore(INDEX_SERVICE_URL, remote_store_name(store.name, shard), fallback=store)
+            for store in stores
+        )
+    return stores
+
+def _ensure_stores():
+    if memory_store is None:
+        init_faiss(dim=EMBEDDING_DIM)
+
+def _shard_stores():
+    _ensure_stores()
+    shard = current_shard()
+    stores = _stores.get(shard)
+    if stores is None:
+        # A shard added (by a rebalance) after the stores were attached
+        init_db([shard])
+        with _stores_lock:
+            stores = _stores.get(shard)
+            if stores is None:
+                stores = _stores[shard] = _attach_stores(shard)
+    return stores
 
-def init_faiss(dim=1536):
-    global memory_index, memory_data, thread_signature_index, thread_signature_data
-    memory_index = faiss.IndexFlatL2(dim)
-    memory_data = []
-    thread_signature_index = faiss.IndexFlatL2(dim)
-    thread_signature_data = []
-    print(f"[{timestamp()}] 🧹 FAISS indexes re-initialized.")
+def get_memory_store():
+    return _shard_stores()[0]
+
+def get_thread_signature_store():
+    return _shard_stores()[1]
+
+def _event_metadata(event):
+    return {
+        "event_id": event.id,
+        "user_id": event.user_id,
+        "thread_id": event.thread_id,
+        "topic": event.topic,
+        "topic_nuance": event.topic_nuance,
+        "subtopics": [s for s in (event.subtopics or "").split(",") if s],
+        "tags": [t for t in (event.tags or "").split(",") if t],
+        "emotion": event.sentiment,
+        "goal_label": event.goal_label or ""
+    }
 
 def add_to_memory(text, metadata):
+    event_id = metadata.get("event_id")
+    if event_id is None:
+        raise ValueError("❌ add_to_memory needs metadata['event_id'] (the MemoryEvent.id).")
+
     embedding = get_embedding(text)
-    vector = np.array([normalize_vector(embedding)], dtype='float32')
-    memory_index.add(vector)
-    memory_data.append((text, metadata, vector))
+    get_memory_store().add(event_id, normalize_vector(embedding), metadata.get("user_id"), metadata.get("thread_id"))
     print(f"[{timestamp()}] 🧠 Added to vector memory: {text[:50]}... | user_id={metadata.get('user_id')}")
-    print(f"[{timestamp()}] 🧠 Current vector memory count: {len(memory_data)}")
 
-def search_memory(query_text, top_k=5, user_id=None, thread_id=None):
-    query_vector = get_embedding(query_text)
-    query_vector = normalize_vector(query_vector).reshape(1, -1)
+def _vector_hits(query_text, limit, user_id, thread_id):
+    query_vector = normalize_vector(get_embedding(query_text))
+    return get_memory_store().search(query_vector, top_k=limit, user_id=user_id, thread_id=thread_id)
+
+@user_scoped
+def search_memory(query_text, top_k=5, user_id=None, thread_id=None, retriever=None):
+    """
+    Past messages relevant to `query_text`, as (text, metadata, vector) tuples, best first.
+    retriever="hybrid" (THREADLY_MEMORY_RETRIEVER's default) fuses vector and BM25 keyword hits
+    by reciprocal rank; "vector" / "lexical" use one alone. When the request's latency budget
+    can't afford the embedding call, the keyword index answers by itself. Each hit's metadata
+    names the retriever that found it ("vector", "lexical" or "hybrid" for both).
+    Searches `user_id`'s shard; without a user, the current shard.
+    """
+    retriever = retriever or MEMORY_RETRIEVER
+    if retriever not in MEMORY_RETRIEVERS:
+        raise ValueError(f"❌ Unknown retriever '{retriever}' (expected one of {MEMORY_RETRIEVERS}).")
+    limit = top_k * 3
+    use_lexical = retriever != "vector" and lexical_available()
 
-    D, I = memory_index.search(query_vector, top_k * 3)
+    vector_hits = []
+    if retriever == "vector" or not use_lexical:
+        vector_hits = _vector_hits(query_text, limit, user_id, thread_id)
+    elif retriever == "hybrid":
+        # ⏱️ Keywords alone when the embedding call doesn't fit the budget (run_stage records it)
+        vector_hits = run_stage(
+            "memory_embedding",
+            lambda: _vector_hits(query_text, limit, user_id, thread_id),
+            lambda: [],
+        )
+    lexical_ids = []
+    if use_lexical:
+        with read_scope() as session:
+            lexical_ids = search_lexical(session, query_text, limit, user_id=user_id, thread_id=thread_id)
+
+    # Reciprocal rank fusion: rank-based, so cosine and BM25 scores never need calibrating
+    fused, found, vectors = defaultdict(float), defaultdict(set), {}
+    for source, keys in (("vector", [key for key, _, _ in vector_hits]), ("lexical", lexical_ids)):
+        for rank, key in enumerate(keys):
+            fused[key] += 1.0 / (RRF_K + rank + 1)
+            found[key].add(source)
+    for key, _, vector in vector_hits:
+        vectors[key] = vector
+    ranked = sorted(fused, key=lambda key: -fused[key])
+    missing = [key for key in ranked if key not in vectors]
+    if missing:
+        vectors.update(get_memory_store().get_many(missing))
+
+    with read_scope() as session:
+        events = {
+            e.id: e for e in EventMetadata.all(
+                EventMetadata.query(session).filter(MemoryEvent.id.in_(ranked))
+            )
+        } if ranked else {}
     results = []
     seen_texts = set()
 
-    for i in I[0]:
-        if i < 0 or i >= len(memory_data):
+    for key in ranked:
+        event = events.get(key)
+        if not event or not event.message_text:
             continue
-        text, metadata, vector = memory_data[i]
-        if (user_id is None or metadata.get("user_id") == user_id) and \
-           (thread_id is None or metadata.get("thread_id") == thread_id):
-            if text not in seen_texts:
-                results.append((text, metadata, vector))
-                seen_texts.add(text)
+        if event.message_text not in seen_texts:
+            metadata = _event_metadata(event)
+            metadata["retriever"] = "hybrid" if len(found[key]) > 1 else next(iter(found[key]))
+            vector = vectors.get(key)
+            results.append((event.message_text, metadata, vector.reshape(1, -1) if vector is not None else None))
+            seen_texts.add(event.message_text)
 
         if len(results) >= top_k:
             break
 
-    print(f"[{timestamp()}] 🔍 Vector search returned {len(results)} hits for user={user_id} thread={thread_id}")
+    answered = "+".join(s for s, hits in (("vector", vector_hits), ("lexical", lexical_ids)) if hits) or "none"
+    print(f"[{timestamp()}] 🔍 Memory search ({answered}) returned {len(results)} hits for user={user_id} thread={thread_id}")
     return results
 
 # ------------------------------
 # THREAD SIGNATURE FUNCTIONS
 # ------------------------------
 
-def add_thread_signature(thread_id, user_id, text):
-    embedding = get_embedding(text)
-    vector = np.array([normalize_vector(embedding)], dtype='float32')
-    thread_signature_index.add(vector)
-    thread_signature_data.append((thread_id, user_id, vector))
-    print(f"[{timestamp()}] 🧷 Thread signature added for {thread_id} (user: {user_id})")
-
-def search_thread_signatures(text, user_id, top_k=5):
-    query_vector = normalize_vector(get_embedding(text)).reshape(1, -1)
-    D, I = thread_signature_index.search(query_vector, top_k)
-    results = []
+def add_thread_signature(thread_id, user_id, text, event_id=None):
+    """
+    Fold message `event_id` into its thread's signature, a running centroid of the thread's
+    message vectors: O(d) per message, replaced in place in the signature store.
+    Returns the new (normalized) signature, or None if the event was already folded in.
+    """
+    if event_id is None:
+        raise ValueError("❌ add_thread_signature needs the event_id of the message.")
+    signature_store = get_thread_signature_store()
 
-    for i in I[0]:
-        if i < 0 or i >= len(thread_signature_data):
-            continue
-        tid, uid, vector = thread_signature_data[i]
-        if uid == user_id:
-            results.append((tid, vector))
+    session = SessionLocal()
+    try:
+        if session.query(ThreadCentroidMember.event_id).filter_by(event_id=event_id).first():
+            return None
+        vector = normalize_vector(get_embedding(text))  # the slow part, done before taking the lock
+
+        # Inserting the member takes SQLite's write lock, so updates to a thread's centroid
+        # serialize from here to the commit — and the commit lands the member, the centroid row
+        # and (for a new thread) the signature's row together
+        session.add(ThreadCentroidMember(event_id=event_id, thread_id=thread_id))
+        session.flush()
+
+        centroid = session.query(ThreadCentroid).filter_by(thread_id=thread_id).first()
+        if centroid is None:
+            # Threads signed before centroids existed start from their first-message signature
+            legacy = (
+                session.query(VectorRow.event_id)
+                .filter_by(store="thread_signature", thread_id=thread_id)
+                .order_by(VectorRow.id)
+                .first()
+            )
+            centroid = ThreadCentroid(
+                thread_id=thread_id,
+                user_id=user_id,
+                event_id=legacy.event_id if legacy else event_id,
+                message_count=1 if legacy else 0,
+                magnitude=1.0 if legacy else 0.0,
+            )
+            session.add(centroid)
+
+        if centroid.message_count == 0:
+            signature_store.add_many([(event_id, vector, user_id, thread_id)], session=session)
+            signature, magnitude = vector, 1.0
+        else:
+            current = signature_store.get(centroid.event_id)
+            total = vector if current is None else SIGNATURE_DECAY * centroid.magnitude * current + vector
+            magnitude = float(np.linalg.norm(total)) or 1.0
+            signature = total / magnitude
+            signature_store.replace(centroid.event_id, signature, session=session)
+
+        centroid.message_count += 1
+        centroid.magnitude = magnitude
+        centroid.updated_at = datetime.utcnow()
+        message_count = centroid.message_count
+        session.commit()
+    except IntegrityError:
+        session.rollback()  # folded in concurrently
+        return None
+    finally:
+        session.close()
+
+    print(f"[{timestamp()}] 🧷 Thread signature updated for {thread_id} "
+          f"(user: {user_id}, messages: {message_count})")
+    return signature
+
+def remove_from_thread_signature(session, thread_id, event_ids, vectors):
+    """
+    Take deleted messages back out of their thread's centroid, in the caller's transaction.
+    The plain mean (SIGNATURE_DECAY == 1) subtracts their vectors exactly; a decayed centroid
+    keeps its vector, as their weight in it fades with the thread's next messages anyway.
+    """
+    signature_store = get_thread_signature_store()
+    members = [
+        event_id for (event_id,) in session.query(ThreadCentroidMember.event_id)
+        .filter(ThreadCentroidMember.event_id.in_(list(event_ids)))
+    ]
+    centroid = session.query(ThreadCentroid).filter_by(thread_id=thread_id).first()
+    if centroid is None or not members:
+        return
+    session.query(ThreadCentroidMember).filter(
+        ThreadCentroidMember.event_id.in_(members)
+    ).delete(synchronize_session=False)
+
+    removed = [normalize_vector(v) for v, event_id in zip(vectors, event_ids) if event_id in members and v is not None]
+    current = signature_store.get(centroid.event_id)
+    if SIGNATURE_DECAY == 1.0 and removed and current is not None:
+        total = centroid.magnitude * current - np.sum(removed, axis=0)
+        magnitude = float(np.linalg.norm(total))
+        if magnitude > 1e-6:
+            signature_store.replace(centroid.event_id, total / magnitude, session=session)
+            centroid.magnitude = magnitude
+    centroid.message_count = max(centroid.message_count - len(members), 1)
+    centroid.updated_at = datetime.utcnow()
+
+def get_thread_signatures(user_id, thread_ids):
+    """Map of thread_id → signature vector for the given threads that have one."""
+    thread_ids = list(thread_ids)
+    if not thread_ids:
+        return {}
+    with read_scope() as session:
+        keys = dict(
+            session.query(VectorRow.event_id, VectorRow.thread_id)
+            .filter(VectorRow.store == "thread_signature", VectorRow.user_id == user_id)
+            .filter(VectorRow.thread_id.in_(thread_ids))
+        )
+    vectors = get_thread_signature_store().get_many(list(keys))
+    return {keys[key]: vec for key, vec in vectors.items() if vec is not None}
+
+def search_thread_signatures(text, user_id, top_k=5, max_age_days=None):
+    """
+    Threads whose signature best matches `text`. With `max_age_days`, only signature segments
+    written within that many days are searched (a signature is rewritten with every message).
+    """
+    query_vector = normalize_vector(get_embedding(text))
+    since = time.time() - max_age_days * 86400 if max_age_days else None
+    hits = get_thread_signature_store().search(query_vector, top_k=top_k, user_id=user_id, since=since)
+
+    with read_scope() as session:
+        thread_ids = dict(
+            session.query(VectorRow.event_id, VectorRow.thread_id)
+            .filter(VectorRow.store == "thread_signature", VectorRow.event_id.in_([key for key, _, _ in hits]))
+            .all()
+        ) if hits else {}
+
+    results = [(thread_ids[key], vector.reshape(1, -1)) for key, _, vector in hits if key in thread_ids]
 
     print(f"[{timestamp()}] 🔁 Thread signature match returned {len(results)} threads")
     return results
 
 def print_vector_count():
-    print(f"[{timestamp()}] 🧠 Message memory: {len(memory_data)} | Thread signatures: {len(thread_signature_data)}")
+    print(f"[{timestamp()}] 🧠 Message memory: {get_memory_store().count()} | Thread signatures: {get_thread_signature_store().count()}")
 
 def timestamp():
     return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
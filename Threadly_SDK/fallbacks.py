@@ -0,0 +1,89 @@
+# fallbacks.py
+#
+# Cheap local stand-ins for the model-backed stages. Used when a request's latency budget
+# can't afford the real call (see deadline.py). They return the same shapes as their
+# model-backed counterparts so callers don't need to special-case degraded results.
+
+import re
+from collections import Counter
+
+TOPIC_KEYWORDS = {
+    "sleep": ["sleep", "slept", "insomnia", "tired", "nap", "bed", "waking", "woke", "rest", "dream"],
+    "work": ["work", "job", "boss", "meeting", "deadline", "project", "office", "career", "coworker", "manager"],
+    "fitness": ["run", "running", "gym", "workout", "exercise", "training", "lift", "yoga", "stretch", "walk"],
+    "relationships": ["partner", "friend", "girlfriend", "boyfriend", "wife", "husband", "date", "relationship", "breakup"],
+    "family": ["mom", "dad", "mother", "father", "sister", "brother", "kids", "parents", "family", "son", "daughter"],
+    "health": ["sick", "doctor", "pain", "headache", "health", "medication", "anxiety", "therapy", "diet"],
+    "money": ["money", "budget", "rent", "debt", "salary", "savings", "spend", "bill", "pay", "buy"],
+    "technology": ["laptop", "phone", "computer", "gadget", "app", "software", "watch", "screen"],
+    "study": ["study", "exam", "class", "school", "course", "homework", "learning", "university"],
+    "food": ["eat", "ate", "food", "cook", "dinner", "lunch", "breakfast", "coffee", "caffeine", "sugar"],
+}
+
+EMOTION_LEXICON = {
+    "frustrated": ["frustrated", "annoyed", "stuck", "hard", "struggle", "ugh", "again", "can't"],
+    "angry": ["angry", "furious", "mad", "hate", "pissed", "unfair"],
+    "anxious": ["anxious", "worried", "nervous", "stress", "stressed", "overwhelmed", "panic", "afraid"],
+    "sad": ["sad", "down", "lonely", "depressed", "miss", "cry", "lost"],
+    "happy": ["happy", "great", "excited", "good", "love", "proud", "fun", "finally"],
+    "grateful": ["grateful", "thankful", "appreciate", "lucky", "blessed"],
+    "confused": ["confused", "unsure", "wonder", "debating", "don't know", "not sure", "?"],
+}
+
+PAST_REFERENCE = re.compile(r"\b(again|still|last time|as before|same as|ever since|keep|kept)\b", re.IGNORECASE)
+WORD = re.compile(r"[a-z']+")
+
+def _words(text):
+    return WORD.findall((text or "").lower())
+
+def first_clause(text, limit=80):
+    clause = re.split(r"[.!?\n]", (text or "").strip(), maxsplit=1)[0].strip()
+    return clause if len(clause) <= limit else clause[:limit].rsplit(" ", 1)[0] + "…"
+
+def keyword_topic(message_text):
+    """Lexicon topic tagger with the same output shape as classify_topic."""
+    words = _words(message_text)
+    scores = Counter()
+    matched = {}
+    for topic, keywords in TOPIC_KEYWORDS.items():
+        hits = [w for w in words if w in keywords]
+        if hits:
+            scores[topic] = len(hits)
+            matched[topic] = hits
+
+    topic = scores.most_common(1)[0][0] if scores else "unknown"
+    subtopics = list(dict.fromkeys(matched.get(topic, [])))[:3]
+    return {
+        "topic": topic,
+        "topic_nuance": first_clause(message_text),
+        "subtopics": subtopics,
+        "reference_past_issue": bool(PAST_REFERENCE.search(message_text or "")),
+    }
+
+def lexicon_sentiment(message_text):
+    text = (message_text or "").lower()
+    words = set(_words(text))
+    scores = Counter()
+    for emotion, cues in EMOTION_LEXICON.items():
+        scores[emotion] = sum(1 for cue in cues if (cue in text if " " in cue or cue == "?" else cue in words))
+    emotion, count = scores.most_common(1)[0]
+    return emotion if count else "neutral"
+
+def template_summary(processed_entries):
+    """Same keys as summarize_memories, built from the entries themselves."""
+    entries = [e for e in processed_entries if e]
+    latest = entries[-1] if entries else ""
+    topics = Counter(keyword_topic(e)["topic"] for e in entries)
+    topics.pop("unknown", None)
+    top_topic = topics.most_common(1)[0][0] if topics else None
+
+    return {
+        "theme": f"Mostly about {top_topic}." if top_topic else "Still forming.",
+        "reflection_summary": (
+            f"You've written {len(entries)} related entr{'y' if len(entries) == 1 else 'ies'}; "
+            f"the latest: “{first_clause(latest, 120)}”"
+        ),
+        "momentum": "You might be circling around something. Let’s keep watching.",
+        "change": "No major shift clearly stated yet — but maybe one is starting.",
+        "consider_next": "Want to say more about that?",
+    }
@@ -0,0 +1,169 @@
+# history.py
+#
+# Paginated reads of a user's journal history.
+# Pages are keyset-paginated: the cursor is the last row's sort key, and the next page is
+# "rows strictly after it", a row-value comparison on the same columns as a composite index
+# (user, timestamp, id) for events, and (user, last_activity, thread) on thread_activity for
+# threads. Each page is a range scan of that index, so page N costs the same as page 1 and
+# nothing is held in memory between pages (unlike OFFSET, which re-reads every skipped row).
+# Queries select only the columns the response needs, never full ORM entities.
+
+import json
+import base64
+from datetime import datetime
+from sqlalchemy import tuple_
+from .db_setup import ReadSessionLocal
+from .models import MemoryEvent, ThreadActivity
+from .sharding import user_scoped
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+EVENT_COLUMNS = (
+    MemoryEvent.id,
+    MemoryEvent.timestamp,
+    MemoryEvent.thread_id,
+    MemoryEvent.message_text,
+    MemoryEvent.topic,
+    MemoryEvent.topic_nuance,
+    MemoryEvent.subtopics,
+    MemoryEvent.sentiment,
+    MemoryEvent.resolved,
+)
+
+# ---------------------------
+# Cursors
+# ---------------------------
+def encode_cursor(ts, key):
+    if ts is None:
+        raise ValueError("Can't paginate past a row with no timestamp")
+    raw = json.dumps([ts.isoformat(), key]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    """Return (timestamp, key) from a cursor string; ValueError if it's malformed."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        ts, key = json.loads(raw)
+        return datetime.fromisoformat(ts), key
+    except Exception:
+        raise ValueError(f"Invalid cursor '{cursor}'")
+
+def page_size(limit):
+    if limit is None:
+        return DEFAULT_PAGE_SIZE
+    return max(1, min(int(limit), MAX_PAGE_SIZE))
+
+def _after(ts_col, key_col, cursor, descending):
+    # Keyset predicate: strictly past the cursor in (ts, key) order
+    ts, key = decode_cursor(cursor)
+    if descending:
+        return tuple_(ts_col, key_col) < tuple_(ts, key)
+    return tuple_(ts_col, key_col) > tuple_(ts, key)
+
+def _event_dict(row):
+    return {
+        "event_id": row.id,
+        "timestamp": row.timestamp.isoformat() if row.timestamp else None,
+        "thread_id": row.thread_id,
+        "message_text": row.message_text,
+        "topic": row.topic,
+        "topic_nuance": row.topic_nuance,
+        "subtopics": [s for s in (row.subtopics or "").split(",") if s],
+        "emotion": row.sentiment,
+        "resolved": bool(row.resolved),
+    }
+
+def _page(rows, limit, cursor_of):
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return rows, (cursor_of(rows[-1]) if has_more and rows else None)
+
+# ---------------------------
+# Listings
+# ---------------------------
+@user_scoped
+def list_threads(user_id, limit=None, cursor=None):
+    """A user's threads, most recently active first."""
+    limit = page_size(limit)
+    session = ReadSessionLocal()
+    try:
+        query = session.query(
+            ThreadActivity.thread_id,
+            ThreadActivity.started_at,
+            ThreadActivity.last_activity,
+            ThreadActivity.message_count,
+            ThreadActivity.last_event_id,
+        ).filter(ThreadActivity.user_id == user_id)
+        if cursor:
+            query = query.filter(_after(ThreadActivity.last_activity, ThreadActivity.thread_id, cursor, descending=True))
+        rows = (
+            query.order_by(ThreadActivity.last_activity.desc(), ThreadActivity.thread_id.desc())
+            .limit(limit + 1).all()
+        )
+        rows, next_cursor = _page(rows, limit, lambda r: encode_cursor(r.last_activity, r.thread_id))
+
+        # Topic/state of each thread comes from its latest event — one indexed lookup per page
+        latest = {
+            r.thread_id: r for r in session.query(
+                MemoryEvent.thread_id, MemoryEvent.topic, MemoryEvent.topic_nuance,
+                MemoryEvent.sentiment, MemoryEvent.resolved
+            ).filter(MemoryEvent.id.in_([r.last_event_id for r in rows]))
+        } if rows else {}
+    finally:
+        session.close()
+
+    items = []
+    for r in rows:
+        head = latest.get(r.thread_id)
+        items.append({
+            "thread_id": r.thread_id,
+            "started_at": r.started_at.isoformat() if r.started_at else None,
+            "last_activity": r.last_activity.isoformat() if r.last_activity else None,
+            "message_count": r.message_count,
+            "topic": head.topic if head else None,
+            "topic_nuance": head.topic_nuance if head else None,
+            "emotion": head.sentiment if head else None,
+            "resolved": bool(head.resolved) if head else False,
+        })
+    return {"items": items, "next_cursor": next_cursor}
+
+@user_scoped
+def list_thread_messages(user_id, thread_id, limit=None, cursor=None):
+    """Messages of one thread in chronological order."""
+    limit = page_size(limit)
+    session = ReadSessionLocal()
+    try:
+        query = session.query(*EVENT_COLUMNS).filter(
+            MemoryEvent.user_id == user_id, MemoryEvent.thread_id == thread_id
+        )
+        if cursor:
+            query = query.filter(_after(MemoryEvent.timestamp, MemoryEvent.id, cursor, descending=False))
+        rows = query.order_by(MemoryEvent.timestamp.asc(), MemoryEvent.id.asc()).limit(limit + 1).all()
+    finally:
+        session.close()
+
+    rows, next_cursor = _page(rows, limit, lambda r: encode_cursor(r.timestamp, r.id))
+    return {"items": [_event_dict(r) for r in rows], "next_cursor": next_cursor}
+
+@user_scoped
+def list_events(user_id, topic=None, since=None, until=None, limit=None, cursor=None):
+    """A user's events newest first, optionally filtered by topic and a [since, until) time range."""
+    limit = page_size(limit)
+    session = ReadSessionLocal()
+    try:
+        query = session.query(*EVENT_COLUMNS).filter(MemoryEvent.user_id == user_id)
+        if topic:
+            query = query.filter(MemoryEvent.topic == topic)
+        if since:
+            query = query.filter(MemoryEvent.timestamp >= since)
+        if until:
+            query = query.filter(MemoryEvent.timestamp < until)
+        if cursor:
+            query = query.filter(_after(MemoryEvent.timestamp, MemoryEvent.id, cursor, descending=True))
+        rows = query.order_by(MemoryEvent.timestamp.desc(), MemoryEvent.id.desc()).limit(limit + 1).all()
+    finally:
+        session.close()
+
+    rows, next_cursor = _page(rows, limit, lambda r: encode_cursor(r.timestamp, r.id))
+    return {"items": [_event_dict(r) for r in rows], "next_cursor": next_cursor}
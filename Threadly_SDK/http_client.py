@@ -0,0 +1,305 @@
+# http_client.py
+#
+# Client for the backend's HTTP API (app.py), for the Streamlit UI, scripted clients and load
+# generators. ThreadlyClient keeps one pooled keep-alive requests.Session; AsyncThreadlyClient
+# does the same over an httpx.AsyncClient. Both cap the requests in flight, retry with jittered
+# exponential backoff (waiting as long as a Retry-After header asks instead, when there is one),
+# and submit batches concurrently across users while keeping each user's messages in order, as
+# thread routing depends on it.
+# Reads and deletes are retried on connection errors, timeouts, 429s and 502-504s. A POST is only
+# retried when the backend can't have seen it: the connection was never made, or a proxy turned
+# it away with a 429/503. A read timeout or a 502/504 may come after the backend has already
+# classified, routed and stored the message, and resending would pay for all of that again.
+#
+#     with ThreadlyClient("http://localhost:5050") as client:
+#         context = client.send_message("user_1", "Slept badly again")
+#         results = client.send_many([{"user_id": "user_2", "message": "..."}, ...])
+
+import os
+import time
+import random
+import asyncio
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from urllib.parse import quote
+
+BACKEND_URL = os.getenv("THREADLY_BACKEND_URL", "http://localhost:5050")
+MAX_IN_FLIGHT = int(os.getenv("THREADLY_CLIENT_MAX_IN_FLIGHT", "8"))
+MAX_ATTEMPTS = int(os.getenv("THREADLY_CLIENT_MAX_ATTEMPTS", "4"))
+CONNECT_TIMEOUT = 5.0
+READ_TIMEOUT = float(os.getenv("THREADLY_CLIENT_TIMEOUT", "60"))  # /message makes several model calls
+BACKOFF_MIN = 0.5             # seconds; doubled per attempt, jittered, capped at BACKOFF_MAX
+BACKOFF_MAX = 16.0
+MAX_RETRY_AFTER = 60.0        # longest Retry-After honored before giving up on the request
+RETRY_STATUSES = frozenset({429, 502, 503, 504})
+UNSENT_STATUSES = frozenset({429, 503})  # rejected ahead of the backend; safe to resend a POST
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+
+class ThreadlyAPIError(Exception):
+    """The backend answered with an error status (after any retries)."""
+
+    def __init__(self, status, payload):
+        self.status = status
+        self.payload = payload
+        message = payload.get("error") if isinstance(payload, dict) else payload
+        super().__init__(f"❌ Threadly API returned {status}: {message}")
+
+
+# ---------------------------
+# Retry policy
+# ---------------------------
+def retry_after(headers):
+    """Seconds a Retry-After header asks to wait (delta-seconds or an HTTP date), or None."""
+    value = headers.get("Retry-After") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+def retry_delay(attempt, headers=None):
+    """Seconds to wait before retry number `attempt`; None if the server asked for too long."""
+    asked = retry_after(headers)
+    if asked is not None:
+        return asked if asked <= MAX_RETRY_AFTER else None
+    return min(BACKOFF_MAX, BACKOFF_MIN * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+
+def retry_status(method, status):
+    """Whether a `status` answer to `method` is worth sending the request again for."""
+    return status in (RETRY_STATUSES if method in IDEMPOTENT_METHODS else UNSENT_STATUSES)
+
+def _payload(response):
+    try:
+        return response.json()
+    except ValueError:
+        return response.text
+
+def _result(status, payload, pick):
+    if status >= 400:
+        raise ThreadlyAPIError(status, payload)
+    return payload.get(pick) if pick and isinstance(payload, dict) else payload
+
+def _params(params):
+    return {k: v for k, v in (params or {}).items() if v is not None} or None
+
+def _by_user(messages):
+    """Indices of `messages` grouped per user, each group in submission order."""
+    groups = defaultdict(list)
+    for i, message in enumerate(messages):
+        groups[message.get("user_id")].append(i)
+    return list(groups.values())
+
+# ---------------------------
+# Routes (shared by both clients; `_call` returns the value, or a coroutine for the async one)
+# ---------------------------
+class _Routes:
+    def _call(self, method, path, json=None, params=None, pick=None):
+        raise NotImplementedError
+
+    def send_message(self, user_id, message, **fields):
+        """POST /message; returns the response context. `fields`: tags, demo_mode, latency_budget_ms, ..."""
+        return self._call("POST", "/message", json={"user_id": user_id, "message": message, **fields}, pick="context")
+
+    def profile(self, user_id):
+        return self._call("GET", f"/profile/{quote(user_id, safe='')}")
+
+    def threads(self, user_id, limit=None, cursor=None):
+        return self._call("GET", f"/users/{quote(user_id, safe='')}/threads",
+                          params={"limit": limit, "cursor": cursor})
+
+    def thread_messages(self, user_id, thread_id, limit=None, cursor=None):
+        return self._call("GET", f"/users/{quote(user_id, safe='')}/threads/{quote(thread_id, safe='')}/messages",
+                          params={"limit": limit, "cursor": cursor})
+
+    def events(self, user_id, topic=None, since=None, until=None, limit=None, cursor=None):
+        return self._call("GET", f"/users/{quote(user_id, safe='')}/events", params={
+            "topic": topic,
+            "since": since.isoformat() if isinstance(since, datetime) else since,
+            "until": until.isoformat() if isinstance(until, datetime) else until,
+            "limit": limit,
+            "cursor": cursor,
+        })
+
+    def delete_user(self, user_id):
+        return self._call("DELETE", f"/users/{quote(user_id, safe='')}")
+
+    def delete_thread(self, user_id, thread_id):
+        return self._call("DELETE", f"/users/{quote(user_id, safe='')}/threads/{quote(thread_id, safe='')}")
+
+    def delete_event(self, user_id, event_id):
+        return self._call("DELETE", f"/users/{quote(user_id, safe='')}/events/{int(event_id)}")
+
+    def stats(self):
+        return self._call("GET", "/stats")
+
+    def health(self):
+        return self._call("GET", "/healthz")
+
+# ---------------------------
+# Blocking client
+# ---------------------------
+class ThreadlyClient(_Routes):
+    """Thread-safe; share one instance per process so every call reuses its pooled connections."""
+
+    def __init__(self, base_url=BACKEND_URL, max_in_flight=MAX_IN_FLIGHT, max_attempts=MAX_ATTEMPTS,
+                 timeout=READ_TIMEOUT):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.base_url = base_url.rstrip("/")
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.timeout = (CONNECT_TIMEOUT, timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight, max_retries=0)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._transient = (requests.ConnectionError, requests.Timeout)
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    def _unsent(self, error):
+        """True when the request can't have reached the server (the connection was never made)."""
+        import requests
+        from urllib3.exceptions import NewConnectionError
+
+        if isinstance(error, requests.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], "reason", None) if error.args else None
+        return isinstance(error, requests.ConnectionError) and isinstance(reason, NewConnectionError)
+
+    def _call(self, method, path, json=None, params=None, pick=None):
+        for attempt in range(1, self.max_attempts + 1):
+            response = None
+            with self._slots:
+                try:
+                    response = self.session.request(
+                        method, self.base_url + path, json=json, params=_params(params), timeout=self.timeout
+                    )
+                except self._transient as e:
+                    if attempt == self.max_attempts or not (method in IDEMPOTENT_METHODS or self._unsent(e)):
+                        raise
+            if response is not None and not retry_status(method, response.status_code):
+                return _result(response.status_code, _payload(response), pick)
+            delay = retry_delay(attempt, response.headers if response is not None else None)
+            if attempt == self.max_attempts or delay is None:
+                return _result(response.status_code, _payload(response), pick)
+            time.sleep(delay)
+
+    def _pool(self):
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_in_flight, thread_name_prefix="threadly-client")
+            return self._executor
+
+    def submit_message(self, user_id, message, **fields):
+        """send_message in the background; returns a Future of the context."""
+        return self._pool().submit(self.send_message, user_id, message, **fields)
+
+    def send_many(self, messages, return_exceptions=False):
+        """
+        Send `messages` (dicts of send_message's arguments) concurrently, up to max_in_flight at
+        a time, each user's in the given order. Returns their contexts in input order; with
+        `return_exceptions`, a failed message's slot holds its exception instead of raising.
+        """
+        messages = list(messages)
+        results = [None] * len(messages)
+
+        def send_in_order(indices):
+            for i in indices:
+                try:
+                    results[i] = self.send_message(**messages[i])
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results[i] = e
+
+        for future in [self._pool().submit(send_in_order, group) for group in _by_user(messages)]:
+            future.result()
+        return results
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# ---------------------------
+# Async client
+# ---------------------------
+class AsyncThreadlyClient(_Routes):
+    """asyncio counterpart of ThreadlyClient (needs httpx); every route method is a coroutine."""
+
+    def __init__(self, base_url=BACKEND_URL, max_in_flight=MAX_IN_FLIGHT, max_attempts=MAX_ATTEMPTS,
+                 timeout=READ_TIMEOUT):
+        import httpx
+
+        self.max_attempts = max_attempts
+        self.client = httpx.AsyncClient(
+            base_url=base_url.rstrip("/"),
+            timeout=httpx.Timeout(timeout, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=max_in_flight, max_keepalive_connections=max_in_flight),
+        )
+        self._transient = (httpx.TransportError,)
+        self._unsent = (httpx.ConnectError, httpx.ConnectTimeout)  # never reached the server
+        self._slots = asyncio.Semaphore(max_in_flight)
+
+    async def _call(self, method, path, json=None, params=None, pick=None):
+        for attempt in range(1, self.max_attempts + 1):
+            response = None
+            async with self._slots:
+                try:
+                    response = await self.client.request(method, path, json=json, params=_params(params))
+                except self._transient as e:
+                    if attempt == self.max_attempts or not (method in IDEMPOTENT_METHODS or isinstance(e, self._unsent)):
+                        raise
+            if response is not None and not retry_status(method, response.status_code):
+                return _result(response.status_code, _payload(response), pick)
+            delay = retry_delay(attempt, response.headers if response is not None else None)
+            if attempt == self.max_attempts or delay is None:
+                return _result(response.status_code, _payload(response), pick)
+            await asyncio.sleep(delay)
+
+    async def send_many(self, messages, return_exceptions=False):
+        """Async send_many: same ordering and result shape as ThreadlyClient.send_many."""
+        messages = list(messages)
+        results = [None] * len(messages)
+
+        async def send_in_order(indices):
+            for i in indices:
+                try:
+                    results[i] = await self.send_message(**messages[i])
+                except Exception as e:
+                    if not return_exceptions:
+                        raise
+                    results[i] = e
+
+        await asyncio.gather(*(send_in_order(group) for group in _by_user(messages)))
+        return results
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.aclose()
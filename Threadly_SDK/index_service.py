@@ -0,0 +1,291 @@
+# index_service.py
+#
+# A standalone local service that owns the vector stores so every Flask/gunicorn worker
+# routes against the same indexes. Run it next to the workers:
+#
+#     python -m Threadly_SDK.index_service --port 5060
+#
+# from the workers' working directory (it shares memory_data.db and THREADLY_VECTOR_DIR with them),
+# and point the workers at it with THREADLY_INDEX_SERVICE_URL=http://127.0.0.1:5060.
+# With several shards (see sharding.py) it serves every shard's stores, as "memory@2" etc.
+
+import os
+import json
+import base64
+import argparse
+import threading
+import http.client
+import numpy as np
+from datetime import datetime
+from urllib.parse import urlparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from .vector_store import VectorStore, MmapVectorStore, VECTOR_STORAGE, shard_directory
+from .init_db import init_db
+from .sharding import shard_numbers
+
+INDEX_SERVICE_URL = os.getenv("THREADLY_INDEX_SERVICE_URL", "")
+INDEX_SERVICE_TIMEOUT = 5.0  # seconds per call before falling back to in-process mode
+RETRY_REMOTE_AFTER = 30.0    # seconds to stay in fallback mode before trying the service again
+GET_MANY_CHUNK = 512         # keys per /get_many call (~3 MB of 1536-d vectors)
+STORE_NAMES = ("memory", "thread_signature")
+
+
+def timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# Vectors travel as base64 float32 — ~4x smaller and much faster to parse than JSON float lists
+def encode_vector(vec):
+    return base64.b64encode(np.asarray(vec, dtype="float32").tobytes()).decode("ascii")
+
+def decode_vector(data):
+    return np.frombuffer(base64.b64decode(data), dtype="float32")
+
+def remote_store_name(name, shard):
+    """What the service calls a shard's store; shard 0's keep their plain names."""
+    return name if shard == 0 else f"{name}@{shard}"
+
+
+# ---------------------------
+# Server
+# ---------------------------
+class IndexServiceHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive for the workers' pooled connections
+    stores = {}
+    store_options = {}
+    stores_lock = threading.Lock()
+
+    @classmethod
+    def open_store(cls, remote_name):
+        """The store called `remote_name`, attaching a shard's stores on first use (after a rebalance)."""
+        store = cls.stores.get(remote_name)
+        if store is not None or not isinstance(remote_name, str):
+            return store
+        name, _, shard = remote_name.partition("@")
+        if name not in STORE_NAMES or not shard.isdigit():
+            return None
+        with cls.stores_lock:
+            if remote_name not in cls.stores:
+                init_db([int(shard)])
+                cls.stores[remote_name] = MmapVectorStore(
+                    name, directory=shard_directory(int(shard)), shard=int(shard), **cls.store_options
+                )
+            return cls.stores[remote_name]
+
+    def log_message(self, format, *args):
+        pass
+
+    def _reply(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            self._reply(200, {"ok": True, "stores": {n: s.count() for n, s in self.stores.items()}})
+        else:
+            self._reply(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            data = json.loads(self.rfile.read(length) or b"{}")
+            store = self.open_store(data.get("store"))
+            if store is None:
+                return self._reply(404, {"error": f"unknown store {data.get('store')!r}"})
+
+            if self.path == "/add":
+                store.add_many([
+                    (item["key"], decode_vector(item["vector"]), item.get("user_id"), item.get("thread_id"))
+                    for item in data["items"]
+                ])
+                return self._reply(200, {"added": len(data["items"])})
+
+            if self.path == "/search":
+                results = store.search_many([
+                    {
+                        "vector": decode_vector(q["vector"]),
+                        "top_k": q.get("top_k", 5),
+                        "user_id": q.get("user_id"),
+                        "thread_id": q.get("thread_id"),
+                        "since": q.get("since"),
+                    }
+                    for q in data["queries"]
+                ])
+                return self._reply(200, {"results": [
+                    [{"key": key, "score": score, "vector": encode_vector(vec)} for key, score, vec in hits]
+                    for hits in results
+                ]})
+
+            if self.path == "/get":
+                vec = store.get(data["key"])
+                return self._reply(200, {"vector": encode_vector(vec) if vec is not None else None})
+
+            if self.path == "/get_many":
+                vectors = store.get_many(data["keys"])
+                return self._reply(200, {"vectors": [
+                    {"key": key, "vector": encode_vector(vec)} for key, vec in vectors.items()
+                ]})
+
+            if self.path == "/replace":
+                store.replace(data["key"], decode_vector(data["vector"]))
+                return self._reply(200, {"replaced": True})
+
+            if self.path == "/count":
+                return self._reply(200, {"count": store.count()})
+
+            if self.path == "/reset":
+                store.reset()
+                return self._reply(200, {"reset": True})
+
+            self._reply(404, {"error": "not found"})
+        except Exception as e:
+            print(f"[{timestamp()}] ⚠️ Index service error on {self.path}: {e}", flush=True)
+            self._reply(500, {"error": str(e)[:200]})
+
+
+def serve(host="127.0.0.1", port=5060, dim=1536, storage=VECTOR_STORAGE):
+    init_db()
+    IndexServiceHandler.store_options = {"dim": dim, "storage": storage}
+    IndexServiceHandler.stores = {
+        remote_store_name(name, shard): MmapVectorStore(
+            name, dim=dim, storage=storage, directory=shard_directory(shard), shard=shard
+        )
+        for shard in shard_numbers() for name in STORE_NAMES
+    }
+    server = ThreadingHTTPServer((host, port), IndexServiceHandler)
+    print(f"[{timestamp()}] 🛰️ Index service listening on http://{host}:{port} (dim={dim}, storage={storage})", flush=True)
+    server.serve_forever()
+
+
+# ---------------------------
+# Client
+# ---------------------------
+class RemoteVectorStore(VectorStore):
+    """
+    VectorStore that forwards to the shared index service.
+    If the service is unreachable it transparently uses `fallback` (an in-process store over the
+    same directory) and retries the service after RETRY_REMOTE_AFTER seconds.
+    """
+
+    def __init__(self, url: str, name: str, fallback: VectorStore, timeout: float = INDEX_SERVICE_TIMEOUT):
+        parsed = urlparse(url)
+        self.host = parsed.hostname
+        self.port = parsed.port or 80
+        self.name = name
+        self.fallback = fallback
+        self.timeout = timeout
+        self._local = threading.local()
+        self._down_until = 0.0
+
+    def _connection(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _call(self, path, payload):
+        now = datetime.now().timestamp()
+        if now < self._down_until:
+            return None
+
+        body = json.dumps({"store": self.name, **payload})
+        error = None
+        for _ in range(2):  # a pooled connection may have been closed server-side; retry once fresh
+            try:
+                conn = self._connection()
+                conn.request("POST", path, body=body, headers={"Content-Type": "application/json"})
+                response = conn.getresponse()
+                data = json.loads(response.read())
+                if response.status != 200:
+                    raise RuntimeError(data.get("error", response.status))
+                return data
+            except (OSError, http.client.HTTPException, RuntimeError, ValueError) as e:
+                self._local.conn = None
+                error = e
+
+        self._down_until = now + RETRY_REMOTE_AFTER
+        print(f"[{timestamp()}] ⚠️ Index service unavailable ({error}); using in-process store '{self.name}'", flush=True)
+        return None
+
+    def add(self, key, vector, user_id, thread_id):
+        self.add_many([(key, vector, user_id, thread_id)])
+
+    def add_many(self, items, session=None):
+        if session is not None:
+            # The service commits on its own connection; a caller's transaction can't span it,
+            # so write the shared files directly (as the fallback does)
+            return self.fallback.add_many(items, session=session)
+        data = self._call("/add", {"items": [
+            {"key": key, "vector": encode_vector(vec), "user_id": user_id, "thread_id": thread_id}
+            for key, vec, user_id, thread_id in items
+        ]})
+        if data is None:
+            self.fallback.add_many(items)
+
+    def search(self, vector, top_k=5, user_id=None, thread_id=None, since=None):
+        return self.search_many([{"vector": vector, "top_k": top_k, "user_id": user_id, "thread_id": thread_id, "since": since}])[0]
+
+    def search_many(self, queries):
+        data = self._call("/search", {"queries": [
+            {**q, "vector": encode_vector(q["vector"])} for q in queries
+        ]})
+        if data is None:
+            return self.fallback.search_many(queries)
+        return [
+            [(hit["key"], hit["score"], decode_vector(hit["vector"])) for hit in hits]
+            for hits in data["results"]
+        ]
+
+    def get(self, key):
+        data = self._call("/get", {"key": key})
+        if data is None:
+            return self.fallback.get(key)
+        return decode_vector(data["vector"]) if data["vector"] else None
+
+    def get_many(self, keys):
+        keys = list(keys)
+        vectors = {}
+        for i in range(0, len(keys), GET_MANY_CHUNK):
+            chunk = keys[i:i + GET_MANY_CHUNK]
+            data = self._call("/get_many", {"keys": chunk})
+            if data is None:
+                vectors.update(self.fallback.get_many(chunk))
+            else:
+                vectors.update((item["key"], decode_vector(item["vector"])) for item in data["vectors"])
+        return vectors
+
+    def replace(self, key, vector, session=None):
+        if session is not None:
+            # Relocating the row repoints it in the caller's transaction, as add_many(session=) does
+            return self.fallback.replace(key, vector, session=session)
+        if self._call("/replace", {"key": key, "vector": encode_vector(vector)}) is None:
+            self.fallback.replace(key, vector)
+
+    def delete(self, keys=None, user_id=None, thread_id=None, session=None):
+        # Deleting only touches the shared id map, so there's nothing for the service to do
+        return self.fallback.delete(keys=keys, user_id=user_id, thread_id=thread_id, session=session)
+
+    def compact(self):
+        return self.fallback.compact()
+
+    def count(self):
+        data = self._call("/count", {})
+        return self.fallback.count() if data is None else data["count"]
+
+    def reset(self):
+        if self._call("/reset", {}) is None:
+            self.fallback.reset()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared Threadly vector index service")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5060)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--storage", default=VECTOR_STORAGE)
+    args = parser.parse_args()
+    serve(args.host, args.port, args.dim, args.storage)
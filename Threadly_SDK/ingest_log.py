@@ -0,0 +1,182 @@
+# ingest_log.py
+#
+# Write-ahead log that keeps the DB and the vector stores consistent.
+# ingest_message appends one entry per vector write it owes (the message embedding, and its fold
+# into the thread's signature centroid) in the same transaction as the MemoryEvent row, so there
+# is never an event the log doesn't know about. Applying an entry is idempotent: if the store
+# already has the entry's event (a memory row, or a centroid member), nothing happens.
+# Each store keeps a watermark file next to its matrix files: the highest sequence number at or
+# below which every entry is applied. Recovery scans only the log past the watermark and embeds
+# exactly the events the store is missing — never the whole corpus.
+# Passing a seq assumes every lower one has committed. SQLite serializes writers, so it has; on
+# a database with concurrent writers a lower seq may still be in flight, so the watermark stops
+# at a gap in the log until the entry after it is LOG_GAP_GRACE_SECONDS old (gaps also come from
+# rolled-back transactions and deleted users, which never fill).
+# Every shard has its own log, stores and watermarks; entries apply on the shard they were logged on.
+
+import uuid
+import threading
+from datetime import datetime, timedelta
+from .db_setup import SessionLocal, current_shard, use_shard, get_engine
+from .models import IngestLogEntry, MemoryEvent, VectorRow, ThreadCentroidMember
+from .vector_store import read_watermark, write_watermark, shard_directory
+from .embedding_utils import add_to_memory, add_thread_signature, _event_metadata, timestamp
+from . import jobs
+from . import working_set
+from .deletion import discard_orphaned
+from .sharding import shard_numbers
+
+STORES = ("memory", "thread_signature")
+CHECKPOINT_EVERY = 500   # applied entries between background watermark advances
+LOG_GAP_GRACE_SECONDS = 300  # longest an ingest transaction may hold an uncommitted seq
+
+_BOOT_ID = uuid.uuid4().hex[:12]
+_lock = threading.Lock()
+_in_flight = set()       # (shard, seq) pairs being applied in this process
+_applied_since_checkpoint = 0
+_recovery_scheduled = False
+
+def append(session, store, event):
+    """Log a pending write of `event` to `store`. Call before the event's transaction commits."""
+    entry = IngestLogEntry(store=store, event_id=event.id, user_id=event.user_id, thread_id=event.thread_id)
+    session.add(entry)
+    return entry
+
+def _applied_events(session, store, event_ids):
+    applied = set()
+    event_ids = list(event_ids)
+    for i in range(0, len(event_ids), 500):
+        chunk = event_ids[i:i + 500]
+        applied.update(
+            event_id for (event_id,) in session.query(VectorRow.event_id)
+            .filter(VectorRow.store == store, VectorRow.event_id.in_(chunk))
+        )
+        if store == "thread_signature":
+            applied.update(
+                event_id for (event_id,) in session.query(ThreadCentroidMember.event_id)
+                .filter(ThreadCentroidMember.event_id.in_(chunk))
+            )
+    return applied
+
+@jobs.handler("apply_ingest_log")
+def apply(seq):
+    """
+    Perform the vector write for log entry `seq`, unless its store already has it.
+    Returns False only when another thread in this process is applying the same entry.
+    """
+    global _applied_since_checkpoint
+    claim = (current_shard(), seq)
+    with _lock:
+        if claim in _in_flight:
+            return False
+        _in_flight.add(claim)
+    wrote = False
+    try:
+        session = SessionLocal()
+        try:
+            entry = session.query(IngestLogEntry).filter_by(seq=seq).first()
+            if entry is None or _applied_events(session, entry.store, [entry.event_id]):
+                return True
+            event = session.query(MemoryEvent).filter_by(id=entry.event_id).first()
+            if event is None or not event.message_text:
+                return True
+            store, text, metadata = entry.store, event.message_text, _event_metadata(event)
+        finally:
+            session.close()
+
+        if store == "memory":
+            add_to_memory(text, metadata)
+        else:
+            signature = add_thread_signature(metadata["thread_id"], metadata["user_id"], text, event_id=metadata["event_id"])
+            if signature is not None:
+                working_set.set_signature(metadata["user_id"], metadata["thread_id"], signature)
+        wrote = True
+
+        # The event may have been deleted while its vector was being written
+        session = SessionLocal()
+        try:
+            deleted = session.query(MemoryEvent.id).filter_by(id=metadata["event_id"]).first() is None
+        finally:
+            session.close()
+        if deleted:
+            discard_orphaned(metadata["user_id"], metadata["thread_id"], metadata["event_id"])
+        return True
+    finally:
+        with _lock:
+            _in_flight.discard(claim)
+            _applied_since_checkpoint += wrote
+            checkpoint = _applied_since_checkpoint >= CHECKPOINT_EVERY
+            if checkpoint:
+                _applied_since_checkpoint = 0
+        if checkpoint:
+            jobs.enqueue("recover_ingest_log")
+            jobs.enqueue("compact_vector_stores")  # also retires segments left over by earlier passes
+
+def _settled_through(session, watermark):
+    """
+    Highest seq past `watermark` below which no entry can still commit, or None if there is no
+    such gap. Looks at every store's entries: they share one sequence.
+    """
+    settled_before = datetime.utcnow() - timedelta(seconds=LOG_GAP_GRACE_SECONDS)
+    previous = watermark
+    rows = (
+        session.query(IngestLogEntry.seq, IngestLogEntry.created_at)
+        .filter(IngestLogEntry.seq > watermark)
+        .order_by(IngestLogEntry.seq)
+    )
+    for seq, created_at in rows:
+        if seq != previous + 1 and created_at is not None and created_at > settled_before:
+            return previous
+        previous = seq
+    return None
+
+@jobs.handler("recover_ingest_log")
+def recover():
+    """Replay log entries past each store's watermark that the store is missing, then advance it."""
+    directory = shard_directory(current_shard())
+    serialized = get_engine(current_shard()).dialect.name == "sqlite"
+    for store in STORES:
+        watermark = read_watermark(store, directory)
+        session = SessionLocal()
+        try:
+            entries = (
+                session.query(IngestLogEntry.seq, IngestLogEntry.event_id)
+                .filter(IngestLogEntry.store == store, IngestLogEntry.seq > watermark)
+                .order_by(IngestLogEntry.seq)
+                .all()
+            )
+            applied = _applied_events(session, store, {event_id for _, event_id in entries})
+            limit = None if serialized else _settled_through(session, watermark)
+        finally:
+            session.close()
+
+        replayed = 0
+        new_watermark = watermark
+        for seq, event_id in entries:
+            if event_id not in applied:
+                try:
+                    if not apply(seq):
+                        break  # still being applied elsewhere; the next pass picks it up
+                except Exception as e:
+                    # The watermark stops here; the next recovery resumes from this entry
+                    print(f"[{timestamp()}] ⚠️ Ingest log replay stopped at {store}#{seq}: {e}", flush=True)
+                    break
+                replayed += 1
+            # Entries past `limit` still replay; only the watermark waits for the gap to settle
+            if limit is None or seq <= limit:
+                new_watermark = seq
+
+        if new_watermark > watermark:
+            write_watermark(store, new_watermark, directory)
+        if replayed or new_watermark > watermark:
+            print(f"[{timestamp()}] 📝 Ingest log: shard {current_shard()} {store} replayed {replayed} of {len(entries)} entries, "
+                  f"watermark {watermark} → {new_watermark}", flush=True)
+
+def schedule_recovery():
+    """Queue one recovery pass per shard per process start."""
+    global _recovery_scheduled
+    if not _recovery_scheduled:
+        _recovery_scheduled = True
+        for shard in shard_numbers():
+            with use_shard(shard):
+                jobs.enqueue("recover_ingest_log", key=f"recover_ingest_log:{_BOOT_ID}")
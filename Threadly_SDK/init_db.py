@@ -1,7 +1,28 @@
-from .db_setup import engine
-from .models import Base
+from .db_setup import get_engine
+from .models import Base, MemoryEvent, VectorRow
+from .lexical_index import ensure_lexical_index
+from .thread_activity import ensure_thread_activity
+from .sharding import shard_numbers, check_layout
 
-# Create all tables defined with Base (just MemoryEvent for now)
-Base.metadata.create_all(bind=engine)
+_initialized = set()
 
-print("Database and tables created.")
+def init_db(shards=None):
+    # Create all tables defined with Base on every shard; cheap no-op for shards already set up in this process
+    new = [shard for shard in (shard_numbers() if shards is None else shards) if shard not in _initialized]
+    if not new:
+        return
+    for shard in new:
+        engine = get_engine(shard)
+        Base.metadata.create_all(bind=engine)
+        # create_all skips tables that already exist, so add indexes introduced since then
+        for index in [*MemoryEvent.__table__.indexes, *VectorRow.__table__.indexes]:
+            index.create(bind=engine, checkfirst=True)
+        ensure_lexical_index(shard)
+        ensure_thread_activity(shard)
+        _initialized.add(shard)
+    if shards is None:
+        check_layout()
+    print("Database and tables created.")
+
+if __name__ == "__main__":
+    init_db()
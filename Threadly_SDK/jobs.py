@@ -0,0 +1,337 @@
+# jobs.py
+#
+# Background queue for post-ingest enrichment (vector writes, thread signatures, profile
+# aggregates, thread summaries). ingest_message commits the event, enqueues the follow-up work
+# and returns; workers pick it up from here.
+#
+# Backends (THREADLY_JOB_BACKEND):
+#   thread — in-process worker pool; fast, but queued jobs are lost if the process exits
+#   sqlite — rows in the `jobs` table; survive restarts and are shared by every worker process
+#   inline — run on the caller's thread (scripts, debugging)
+# Every job has a key; enqueueing a key that's already queued or done is a no-op, so callers can
+# enqueue freely. Failed jobs are retried with exponential backoff up to MAX_ATTEMPTS.
+# A job runs on the shard it was enqueued on (see sharding.py); durable jobs are stored there too.
+#
+# Run a standalone durable worker with:  python -m Threadly_SDK.jobs
+
+import os
+import json
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from .db_setup import SessionLocal, current_shard, use_shard
+from .models import JobRecord
+from .init_db import init_db
+from .unit_of_work import current_unit_of_work
+from .sharding import shard_numbers
+
+JOB_BACKEND = os.getenv("THREADLY_JOB_BACKEND", "thread")
+JOB_WORKERS = int(os.getenv("THREADLY_JOB_WORKERS", "4"))
+MAX_ATTEMPTS = int(os.getenv("THREADLY_JOB_MAX_ATTEMPTS", "5"))
+RETRY_BACKOFF_SECONDS = 2.0     # doubled after each failed attempt
+POLL_SECONDS = 1.0              # idle durable workers re-check the table this often
+LEASE_SECONDS = 300             # a "running" row untouched this long belonged to a dead worker
+DONE_RETENTION_SECONDS = 24 * 3600  # finished keys are remembered this long for idempotency
+RECENT_KEYS = 50000             # same, for the thread backend
+
+_handlers = {}
+_backend = None
+_backend_lock = threading.Lock()
+
+def handler(name):
+    """Register `fn(**payload)` as the handler for jobs called `name`."""
+    def register(fn):
+        _handlers[name] = fn
+        return fn
+    return register
+
+def _execute(name, payload):
+    fn = _handlers.get(name)
+    if fn is None:
+        raise KeyError(f"No job handler registered for '{name}'")
+    fn(**payload)
+
+def _retry_delay(attempt):
+    return RETRY_BACKOFF_SECONDS * 2 ** (attempt - 1)
+
+def timestamp():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+# ---------------------------
+# Backends
+# ---------------------------
+class InlineBackend:
+    def enqueue(self, name, key, payload):
+        _execute(name, payload)
+        return True
+
+    def enqueue_in(self, uow, name, key, payload):
+        uow.on_commit(self.enqueue, name, key, payload)
+        return True
+
+    def start(self):
+        pass
+
+    def drain(self, timeout=None):
+        return True
+
+
+class ThreadPoolBackend:
+    def __init__(self, workers: int):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="jobs")
+        self._keys = OrderedDict()  # recently accepted keys
+        self._pending = 0
+        self._lock = threading.Condition()
+
+    def enqueue(self, name, key, payload):
+        shard = current_shard()
+        with self._lock:
+            if (shard, key) in self._keys:
+                return False
+            self._keys[(shard, key)] = True
+            while len(self._keys) > RECENT_KEYS:
+                self._keys.popitem(last=False)
+            self._pending += 1
+        self._executor.submit(self._run, shard, name, key, payload)
+        return True
+
+    def enqueue_in(self, uow, name, key, payload):
+        uow.on_commit(self.enqueue, name, key, payload)
+        return True
+
+    def _run(self, shard, name, key, payload, attempt=1):
+        try:
+            with use_shard(shard):
+                _execute(name, payload)
+        except Exception as e:
+            if attempt < MAX_ATTEMPTS:
+                print(f"[{timestamp()}] 🔁 Job {key} attempt {attempt} failed: {e}", flush=True)
+                # Wait out the backoff on a timer, not in a pool worker; the job stays pending
+                timer = threading.Timer(_retry_delay(attempt), self._executor.submit,
+                                        (self._run, shard, name, key, payload, attempt + 1))
+                timer.daemon = True
+                timer.start()
+                return
+            print(f"[{timestamp()}] ❌ Job {key} failed after {attempt} attempts: {e}", flush=True)
+            with self._lock:
+                self._keys.pop((shard, key), None)  # let a later enqueue try again
+        self._finished()
+
+    def _finished(self):
+        with self._lock:
+            self._pending -= 1
+            self._lock.notify_all()
+
+    def start(self):
+        pass
+
+    def drain(self, timeout=None):
+        with self._lock:
+            return self._lock.wait_for(lambda: self._pending == 0, timeout=timeout)
+
+
+class SqliteBackend:
+    def __init__(self, workers: int):
+        self.workers = workers
+        self._wake = threading.Event()
+        self._started = False
+        self._start_lock = threading.Lock()
+        self._last_prune = 0.0
+        self._next_shard = 0  # shards are polled round-robin so none starves
+
+    def enqueue(self, name, key, payload):
+        session = SessionLocal()
+        try:
+            session.add(JobRecord(key=key, name=name, payload=json.dumps(payload)))
+            session.commit()
+        except IntegrityError:
+            session.rollback()
+            return False
+        finally:
+            session.close()
+        self._notify()
+        return True
+
+    def enqueue_in(self, uow, name, key, payload):
+        # The job row commits atomically with the unit's other writes
+        if uow.session.query(JobRecord.key).filter_by(key=key).first() is not None:
+            return False
+        uow.session.add(JobRecord(key=key, name=name, payload=json.dumps(payload)))
+        uow.on_commit(self._notify)
+        return True
+
+    def _notify(self):
+        self.start()
+        self._wake.set()
+
+    def start(self):
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        init_db()
+        self._maintain()
+        for i in range(self.workers):
+            threading.Thread(target=self._work, name=f"jobs-{i}", daemon=True).start()
+
+    def _maintain(self):
+        # Requeue jobs whose worker died mid-run; forget finished keys past retention
+        now = datetime.utcnow()
+        for shard in shard_numbers():
+            session = SessionLocal(shard=shard)
+            try:
+                session.query(JobRecord).filter(
+                    JobRecord.status == "running",
+                    JobRecord.updated_at < now - timedelta(seconds=LEASE_SECONDS)
+                ).update({"status": "pending"}, synchronize_session=False)
+                session.query(JobRecord).filter(
+                    JobRecord.status == "done",
+                    JobRecord.updated_at < now - timedelta(seconds=DONE_RETENTION_SECONDS)
+                ).delete(synchronize_session=False)
+                session.commit()
+            finally:
+                session.close()
+        self._last_prune = time.monotonic()
+
+    def _claim(self):
+        shards = list(shard_numbers())
+        start = self._next_shard % len(shards)
+        self._next_shard = start + 1
+        for shard in shards[start:] + shards[:start]:
+            job = self._claim_on(shard)
+            if job is not None:
+                return (shard,) + job
+        return None
+
+    def _claim_on(self, shard):
+        session = SessionLocal(shard=shard)
+        try:
+            now = datetime.utcnow()
+            keys = (
+                session.query(JobRecord.key)
+                .filter(JobRecord.status == "pending", JobRecord.run_after <= now)
+                .order_by(JobRecord.run_after)
+                .limit(self.workers)
+                .all()
+            )
+            for (key,) in keys:
+                # Conditional update: exactly one worker, in any process, wins each row
+                claimed = (
+                    session.query(JobRecord)
+                    .filter_by(key=key, status="pending")
+                    .update({"status": "running", "attempts": JobRecord.attempts + 1, "updated_at": now},
+                            synchronize_session=False)
+                )
+                session.commit()
+                if claimed:
+                    job = session.query(JobRecord).filter_by(key=key).first()
+                    return job.key, job.name, json.loads(job.payload), job.attempts
+            return None
+        finally:
+            session.close()
+
+    def _finish(self, shard, key, values):
+        session = SessionLocal(shard=shard)
+        try:
+            values["updated_at"] = datetime.utcnow()
+            session.query(JobRecord).filter_by(key=key).update(values, synchronize_session=False)
+            session.commit()
+        finally:
+            session.close()
+
+    def _run(self, shard, key, name, payload, attempt):
+        try:
+            with use_shard(shard):
+                _execute(name, payload)
+        except Exception as e:
+            if attempt >= MAX_ATTEMPTS:
+                print(f"[{timestamp()}] ❌ Job {key} failed after {attempt} attempts: {e}", flush=True)
+                self._finish(shard, key, {"status": "failed", "last_error": str(e)})
+            else:
+                print(f"[{timestamp()}] 🔁 Job {key} attempt {attempt} failed: {e}", flush=True)
+                self._finish(shard, key, {
+                    "status": "pending",
+                    "last_error": str(e),
+                    "run_after": datetime.utcnow() + timedelta(seconds=_retry_delay(attempt)),
+                })
+            return
+        self._finish(shard, key, {"status": "done", "last_error": ""})
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+                if job is None:
+                    if time.monotonic() - self._last_prune > LEASE_SECONDS:
+                        self._maintain()
+                    self._wake.wait(POLL_SECONDS)
+                    self._wake.clear()
+                    continue
+                self._run(*job)
+            except Exception as e:
+                print(f"[{timestamp()}] ⚠️ Job worker error: {e}", flush=True)
+                time.sleep(POLL_SECONDS)
+
+    def drain(self, timeout=None):
+        expires = None if timeout is None else time.monotonic() + timeout
+        while True:
+            busy = 0
+            for shard in shard_numbers():
+                session = SessionLocal(shard=shard)
+                try:
+                    busy += session.query(JobRecord).filter(JobRecord.status.in_(["pending", "running"])).count()
+                finally:
+                    session.close()
+            if not busy:
+                return True
+            if expires is not None and time.monotonic() > expires:
+                return False
+            time.sleep(0.05)
+
+# ---------------------------
+# Public API
+# ---------------------------
+BACKENDS = {"inline": InlineBackend, "thread": ThreadPoolBackend, "sqlite": SqliteBackend}
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                if JOB_BACKEND not in BACKENDS:
+                    raise ValueError(f"Unknown THREADLY_JOB_BACKEND '{JOB_BACKEND}'; expected one of {sorted(BACKENDS)}")
+                backend_cls = BACKENDS[JOB_BACKEND]
+                _backend = backend_cls() if backend_cls is InlineBackend else backend_cls(JOB_WORKERS)
+    return _backend
+
+def enqueue(name, key=None, **payload):
+    """
+    Queue `name(**payload)`. Returns False if a job with this key is already queued or done.
+    Inside a unit of work the job only reaches workers once the unit commits.
+    """
+    key = key or f"{name}:{uuid.uuid4()}"
+    uow = current_unit_of_work()
+    if uow is not None:
+        return get_backend().enqueue_in(uow, name, key, payload)
+    return get_backend().enqueue(name, key, payload)
+
+def start():
+    """Start durable workers now, so jobs left over from a previous run resume without waiting for a new enqueue."""
+    get_backend().start()
+
+def drain(timeout=None):
+    """Block until every queued job has finished (or `timeout` seconds pass)."""
+    return get_backend().drain(timeout)
+
+if __name__ == "__main__":
+    # Go through the package module so the handlers register where the workers look them up
+    from . import jobs, memory_ingestion, deletion  # noqa: F401
+    jobs._backend = jobs.SqliteBackend(jobs.JOB_WORKERS)
+    jobs.start()
+    print(f"[{timestamp()}] 📬 Job worker running ({jobs.JOB_WORKERS} threads)", flush=True)
+    while True:
+        time.sleep(3600)
@@ -0,0 +1,106 @@
+# lexical_index.py
+#
+# BM25 keyword index over past messages, for hybrid memory search.
+# An SQLite FTS5 table mirrors memory_events' message_text, topic_nuance and subtopics
+# (external content: the text itself is only stored once). Triggers on memory_events keep it in
+# sync in the same transaction as every insert, update and delete, so ingestion and deletion
+# need no extra step. Other databases (or SQLite builds without FTS5) just have no lexical
+# index, and search_memory falls back to vectors alone. Each shard's database is checked on
+# its own, so one shard without FTS5 doesn't turn keyword search off for the others.
+
+import re
+from sqlalchemy import text
+from .db_setup import get_engine, current_shard
+
+FTS_TABLE = "memory_fts"
+FTS_COLUMNS = ("message_text", "topic_nuance", "subtopics")
+BM25_WEIGHTS = (1.0, 0.5, 0.5)  # per FTS_COLUMNS; matches in the message itself count most
+MAX_QUERY_TERMS = 16
+
+# Too common to say anything about what a message is about
+STOPWORDS = frozenset("""
+a an and are as at be been but by can could did do does for from had has have how i i'm if in
+into is it it's its just me my myself of on or so than that the their them then there these
+they this to too was we were what when where which who why will with would you your
+""".split())
+
+_available = {}  # shard → whether its database has the FTS index
+
+_DDL = [
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    f"{', '.join(FTS_COLUMNS)}, content='memory_events', content_rowid='id')",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON memory_events BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, {', '.join(FTS_COLUMNS)})
+        VALUES (new.id, {', '.join('new.' + c for c in FTS_COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON memory_events BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {', '.join(FTS_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join('old.' + c for c in FTS_COLUMNS)});
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {', '.join(FTS_COLUMNS)} ON memory_events BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {', '.join(FTS_COLUMNS)})
+        VALUES ('delete', old.id, {', '.join('old.' + c for c in FTS_COLUMNS)});
+        INSERT INTO {FTS_TABLE}(rowid, {', '.join(FTS_COLUMNS)})
+        VALUES (new.id, {', '.join('new.' + c for c in FTS_COLUMNS)});
+    END""",
+]
+
+def ensure_lexical_index(shard=None):
+    """Create the FTS table and its triggers on a shard (default: the current one) if missing."""
+    shard = current_shard() if shard is None else shard
+    bind = get_engine(shard)
+    if bind.dialect.name != "sqlite":
+        _available[shard] = False
+        return False
+    try:
+        with bind.begin() as conn:
+            exists = conn.execute(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+            ).first()
+            for statement in _DDL:
+                conn.execute(text(statement))
+            if not exists:
+                conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    except Exception as e:
+        print(f"[⚠️ Lexical Index] FTS5 unavailable on shard {shard}, memory search uses vectors only: {e}", flush=True)
+        _available[shard] = False
+        return False
+    _available[shard] = True
+    return True
+
+def lexical_available():
+    """Whether the current shard's database has the FTS index."""
+    shard = current_shard()
+    if shard not in _available:
+        ensure_lexical_index(shard)
+    return _available[shard]
+
+def match_query(query_text):
+    """FTS5 MATCH expression OR-ing the query's distinct content words; None if it has none."""
+    terms = []
+    for word in re.findall(r"\w+", (query_text or "").lower()):
+        if len(word) > 1 and word not in STOPWORDS and word not in terms:
+            terms.append(word)
+    if not terms:
+        return None
+    # Quoted, so words like AND / NEAR or stray punctuation never parse as query syntax
+    return " OR ".join(f'"{t}"' for t in terms[:MAX_QUERY_TERMS])
+
+def search_lexical(session, query_text, limit=15, user_id=None, thread_id=None):
+    """MemoryEvent ids matching `query_text`, best BM25 score first."""
+    query = match_query(query_text)
+    if query is None or not lexical_available():
+        return []
+    filters, params = "", {"query": query, "limit": limit}
+    if user_id is not None:
+        filters += " AND m.user_id = :user_id"
+        params["user_id"] = user_id
+    if thread_id is not None:
+        filters += " AND m.thread_id = :thread_id"
+        params["thread_id"] = thread_id
+    rows = session.execute(text(
+        f"SELECT m.id FROM {FTS_TABLE} JOIN memory_events m ON m.id = {FTS_TABLE}.rowid "
+        f"WHERE {FTS_TABLE} MATCH :query{filters} "
+        f"ORDER BY bm25({FTS_TABLE}, {', '.join(str(w) for w in BM25_WEIGHTS)}) LIMIT :limit"
+    ), params)
+    return [event_id for (event_id,) in rows]
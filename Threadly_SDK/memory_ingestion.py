@@ -1,12 +1,28 @@
-from .db_setup import SessionLocal
-from .models import MemoryEvent, UserProfile
-from .embedding_utils import add_to_memory, add_thread_signature
+from .models import MemoryEvent, UserProfile, MessageFingerprint
 from .classify_utils import classify_topic, classify_sentiment
 from .thread_manager import get_active_thread_id
 from .summarizer import summarize_memories
+from .init_db import init_db
+from . import jobs
+from . import ingest_log
+from . import working_set
+from . import thread_activity
+from .records import ThreadHead
+from .embedding_utils import cached_embedding, get_memory_store
+from .near_duplicates import fingerprint, find_near_duplicate, NEAR_DUPLICATE_MODE
+from .fallbacks import PAST_REFERENCE
+from .unit_of_work import unit_of_work, read_scope
+from .sharding import user_scoped
 from sqlalchemy import func
 import hashlib
-import uuid
+
+# What summarize_thread_and_update writes onto a thread's latest event
+SUMMARY_COLUMNS = (
+    MemoryEvent.current_state_summary,
+    MemoryEvent.next_step_prediction,
+    MemoryEvent.breakthrough_flag,
+    MemoryEvent.breakthrough_description,
+)
 
 def hash_message(user_id, message_text):
     if not message_text:
@@ -15,34 +31,35 @@ def hash_message(user_id, message_text):
     return hashlib.sha256(key.encode("utf-8")).hexdigest()
 
 def get_thread_messages(session, thread_id, user_id):
-    events = (
-        session.query(MemoryEvent)
+    rows = (
+        session.query(MemoryEvent.message_text)
         .filter_by(user_id=user_id, thread_id=thread_id)
         .order_by(MemoryEvent.timestamp.asc())
-        .all()
     )
-    return [e.message_text for e in events if e.message_text]
+    return [text for (text,) in rows if text]
 
-def summarize_thread_and_update(thread_id, user_id):
-    session = SessionLocal()
-    messages = get_thread_messages(session, thread_id, user_id)
-    summary_data = summarize_memories(messages, user_id)
+@jobs.handler("summarize_thread")
+def summarize_thread_and_update(thread_id, user_id, session=None):
+    with read_scope(session) as read_session:
+        messages = get_thread_messages(read_session, thread_id, user_id)
 
-    last_event = (
-        session.query(MemoryEvent)
-        .filter_by(user_id=user_id, thread_id=thread_id)
-        .order_by(MemoryEvent.timestamp.desc())
-        .first()
-    )
-    if last_event:
-        last_event.current_state_summary = summary_data.get("momentum", "")
-        last_event.next_step_prediction = summary_data.get("consider_next", "")
-        last_event.breakthrough_flag = False
-        last_event.breakthrough_description = summary_data.get("change", "")
+    # The model call runs outside any open transaction
+    summary_data = summarize_memories(messages, user_id)
 
-    session.commit()
-    session.close()
+    with unit_of_work(session) as uow:
+        last_event = (
+            uow.session.query(MemoryEvent)
+            .filter_by(user_id=user_id, thread_id=thread_id)
+            .order_by(MemoryEvent.timestamp.desc())
+            .first()
+        )
+        if last_event:
+            last_event.current_state_summary = summary_data.get("momentum", "")
+            last_event.next_step_prediction = summary_data.get("consider_next", "")
+            last_event.breakthrough_flag = False
+            last_event.breakthrough_description = summary_data.get("change", "")
 
+@user_scoped
 def ingest_message(
     user_id,
     message_text,
@@ -51,45 +68,91 @@ def ingest_message(
     debug=False,
     goal_label=None,
     demo_mode=False,
-    embedding_threshold=0.82   # 👈 NEW: default matches thread_manager.py
+    embedding_threshold=0.82,   # 👈 NEW: default matches thread_manager.py
+    session=None
 ):
     if not message_text:
         return "", False, False, {"skipped": True, "reason": "Empty message"}
 
-    session = SessionLocal()
+    init_db()
+    # Joins the caller's unit of work (e.g. the /message request's) when there is one
+    with unit_of_work(session) as uow:
+        return _ingest_message(
+            uow, user_id, message_text, tags, importance_score, debug,
+            goal_label, demo_mode, embedding_threshold
+        )
+
+def _ingest_message(uow, user_id, message_text, tags, importance_score, debug,
+                    goal_label, demo_mode, embedding_threshold):
+    session = uow.session
+    debug_log = {} if debug else None
+
+    # 🪞 A lightly edited resubmission of a recent entry takes that entry's classification,
+    # thread and stored vector, and keeps the thread's summary: no classifier, routing,
+    # embedding or summary call runs for it
+    msg_fingerprint = fingerprint(message_text)
+    duplicate = find_near_duplicate(session, working_set.get(user_id, session), message_text, msg_fingerprint)
+    previous = duplicate[0] if duplicate else None
+    if previous is not None:
+        duplicate_meta = {"near_duplicate_of": previous.id, "near_duplicate_similarity": round(duplicate[1], 3)}
+        if NEAR_DUPLICATE_MODE == "skip":
+            return previous.thread_id, False, False, {
+                "skipped": True,
+                "reason": "Near-duplicate message",
+                "thread_id": previous.thread_id,
+                "classified_topic": previous.topic,
+                **duplicate_meta,
+            }
+        if debug_log is not None:
+            debug_log.update(duplicate_meta)
 
-    topic_info = classify_topic(message_text)
+    if previous is None:
+        # Classification and routing make model calls (with retries): hand the connection back
+        # first, as /message does before its summary calls; routing's reads check one out again
+        uow.release()
+
+    if previous is not None:
+        topic_info = {
+            "topic": previous.topic,
+            "topic_nuance": previous.topic_nuance,
+            "subtopics": [s for s in (previous.subtopics or "").split(",") if s],
+            "reference_past_issue": bool(PAST_REFERENCE.search(message_text)),
+            "source": "near_duplicate",
+        }
+    else:
+        topic_info = classify_topic(message_text, user_id=user_id)
     topic = topic_info.get("topic")
     topic_nuance = topic_info.get("topic_nuance")
     subtopics = topic_info.get("subtopics", [])
     reference_past_issue = topic_info.get("reference_past_issue", False)
 
-    dominant_emotion = classify_sentiment(message_text)
-
-    debug_log = {} if debug else None
-    thread_id, thread_is_intensifying = get_active_thread_id(
-        user_id=user_id,
-        current_nuance=topic_nuance,
-        dominant_emotion=dominant_emotion,
-        debug_log=debug_log,
-        current_message_text=message_text,
-        current_topic=topic,
-        current_subtopics=subtopics,
-        embedding_threshold=embedding_threshold   # 👈 forward param
-    )
+    if previous is not None:
+        dominant_emotion = previous.sentiment
+        thread_id, thread_is_intensifying = previous.thread_id, False
+    else:
+        dominant_emotion = classify_sentiment(message_text, user_id=user_id)
+        thread_id, thread_is_intensifying = get_active_thread_id(
+            user_id=user_id,
+            current_nuance=topic_nuance,
+            dominant_emotion=dominant_emotion,
+            debug_log=debug_log,
+            current_message_text=message_text,
+            current_topic=topic,
+            current_subtopics=subtopics,
+            embedding_threshold=embedding_threshold   # 👈 forward param
+        )
 
     if debug_log is not None:
         debug_log["matched_thread_id"] = thread_id
 
     msg_hash = hash_message(user_id, message_text)
     existing = (
-        session.query(MemoryEvent)
+        session.query(MemoryEvent.id)
         .filter_by(user_id=user_id, thread_id=thread_id)
         .filter(MemoryEvent.message_hash == msg_hash)
         .first()
     )
     if existing:
-        session.close()
         return thread_id, False, reference_past_issue, {
             "skipped": True,
             "reason": "Duplicate message",
@@ -98,13 +161,23 @@ def ingest_message(
         }
 
     is_first_message = (
-        session.query(MemoryEvent)
+        session.query(MemoryEvent.id)
         .filter_by(user_id=user_id, thread_id=thread_id)
-        .count() == 0
+        .first() is None
     )
 
     final_tags = (tags or []) + (["demo"] if demo_mode else [])
 
+    # A resubmission changes nothing a new summary would say, so the thread's latest one carries over
+    carried_summary = None
+    if previous is not None:
+        carried_summary = (
+            session.query(*SUMMARY_COLUMNS)
+            .filter_by(user_id=user_id, thread_id=thread_id)
+            .order_by(MemoryEvent.timestamp.desc())
+            .first()
+        )
+
     memory = MemoryEvent(
         user_id=user_id,
         message_text=message_text,
@@ -121,34 +194,59 @@ def ingest_message(
         role="user",
         goal_label=goal_label if is_first_message else ""
     )
+    if carried_summary is not None:
+        for column, value in zip(SUMMARY_COLUMNS, carried_summary):
+            setattr(memory, column.key, value)
     session.add(memory)
-    session.commit()
-    session.close()
+    session.flush()  # assigns memory.id for the log entries; also takes the write lock
+    thread_activity.record_event(session, memory)
+    if msg_fingerprint is not None:
+        session.add(MessageFingerprint(event_id=memory.id, user_id=user_id, simhash=msg_fingerprint))
 
-    # 🔁 Add message-level embedding to FAISS vector memory
-    add_to_memory(message_text, {
-        "user_id": user_id,
-        "thread_id": thread_id,
-        "topic": topic,
-        "topic_nuance": topic_nuance,
-        "subtopics": subtopics,
-        "reference_past_issue": reference_past_issue,
-        "tags": final_tags,
-        "emotion": dominant_emotion,
-        "goal_label": goal_label if is_first_message else ""
-    })
+    # 🪞 A near-duplicate stores the earlier entry's vector under its own id, in this transaction,
+    # and adds nothing new to its thread's centroid. If that vector isn't stored yet, the message
+    # is embedded like any other.
+    reused = get_memory_store().get(previous.id) if previous is not None else None
+    if reused is not None:
+        get_memory_store().add_many([(memory.id, reused, user_id, thread_id)], session=session)
+        log_entries = []
+    else:
+        # 📝 Vector writes are logged in the event's own transaction, so the DB and the vector
+        # stores can't silently diverge: whatever isn't applied yet is replayed from the log
+        log_entries = [
+            ingest_log.append(session, "memory", memory),
+            ingest_log.append(session, "thread_signature", memory),
+        ]
+    session.flush()
+    event_id = memory.id
+    log_seqs = [entry.seq for entry in log_entries]
+
+    # 🗂️ Write-through to the user's routing working set once the event is committed
+    vector = reused if reused is not None else cached_embedding(message_text)
+    uow.on_commit(
+        working_set.record_event, user_id, ThreadHead.from_entity(memory), vector, msg_fingerprint
+    )
 
-    # 🔖 Add thread signature embedding only for first message in a thread
-    if is_first_message:
-        add_thread_signature(thread_id, user_id, message_text)
+    # 🔁 Message embedding and the thread signature's centroid update
+    for seq in log_seqs:
+        jobs.enqueue("apply_ingest_log", key=f"apply_ingest_log:{seq}", seq=seq)
 
     if not demo_mode:
-        update_user_profile(user_id, topic, dominant_emotion)
+        jobs.enqueue(
+            "update_user_profile", key=f"update_user_profile:{event_id}",
+            user_id=user_id, topic=topic, dominant_emotion=dominant_emotion
+        )
+
+    if previous is None:
+        jobs.enqueue("summarize_thread", key=f"summarize_thread:{event_id}", thread_id=thread_id, user_id=user_id)
 
-    summarize_thread_and_update(thread_id, user_id)
+    # 💾 One commit for the event, its log entries and (durable backend) its jobs; the jobs are
+    # handed to workers only once it succeeds
+    uow.commit()
 
     debug_meta = {
         "classified_topic": topic,
+        "topic_source": topic_info.get("source", "llm"),
         "nuance": topic_nuance,
         "subtopics": subtopics,
         "emotion": dominant_emotion,
@@ -161,11 +259,19 @@ def ingest_message(
 
     return thread_id, thread_is_intensifying, reference_past_issue, debug_meta
 
-def update_user_profile(user_id, topic, dominant_emotion):
+@jobs.handler("update_user_profile")
+def update_user_profile(user_id, topic, dominant_emotion, session=None):
     if topic == "unknown":
         return
 
-    session = SessionLocal()
+    with unit_of_work(session) as uow:
+        profile = _update_user_profile(uow.session, user_id, topic, dominant_emotion)
+        uow.on_commit(
+            working_set.set_profile, user_id,
+            {field: getattr(profile, field) for field in working_set.PROFILE_FIELDS}
+        )
+
+def _update_user_profile(session, user_id, topic, dominant_emotion):
     profile = session.query(UserProfile).filter_by(user_id=user_id).first()
 
     if not profile:
@@ -211,6 +317,4 @@ def update_user_profile(user_id, topic, dominant_emotion):
     else:
         profile.active_topic_streak = topic
         profile.repetition_count = 1
-
-    session.commit()
-    session.close()
+    return profile
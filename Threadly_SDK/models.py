@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer, DateTime, Text, Float, Boolean
+from sqlalchemy import Column, String, Integer, BigInteger, DateTime, Text, Float, Boolean, ForeignKey, Index
 from .db_setup import Base
 from datetime import datetime
 
@@ -36,6 +36,12 @@ class MemoryEvent(Base):
     # 🎯 Optional goal label
     goal_label = Column(String, default="")
 
+    # 📜 Keyset pagination indexes for history.py: (timestamp, id) order within a user / thread
+    __table_args__ = (
+        Index("ix_memory_events_user_ts", "user_id", "timestamp", "id"),
+        Index("ix_memory_events_user_thread_ts", "user_id", "thread_id", "timestamp", "id"),
+    )
+
 class UserProfile(Base):
     __tablename__ = "user_profiles"
 
@@ -48,3 +54,110 @@ class UserProfile(Base):
     dominant_emotion = Column(String, default="neutral")
     active_topic_streak = Column(String, default="")
     repetition_count = Column(Integer, default=0)
+
+
+class VectorRow(Base):
+    __tablename__ = "vector_rows"
+
+    # 🧮 One row per vector in a store's segment files; `row` is segment × SEGMENT_SPAN (2**32)
+    # + offset in that segment (see vector_store.py), so it needs 64 bits past segment 0
+    id = Column(Integer, primary_key=True)
+    store = Column(String, index=True)
+    row = Column(BigInteger)
+    event_id = Column(Integer, ForeignKey("memory_events.id"), index=True)
+    user_id = Column(String)
+    thread_id = Column(String)
+
+    __table_args__ = (
+        Index("ix_vector_rows_store_user", "store", "user_id"),
+        Index("ix_vector_rows_store_row", "store", "row"),  # segment ranges, for search and compaction
+    )
+
+class SummaryCacheEntry(Base):
+    __tablename__ = "summary_cache"
+
+    # 🗃️ Persistent tier of summary_cache.py, keyed by hash(model, mode, processed entries)
+    key = Column(String, primary_key=True)
+    value = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+class JobRecord(Base):
+    __tablename__ = "jobs"
+
+    # 📬 Durable queue for jobs.py's SQLite backend; the key makes enqueueing idempotent
+    key = Column(String, primary_key=True)
+    name = Column(String)
+    payload = Column(Text)
+    status = Column(String, default="pending")  # pending | running | done | failed
+    attempts = Column(Integer, default=0)
+    last_error = Column(Text, default="")
+    run_after = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, index=True)
+
+    __table_args__ = (
+        Index("ix_jobs_status_run_after", "status", "run_after"),
+    )
+
+class IngestLogEntry(Base):
+    __tablename__ = "ingest_log"
+
+    # 📝 Write-ahead log of vector-store writes, appended in the same transaction as the event
+    seq = Column(Integer, primary_key=True)
+    store = Column(String)      # vector store the write targets: "memory" | "thread_signature"
+    event_id = Column(Integer, ForeignKey("memory_events.id"))
+    user_id = Column(String)
+    thread_id = Column(String)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_ingest_log_store_seq", "store", "seq"),
+        {"sqlite_autoincrement": True},  # sequence numbers are never reused
+    )
+
+class ThreadCentroid(Base):
+    __tablename__ = "thread_centroids"
+
+    # 🧷 Running centroid behind a thread's signature: the signature store holds the normalized
+    # weighted sum of the thread's message vectors, this row its magnitude and message count
+    thread_id = Column(String, primary_key=True)
+    user_id = Column(String, index=True)
+    event_id = Column(Integer, ForeignKey("memory_events.id"))  # the signature's key in the store
+    message_count = Column(Integer, default=0)  # 0 while the first message's vector is being written
+    magnitude = Column(Float, default=0.0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class ThreadActivity(Base):
+    __tablename__ = "thread_activity"
+
+    # 🕰️ One row per thread, kept current on ingest (see thread_activity.py), so listing a
+    # user's threads by recency is a range scan instead of a GROUP BY over all their events
+    thread_id = Column(String, primary_key=True)
+    user_id = Column(String, nullable=False)
+    started_at = Column(DateTime, nullable=False)
+    last_activity = Column(DateTime, nullable=False)
+    message_count = Column(Integer, default=0)
+    last_event_id = Column(Integer)  # the thread's latest event, for its topic and state
+
+    __table_args__ = (
+        Index("ix_thread_activity_user_last", "user_id", "last_activity", "thread_id"),
+    )
+
+class ThreadCentroidMember(Base):
+    __tablename__ = "thread_centroid_members"
+
+    # Events already folded into their thread's centroid, so a log replay never counts one twice
+    event_id = Column(Integer, ForeignKey("memory_events.id"), primary_key=True)
+    thread_id = Column(String, index=True)
+
+class MessageFingerprint(Base):
+    __tablename__ = "message_fingerprints"
+
+    # 🪞 SimHash of a message's words (see near_duplicates.py), for spotting lightly edited resubmissions
+    event_id = Column(Integer, ForeignKey("memory_events.id"), primary_key=True)
+    user_id = Column(String)
+    simhash = Column(BigInteger)  # 64 bits, stored signed
+
+    __table_args__ = (
+        Index("ix_message_fingerprints_user_event", "user_id", "event_id"),
+    )
@@ -0,0 +1,73 @@
+# near_duplicates.py
+#
+# Near-duplicate detection for resubmitted entries.
+# Every message gets a 64-bit SimHash of its words and word pairs: lightly edited versions of a
+# message land a few bits apart, so the user's recent fingerprints (kept in their working set)
+# give the likely matches without any SQL or model call. SimHash alone is noisy on messages this
+# short, so candidates are confirmed by the Jaccard similarity of the two messages' word sets,
+# which is what THREADLY_NEAR_DUPLICATE_THRESHOLD sets. ingest_message runs this first; a match
+# reuses the earlier entry's classification, thread and stored vector (and keeps the thread's
+# summary) instead of computing them again.
+
+import os
+import re
+import hashlib
+import numpy as np
+from .models import MemoryEvent
+from .records import DuplicateCandidate
+
+# Jaccard similarity (words + word pairs) at which a message counts as a resubmission; 0 disables
+NEAR_DUPLICATE_THRESHOLD = float(os.getenv("THREADLY_NEAR_DUPLICATE_THRESHOLD", "0.7"))
+# "reuse": store the entry with the earlier one's classification; "skip": drop it like an exact duplicate
+NEAR_DUPLICATE_MODE = os.getenv("THREADLY_NEAR_DUPLICATE_MODE", "reuse")
+NEAR_DUPLICATE_WINDOW = 200   # most recent messages per user compared against
+MIN_WORDS = 4                 # shorter messages carry too few features to compare
+CANDIDATE_DISTANCE = 16       # fingerprints this many bits apart still get the exact check
+MAX_CANDIDATES = 3
+
+FINGERPRINT_BITS = 64
+_MASK = (1 << FINGERPRINT_BITS) - 1
+
+def _features(message_text):
+    words = re.findall(r"\w+", (message_text or "").lower())
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])], len(words)
+
+def fingerprint(message_text):
+    """Signed 64-bit SimHash of the message (as stored), or None if it's too short to compare."""
+    features, word_count = _features(message_text)
+    if word_count < MIN_WORDS:
+        return None
+    hashes = np.frombuffer(
+        b"".join(hashlib.blake2b(f.encode("utf-8"), digest_size=8).digest() for f in features), dtype="<u8"
+    )
+    # Each bit of the fingerprint is the majority vote of that bit across the feature hashes
+    bits = (hashes[:, None] >> np.arange(FINGERPRINT_BITS, dtype="uint64")) & np.uint64(1)
+    votes = 2 * bits.sum(axis=0, dtype="int64") - len(features)
+    value = sum(1 << bit for bit in np.flatnonzero(votes > 0).tolist())
+    return value - (1 << FINGERPRINT_BITS) if value >= 1 << (FINGERPRINT_BITS - 1) else value
+
+def distance(a, b):
+    """Number of differing fingerprint bits."""
+    return bin((a ^ b) & _MASK).count("1")
+
+def similarity(text_a, text_b):
+    a, b = set(_features(text_a)[0]), set(_features(text_b)[0])
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+def find_near_duplicate(session, ws, message_text, fp, threshold=None):
+    """
+    The user's recent message that `message_text` (fingerprint `fp`) is a near-duplicate of, as
+    (DuplicateCandidate, similarity), or None. `ws` is the user's working set.
+    """
+    threshold = NEAR_DUPLICATE_THRESHOLD if threshold is None else threshold
+    if fp is None or threshold <= 0:
+        return None
+    event_ids = ws.similar_fingerprints(fp, CANDIDATE_DISTANCE, MAX_CANDIDATES)
+    if not event_ids:
+        return None
+    candidates = DuplicateCandidate.all(
+        DuplicateCandidate.query(session).filter(MemoryEvent.id.in_(event_ids))
+    )
+    scored = [(c, similarity(message_text, c.message_text)) for c in candidates]
+    scored = [(c, s) for c, s in scored if s >= threshold]
+    return max(scored, key=lambda pair: (pair[1], pair[0].id)) if scored else None
@@ -0,0 +1,149 @@
+# rate_limiter.py
+#
+# Process-wide token-bucket governor for upstream model calls.
+# Each model gets a requests-per-minute and a tokens-per-minute bucket. Callers declare a priority:
+# critical work (routing classification, embeddings) may wait for capacity, optional work
+# (wild card, curiosity) is shed as soon as the buckets dip into the reserve kept for others.
+# Upstream 429s shrink the model's effective rate (multiplicative decrease), which then
+# recovers gradually while calls succeed (additive increase).
+
+import os
+import time
+import threading
+
+# ---------------------------
+# Priorities
+# ---------------------------
+CRITICAL = 0   # needed to route/answer the message at all
+NORMAL = 1     # main summaries
+OPTIONAL = 2   # nice-to-have: wild card, curiosity, resolved-thread summaries
+
+MAX_WAIT_SECONDS = {CRITICAL: 20.0, NORMAL: 5.0, OPTIONAL: 0.0}
+# Fraction of each bucket a priority may NOT dip into, so lower classes can't starve higher ones
+RESERVE_FRACTION = {CRITICAL: 0.0, NORMAL: 0.1, OPTIONAL: 0.3}
+
+# ---------------------------
+# Default per-model limits (requests/min, tokens/min); tune to the account's tier
+# ---------------------------
+DEFAULT_LIMITS = {
+    "gpt-4": (500, 10_000),
+    "gpt-4o": (500, 30_000),
+    "gpt-4o-mini": (500, 200_000),
+    "text-embedding-3-small": (3_000, 1_000_000),
+}
+FALLBACK_LIMITS = (500, 30_000)
+LIMIT_SCALE = float(os.getenv("THREADLY_RATE_LIMIT_SCALE", "1.0"))  # e.g. 0.5 when sharing a key
+
+MIN_RATE_FACTOR = 0.2      # never throttle below 20% of the configured rate
+PENALTY_FACTOR = 0.7       # multiply the rate by this on each upstream 429
+RECOVERY_PER_SUCCESS = 0.02
+DEFAULT_COMPLETION_TOKENS = 400  # assumed output size when max_tokens isn't given
+
+
+class RateLimitShed(Exception):
+    """Raised when a call is dropped because its priority class can't get capacity in time."""
+
+
+class TokenBucket:
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.rate = per_minute / 60.0  # refill per second
+        self.updated = time.monotonic()
+
+    def refill(self, factor: float = 1.0):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate * factor)
+        self.updated = now
+
+    def wait_for(self, amount: float, reserve: float, factor: float) -> float:
+        # Seconds until `amount` can be taken while leaving `reserve` of capacity untouched
+        needed = amount + reserve * self.capacity - self.level
+        if needed <= 0:
+            return 0.0
+        return needed / (self.rate * factor)
+
+
+class ModelLimiter:
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm * LIMIT_SCALE)
+        self.tokens = TokenBucket(tpm * LIMIT_SCALE)
+        self.factor = 1.0
+        self.shed = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, tokens: int, priority: int = NORMAL):
+        deadline = time.monotonic() + MAX_WAIT_SECONDS[priority]
+        reserve = RESERVE_FRACTION[priority]
+        # A single oversized request may take the whole bucket rather than wait forever
+        tokens = min(tokens, self.tokens.capacity)
+
+        while True:
+            with self.lock:
+                self.requests.refill(self.factor)
+                self.tokens.refill(self.factor)
+                wait = max(
+                    self.requests.wait_for(1, reserve, self.factor),
+                    self.tokens.wait_for(tokens, reserve, self.factor),
+                )
+                if wait == 0:
+                    self.requests.level -= 1
+                    self.tokens.level -= tokens
+                    return
+                if time.monotonic() + wait > deadline:
+                    self.shed += 1
+                    raise RateLimitShed(f"priority {priority} call shed (needs {wait:.1f}s of capacity)")
+            time.sleep(min(wait, 0.25))
+
+    def settle(self, estimated: int, actual: int):
+        # Correct the token bucket once the real usage is known
+        with self.lock:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + estimated - actual)
+            self.factor = min(1.0, self.factor + RECOVERY_PER_SUCCESS)
+
+    def refund(self, tokens: int, request: bool = False):
+        # Give back what an attempt took without using it (the upstream never ran the model)
+        with self.lock:
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + min(tokens, self.tokens.capacity))
+            if request:
+                self.requests.level = min(self.requests.capacity, self.requests.level + 1)
+
+    def penalize(self):
+        with self.lock:
+            self.factor = max(MIN_RATE_FACTOR, self.factor * PENALTY_FACTOR)
+            # Drain what's left so the burst that triggered the 429 backs off immediately
+            self.requests.level = min(self.requests.level, 0.0)
+
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(model: str) -> ModelLimiter:
+    limiter = _limiters.get(model)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(model)
+            if limiter is None:
+                limiter = ModelLimiter(*DEFAULT_LIMITS.get(model, FALLBACK_LIMITS))
+                _limiters[model] = limiter
+    return limiter
+
+def configure_model_limits(model: str, rpm: float, tpm: float):
+    with _limiters_lock:
+        _limiters[model] = ModelLimiter(rpm, tpm)
+
+def estimate_tokens(texts, max_tokens=None) -> int:
+    # ~4 characters per token is close enough for budgeting; settle() fixes it up afterwards
+    prompt_tokens = sum(len(t or "") for t in texts) // 4 + 1
+    return prompt_tokens + (max_tokens or 0)
+
+def limiter_stats() -> dict:
+    return {
+        model: {
+            "rate_factor": round(l.factor, 3),
+            "requests_available": round(l.requests.level, 1),
+            "tokens_available": round(l.tokens.level),
+            "shed": l.shed,
+        }
+        for model, l in _limiters.items()
+    }
@@ -0,0 +1,273 @@
+# rebalance.py
+#
+# Moves users onto the shards the hash ring assigns them after THREADLY_SHARDS changes.
+#
+#     python -m Threadly_SDK.rebalance status
+#     python -m Threadly_SDK.rebalance [--dry-run] [--batch-size 100]
+#
+# Users move in batches while the service keeps running:
+#   1. copy each user's events, profile, thread centroids, fingerprints and vectors to the new
+#      shard (events get new ids there; vector writes still pending on the old shard are logged
+#      again on the new one)
+#   2. mark the batch moved in the shard map; every process routes them to the new shard within
+#      SHARD_MAP_REFRESH_SECONDS, so wait a few of those for requests already in flight
+#   3. copy whatever they wrote to the old shard in the meantime, then delete them from it
+# When every user is moved the map records the new layout. An interrupted run can simply be
+# started again: a half-copied user is copied again from scratch, a moved one just finishes step 3.
+
+import sys
+import time
+import argparse
+from collections import Counter
+from .db_setup import SessionLocal, use_shard
+from .models import (
+    MemoryEvent, UserProfile, IngestLogEntry, ThreadCentroid, ThreadCentroidMember, MessageFingerprint, VectorRow
+)
+from .sharding import (
+    SHARD_COUNT, SHARD_MAP_REFRESH_SECONDS, ring_shard, shard_map, save_shard_map, shard_numbers
+)
+from .init_db import init_db
+from .unit_of_work import unit_of_work
+from .embedding_utils import get_memory_store, get_thread_signature_store, timestamp
+from . import ingest_log
+from . import deletion
+from . import jobs
+from . import working_set
+from . import thread_activity
+
+BATCH_SIZE = 100
+MOVE_SETTLE_SECONDS = 3 * SHARD_MAP_REFRESH_SECONDS
+
+def _chunks(values, size=500):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def _columns(row, skip=()):
+    return {c.key: getattr(row, c.key) for c in row.__table__.columns if c.key not in skip}
+
+def users_on(shard):
+    """Users with any data on `shard`."""
+    with use_shard(shard):
+        session = SessionLocal()
+        try:
+            users = {u for (u,) in session.query(MemoryEvent.user_id).distinct()}
+            users.update(u for (u,) in session.query(UserProfile.user_id))
+        finally:
+            session.close()
+    users.discard(None)
+    return users
+
+def plan(target, shards=None):
+    """(user_id, from shard, to shard) for every user not yet where a `target`-shard layout puts them."""
+    moves = []
+    for shard in shard_numbers() if shards is None else shards:
+        for user_id in sorted(users_on(shard)):
+            dest = ring_shard(user_id, target)
+            if dest != shard:
+                moves.append((user_id, shard, dest))
+    return moves
+
+# ---------------------------
+# Copying one user
+# ---------------------------
+def _snapshot(user_id, after_id=0):
+    """
+    Everything stored for `user_id` on the current shard. With `after_id`, only the events
+    written after it (the catch-up copy): thread state is left for the new shard to rebuild.
+    """
+    memory_store, signature_store = get_memory_store(), get_thread_signature_store()
+    session = SessionLocal()
+    try:
+        events = [
+            _columns(e) for e in session.query(MemoryEvent)
+            .filter(MemoryEvent.user_id == user_id, MemoryEvent.id > after_id)
+            .order_by(MemoryEvent.id)
+        ]
+        event_ids = [e["id"] for e in events]
+        profile = session.query(UserProfile).filter_by(user_id=user_id).first()
+        snap = {
+            "events": events,
+            "profile": _columns(profile) if profile else None,
+            "fingerprints": dict(
+                session.query(MessageFingerprint.event_id, MessageFingerprint.simhash)
+                .filter(MessageFingerprint.user_id == user_id, MessageFingerprint.event_id > after_id)
+            ),
+            "logged": set(
+                session.query(IngestLogEntry.store, IngestLogEntry.event_id)
+                .filter(IngestLogEntry.user_id == user_id, IngestLogEntry.event_id > after_id)
+            ),
+            "vectors": memory_store.get_many(event_ids),
+            "centroids": [],
+            "members": [],
+            "signatures": {},
+        }
+        if not after_id:
+            snap["centroids"] = [_columns(c) for c in session.query(ThreadCentroid).filter_by(user_id=user_id)]
+            for chunk in _chunks(event_ids):
+                snap["members"].extend(
+                    session.query(ThreadCentroidMember.event_id, ThreadCentroidMember.thread_id)
+                    .filter(ThreadCentroidMember.event_id.in_(chunk))
+                )
+            keys = dict(
+                session.query(VectorRow.event_id, VectorRow.thread_id)
+                .filter(VectorRow.store == "thread_signature", VectorRow.user_id == user_id)
+            )
+            snap["signatures"] = {
+                key: (keys[key], vec) for key, vec in signature_store.get_many(list(keys)).items()
+            }
+    finally:
+        session.close()
+    return snap
+
+def _restore(user_id, snap, fresh):
+    """
+    Write a snapshot to the current shard. `fresh` first clears anything an interrupted
+    earlier copy left there. Returns the number of events copied.
+    """
+    memory_store, signature_store = get_memory_store(), get_thread_signature_store()
+    with unit_of_work() as uow:
+        session = uow.session
+        if fresh and (
+            session.query(MemoryEvent.id).filter_by(user_id=user_id).first()
+            or session.query(UserProfile.user_id).filter_by(user_id=user_id).first()
+        ):
+            deletion._delete(user_id)
+
+        copies = []
+        for columns in snap["events"]:
+            event = MemoryEvent(**{k: v for k, v in columns.items() if k != "id"})
+            session.add(event)
+            copies.append((columns["id"], event))
+        session.flush()  # new ids; also takes the write lock ahead of the vector files' lock
+        ids = {old: event.id for old, event in copies}
+        events = {old: event for old, event in copies}
+        thread_activity.refresh(session, {event.thread_id for event in events.values()})
+
+        if snap["profile"] is not None:
+            session.merge(UserProfile(**snap["profile"]))
+        threads = set()
+        for centroid in snap["centroids"]:
+            if centroid["event_id"] in ids:
+                session.add(ThreadCentroid(**{**centroid, "event_id": ids[centroid["event_id"]]}))
+                threads.add(centroid["thread_id"])
+        folded = {old for old, thread_id in snap["members"] if old in ids and thread_id in threads}
+        session.add_all(ThreadCentroidMember(event_id=ids[old], thread_id=events[old].thread_id) for old in folded)
+        session.add_all(
+            MessageFingerprint(event_id=ids[old], user_id=user_id, simhash=simhash)
+            for old, simhash in snap["fingerprints"].items() if old in ids
+        )
+
+        vectors = [
+            (ids[old], vec, user_id, events[old].thread_id)
+            for old, vec in snap["vectors"].items() if old in ids
+        ]
+        signatures = [
+            (ids[old], vec, user_id, thread_id)
+            for old, (thread_id, vec) in snap["signatures"].items() if old in ids
+        ]
+        if vectors:
+            memory_store.add_many(vectors, session=session)
+        if signatures:
+            signature_store.add_many(signatures, session=session)
+
+        # Vector writes the old shard logged but the copy doesn't carry are redone here
+        copied = {"memory": {old for old in snap["vectors"] if old in ids}, "thread_signature": folded}
+        pending = [
+            ingest_log.append(session, store, events[old])
+            for store, old in sorted(snap["logged"]) if old in ids and old not in copied.get(store, ())
+        ]
+        session.flush()
+        for entry in pending:
+            jobs.enqueue("apply_ingest_log", key=f"apply_ingest_log:{entry.seq}", seq=entry.seq)
+        uow.on_commit(working_set.invalidate, user_id)
+    return len(copies)
+
+def move_batch(batch, target):
+    """Move `batch` of (user_id, from shard, to shard) users; see the module header for the steps."""
+    data = shard_map(refresh=True)
+    copied = {}
+    for user_id, source, dest in batch:
+        if user_id in data["moved"]:
+            continue  # copied and switched over by an interrupted run
+        with use_shard(source):
+            snap = _snapshot(user_id)
+        with use_shard(dest):
+            _restore(user_id, snap, fresh=True)
+        copied[user_id] = max([e["id"] for e in snap["events"]], default=0)
+
+    if copied:
+        data["moved"].update(copied)
+        save_shard_map({**data, "target": target})
+        time.sleep(MOVE_SETTLE_SECONDS)
+
+    data = shard_map(refresh=True)
+    for user_id, source, dest in batch:
+        with use_shard(source):
+            snap = _snapshot(user_id, after_id=data["moved"].get(user_id, 0))
+        with use_shard(dest):
+            _restore(user_id, snap, fresh=False)
+        with use_shard(source):
+            deletion._delete(user_id)
+        print(f"[{timestamp()}] 🚚 Moved {user_id}: shard {source} → {dest} "
+              f"(+{len(snap['events'])} written during the copy)", flush=True)
+
+def rebalance(target=SHARD_COUNT, dry_run=False, batch_size=BATCH_SIZE):
+    """Move every user to their shard in a `target`-shard layout, then record that layout."""
+    data = shard_map(refresh=True)
+    if data["target"] not in (None, target):
+        raise ValueError(f"❌ A rebalance to {data['target']} shards is unfinished; finish it first.")
+    shards = range(max(target, data["shards"]))
+    if not dry_run:
+        init_db(shards)
+        save_shard_map({**data, "target": target})
+
+    moves = plan(target, None if dry_run else shards)  # a dry run only reads the shards in use
+    routes = Counter((source, dest) for _, source, dest in moves)
+    print(f"[{timestamp()}] 🗂️ {data['shards']} → {target} shards: {len(moves)} users to move"
+          + "".join(f", {s}→{d}: {n}" for (s, d), n in sorted(routes.items())), flush=True)
+    if dry_run:
+        return moves
+
+    moved = 0
+    while moves:
+        # Users who first wrote during a pass were placed by the old layout; pick them up too
+        for i in range(0, len(moves), batch_size):
+            move_batch(moves[i:i + batch_size], target)
+        moved += len(moves)
+        moves = plan(target, shards)
+    save_shard_map({"shards": target, "target": None, "moved": {}})
+
+    # Anyone who first wrote between the last pass and the switch is routed to their new shard
+    # already, so their old rows are merged into whatever they've written there since
+    for user_id, source, dest in plan(target, shards):
+        with use_shard(source):
+            snap = _snapshot(user_id)
+        with use_shard(dest):
+            _restore(user_id, snap, fresh=False)
+        with use_shard(source):
+            deletion._delete(user_id)
+        moved += 1
+    print(f"[{timestamp()}] ✅ Data now laid out over {target} shards ({moved} users moved)", flush=True)
+    return moved
+
+def status():
+    data = shard_map(refresh=True)
+    print(f"Layout: {data['shards']} shard(s); THREADLY_SHARDS={SHARD_COUNT}")
+    if data["target"] is not None:
+        print(f"Rebalance to {data['target']} shards in progress: {len(data['moved'])} users moved")
+    for shard in shard_numbers():
+        print(f"  shard {shard}: {len(users_on(shard))} users")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move Threadly users onto their shards")
+    parser.add_argument("command", nargs="?", default="rebalance", choices=("rebalance", "status"))
+    parser.add_argument("--shards", type=int, default=SHARD_COUNT, help="target shard count (default: THREADLY_SHARDS)")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+    if args.command == "status":
+        status()
+        sys.exit(0)
+    rebalance(args.shards, dry_run=args.dry_run, batch_size=args.batch_size)
+    jobs.drain()
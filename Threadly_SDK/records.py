@@ -0,0 +1,65 @@
+# records.py
+#
+# Lightweight read models for hot query paths.
+# Each record names the MemoryEvent columns it needs in __slots__; `Record.query()` selects just
+# those columns and `Record.all()` / `Record.first()` map the result rows onto slotted objects —
+# no ORM entity, identity-map entry or change tracking per row, and no unused Text columns
+# pulled off disk.
+
+from .models import MemoryEvent
+
+
+class Record:
+    __slots__ = ()
+
+    @classmethod
+    def columns(cls):
+        return [getattr(MemoryEvent, name) for name in cls.__slots__]
+
+    @classmethod
+    def query(cls, session):
+        return session.query(*cls.columns())
+
+    @classmethod
+    def from_row(cls, row):
+        record = cls.__new__(cls)
+        for name, value in zip(cls.__slots__, row):
+            setattr(record, name, value)
+        return record
+
+    @classmethod
+    def from_entity(cls, entity):
+        return cls.from_row([getattr(entity, name) for name in cls.__slots__])
+
+    @classmethod
+    def all(cls, query):
+        return [cls.from_row(row) for row in query]
+
+    @classmethod
+    def first(cls, query):
+        row = query.first()
+        return cls.from_row(row) if row is not None else None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class ThreadHead(Record):
+    """Latest message of a thread — everything routing scores a candidate thread on."""
+    __slots__ = ("id", "thread_id", "timestamp", "message_text", "topic", "topic_nuance", "subtopics", "sentiment", "resolved")
+
+
+class EventMetadata(Record):
+    """What vector-search hits return alongside the text (see embedding_utils._event_metadata)."""
+    __slots__ = ("id", "user_id", "thread_id", "message_text", "topic", "topic_nuance", "subtopics", "tags", "sentiment", "goal_label")
+
+
+class DuplicateCandidate(Record):
+    """An earlier message a new one may resubmit, with the classification it would reuse."""
+    __slots__ = ("id", "thread_id", "message_text", "topic", "topic_nuance", "subtopics", "sentiment")
+
+
+class ContextEntry(Record):
+    """A past message as the summary context formats it."""
+    __slots__ = ("thread_id", "message_text", "sentiment", "topic_nuance")
@@ -0,0 +1,135 @@
+# sharding.py
+#
+# Per-user shards. Each user's events, threads, profile, jobs and vectors live on one shard:
+# its own database (db_setup.shard_url) and its own vector store directory. Users are placed on
+# a consistent-hash ring, so changing the shard count only moves the users whose position on
+# the ring changes hands (about 1/N of them when adding a shard).
+#
+# Which ring applies is recorded in the shard map (THREADLY_SHARD_MAP), not taken from the
+# environment directly: the data stays where the map says until rebalance.py has moved it.
+# While a rebalance runs, the map also names the target shard count and the users already
+# moved to it. Every process re-reads the map within SHARD_MAP_REFRESH_SECONDS.
+#
+# Code that touches one user's data runs inside user_shard(user_id) (or a @user_scoped
+# function); every SessionLocal()/ReadSessionLocal() opened inside goes to that user's shard.
+
+import os
+import json
+import time
+import bisect
+import hashlib
+import inspect
+import functools
+import threading
+from contextlib import contextmanager
+from .db_setup import use_shard
+
+# Shards wanted; see rebalance.py for moving existing users after changing it
+SHARD_COUNT = int(os.getenv("THREADLY_SHARDS", "1"))
+SHARD_MAP_PATH = os.getenv("THREADLY_SHARD_MAP", "./shard_map.json")
+SHARD_MAP_REFRESH_SECONDS = 1.0
+VIRTUAL_NODES = 64  # ring points per shard; more points, more even spread
+
+_rings = {}
+_map = None
+_map_lock = threading.Lock()
+
+# ---------------------------
+# 💍 Hash ring
+# ---------------------------
+
+def _hash(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode("utf-8"), digest_size=8).digest(), "big")
+
+def _ring(shards):
+    ring = _rings.get(shards)
+    if ring is None:
+        points = sorted(
+            (_hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(shards) for replica in range(VIRTUAL_NODES)
+        )
+        ring = _rings[shards] = ([p for p, _ in points], [s for _, s in points])
+    return ring
+
+def ring_shard(user_id, shards):
+    """Shard `user_id` belongs on when data is spread over `shards` shards."""
+    if shards <= 1:
+        return 0
+    points, owners = _ring(shards)
+    return owners[bisect.bisect(points, _hash(user_id)) % len(points)]
+
+# ---------------------------
+# 🗺️ Shard map
+# ---------------------------
+
+def _read_map():
+    try:
+        with open(SHARD_MAP_PATH) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        # No map yet: everything is still in the one original database
+        data = {}
+    return {
+        "shards": int(data.get("shards", 1)),
+        "target": data.get("target"),
+        "moved": dict(data.get("moved") or {}),
+    }
+
+def shard_map(refresh=False):
+    """{"shards": N, "target": M or None, "moved": {user_id: last copied event id}}"""
+    global _map
+    with _map_lock:
+        if refresh or _map is None or time.time() - _map[0] >= SHARD_MAP_REFRESH_SECONDS:
+            _map = (time.time(), _read_map())
+        return _map[1]
+
+def save_shard_map(data):
+    tmp = f"{SHARD_MAP_PATH}.tmp"
+    with open(tmp, "w") as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, SHARD_MAP_PATH)
+    shard_map(refresh=True)
+
+def shard_for_user(user_id):
+    data = shard_map()
+    if data["target"] is not None and str(user_id) in data["moved"]:
+        return ring_shard(user_id, data["target"])
+    return ring_shard(user_id, data["shards"])
+
+def shard_numbers():
+    """Every shard that may hold data right now (both layouts while a rebalance runs)."""
+    data = shard_map()
+    return range(max(data["shards"], data["target"] or 0))
+
+def check_layout():
+    """Warn when THREADLY_SHARDS asks for a layout the data hasn't been moved to yet."""
+    data = shard_map()
+    if data["target"] is None and data["shards"] != SHARD_COUNT:
+        print(
+            f"⚠️ THREADLY_SHARDS={SHARD_COUNT} but data is laid out over {data['shards']} shard(s); "
+            f"run `python -m Threadly_SDK.rebalance` to move it.",
+            flush=True,
+        )
+
+# ---------------------------
+# 🔀 Routing
+# ---------------------------
+
+@contextmanager
+def user_shard(user_id):
+    """Route the sessions, vector stores and jobs opened inside to `user_id`'s shard."""
+    with use_shard(shard_for_user(user_id)) as shard:
+        yield shard
+
+def user_scoped(fn):
+    """Run `fn` on the shard of its `user_id` argument."""
+    signature = inspect.signature(fn)
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        user_id = signature.bind_partial(*args, **kwargs).arguments.get("user_id")
+        if user_id is None:
+            return fn(*args, **kwargs)
+        with user_shard(user_id):
+            return fn(*args, **kwargs)
+    return wrapper
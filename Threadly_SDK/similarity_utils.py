@@ -45,13 +45,14 @@ def batch_nuance_similarity(current: str, references: List[str], threshold: floa
     return sorted(results, key=lambda x: x[1], reverse=True)
 
 
-def get_embedding_similarity(text_a: str, text_b: str) -> float:
+def get_embedding_similarity(text_a: str, text_b: str, vector_b=None) -> float:
     """
     Compute cosine similarity between the embeddings of two texts.
+    Pass `vector_b` when text_b's embedding is already at hand to skip looking it up.
     """
     try:
         vec_a = normalize_vector(get_embedding(text_a))
-        vec_b = normalize_vector(get_embedding(text_b))
+        vec_b = normalize_vector(vector_b if vector_b is not None else get_embedding(text_b))
         similarity = float(np.dot(vec_a, vec_b))
         logging.info(f"🧠 Embedding similarity between A and B: {similarity:.3f}")
         return similarity
@@ -1,21 +1,25 @@
-import os
-from openai import OpenAI
-from tenacity import retry, stop_after_attempt, wait_random_exponential
 from .context_summary import build_summary_prompt
 from .curiosity import generate_curiosity_prompt
+from .clients import chat_completion, CHAT_TIMEOUT
+from .rate_limiter import NORMAL
+from .deadline import run_stage, call_timeout
+from .fallbacks import template_summary
+from . import summary_cache
 
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+SUMMARY_MODEL = "gpt-4o"
 
-@retry(wait=wait_random_exponential(min=1, max=5), stop=stop_after_attempt(3))
-def call_gpt_summary(prompt):
-    response = client.chat.completions.create(
-        model="gpt-4o",
+def call_gpt_summary(prompt, priority=NORMAL):
+    # Retries/backoff come from the shared client policy in clients.py
+    response = chat_completion(
+        model=SUMMARY_MODEL,
         messages=[{"role": "system", "content": prompt}],
         temperature=0.5,  # slightly higher for richer detail
+        priority=priority,
+        timeout=call_timeout(CHAT_TIMEOUT),
     )
     return response.choices[0].message.content.strip()
 
-def summarize_memories(memory_list, user_id, mode="neutral"):
+def summarize_memories(memory_list, user_id, mode="neutral", priority=NORMAL):
     if not memory_list:
         return {
             "theme": "No theme detected yet.",
@@ -35,6 +39,12 @@ def summarize_memories(memory_list, user_id, mode="neutral"):
         else:
             processed.append(f"{text}")
 
+    # 🗃️ Same model + mode + entries → same summary; skip the call entirely
+    cache_key = summary_cache.cache_key(SUMMARY_MODEL, mode, processed)
+    cached = summary_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
     # 🧠 Build a prompt that nudges for slightly more verbosity
     prompt = build_summary_prompt(processed, user_id) + """
 
@@ -44,7 +54,9 @@ Write each section in 1–2 sentences, adding helpful detail only when it exists
 - Provide enough to feel informative, but avoid repeating the same point."""
 
     try:
-        raw = call_gpt_summary(prompt)
+        raw = run_stage("summary", lambda: call_gpt_summary(prompt, priority=priority), lambda: None)
+        if raw is None:
+            return template_summary(processed)
         lines = [line.strip() for line in raw.splitlines() if line.strip()]
         parsed = {
             "theme": "",
@@ -76,20 +88,40 @@ Write each section in 1–2 sentences, adding helpful detail only when it exists
                 parsed[current_section] += " " + line.strip()
 
         # Curiosity fallback
+        cacheable = True
         if not parsed["consider_next"] or len(parsed["consider_next"]) < 10:
             latest_message = processed[-1]
             past_topics = []
-            parsed["consider_next"] = generate_curiosity_prompt(latest_message, past_topics)
 
-        return {
+            def canned_check_in():
+                nonlocal cacheable
+                cacheable = False  # don't pin a degraded answer in the cache
+                return "Want to say more about that?"
+
+            try:
+                parsed["consider_next"] = run_stage(
+                    "curiosity",
+                    lambda: generate_curiosity_prompt(latest_message, past_topics),
+                    canned_check_in
+                )
+            except Exception as e:
+                # Curiosity is optional (and sheddable) — never fail the whole reflection over it
+                print(f"[⚠️ Curiosity Skipped] {e}")
+                parsed["consider_next"] = canned_check_in()
+
+        summary = {
             "theme": parsed["theme"] or "Still forming.",
             "reflection_summary": parsed["reflection_summary"] or "Still early to summarize meaningfully.",
             "momentum": parsed["momentum"] or "You might be circling around something. Let’s keep watching.",
             "change": parsed["change"] or "No major shift clearly stated yet — but maybe one is starting.",
             "consider_next": parsed["consider_next"]
         }
+        if cacheable:
+            summary_cache.put(cache_key, summary)
+        return summary
 
     except Exception as e:
+        # Errors are returned but never cached
         return {
             "theme": "Reflection Failed",
             "reflection_summary": f"(⚠️ Couldn't generate reflection: {str(e)[:80]})",
@@ -0,0 +1,87 @@
+# summary_cache.py
+#
+# Content-addressed cache for summarize_memories results.
+# The key is a hash of (model, mode, processed entries) — the only inputs the summary prompt
+# depends on — so retries, repeated follow-ups and never-changing resolved threads reuse the
+# parsed summary dict instead of paying for another gpt-4o call.
+# Two tiers: an in-process LRU with TTL, backed by the `summary_cache` table so results
+# survive restarts and are shared across workers. Only clean model results are ever stored;
+# "Reflection Failed" errors and degraded/template output never are.
+
+import json
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from sqlalchemy.exc import IntegrityError
+from .db_setup import SessionLocal
+from .models import SummaryCacheEntry
+
+MEMORY_CACHE_SIZE = 1024
+CACHE_TTL_SECONDS = 7 * 24 * 3600
+PRUNE_EVERY_WRITES = 200  # expired persistent rows are swept every N writes
+
+_memory = OrderedDict()  # key → (expires_at, summary)
+_lock = threading.Lock()
+_writes = 0
+
+def cache_key(model, mode, processed_entries):
+    payload = json.dumps([model, mode, list(processed_entries)], ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+def get(key):
+    now = time.time()
+    with _lock:
+        hit = _memory.get(key)
+        if hit:
+            expires_at, summary = hit
+            if expires_at > now:
+                _memory.move_to_end(key)
+                return dict(summary)
+            del _memory[key]
+
+    session = SessionLocal()
+    try:
+        row = session.query(SummaryCacheEntry).filter_by(key=key).first()
+        if not row or row.created_at < datetime.utcnow() - timedelta(seconds=CACHE_TTL_SECONDS):
+            return None
+        summary = json.loads(row.value)
+        expires_at = row.created_at.replace(tzinfo=timezone.utc).timestamp() + CACHE_TTL_SECONDS  # stored as naive UTC
+    except Exception as e:
+        print(f"[⚠️ Summary Cache Read Error] {e}")
+        return None
+    finally:
+        session.close()
+
+    _remember(key, summary, expires_at)
+    return dict(summary)
+
+def _remember(key, summary, expires_at):
+    with _lock:
+        _memory[key] = (expires_at, dict(summary))
+        _memory.move_to_end(key)
+        while len(_memory) > MEMORY_CACHE_SIZE:
+            _memory.popitem(last=False)
+
+def put(key, summary):
+    global _writes
+    _remember(key, summary, time.time() + CACHE_TTL_SECONDS)
+
+    session = SessionLocal()
+    try:
+        session.merge(SummaryCacheEntry(key=key, value=json.dumps(summary), created_at=datetime.utcnow()))
+        with _lock:
+            _writes += 1
+            prune = _writes % PRUNE_EVERY_WRITES == 0
+        if prune:
+            cutoff = datetime.utcnow() - timedelta(seconds=CACHE_TTL_SECONDS)
+            session.query(SummaryCacheEntry).filter(SummaryCacheEntry.created_at < cutoff).delete()
+        session.commit()
+    except IntegrityError:
+        session.rollback()  # a concurrent writer stored the same key — same content, nothing to do
+    except Exception as e:
+        session.rollback()
+        print(f"[⚠️ Summary Cache Write Error] {e}")
+    finally:
+        session.close()
@@ -0,0 +1,69 @@
+# thread_activity.py
+#
+# Per-thread recency for history.list_threads.
+# `thread_activity` holds one row per thread (first and last message time, message count,
+# latest event) under an index on (user_id, last_activity, thread_id), so a page of a user's
+# threads is a keyset range scan of that index. Ingestion updates the row in the event's own
+# transaction; deletion and rebalancing, which remove or re-id events, recompute the rows of
+# the threads they touch from memory_events. init_db backfills shards that predate the table.
+
+from sqlalchemy import func, select, insert
+from .db_setup import get_engine, current_shard
+from .models import MemoryEvent, ThreadActivity
+
+def _chunks(values, size=500):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+def _from_events(*conditions):
+    # The activity rows memory_events implies for the threads matching `conditions`
+    return (
+        select(
+            MemoryEvent.thread_id,
+            func.max(MemoryEvent.user_id),
+            func.min(MemoryEvent.timestamp),
+            func.max(MemoryEvent.timestamp),
+            func.count(MemoryEvent.id),
+            func.max(MemoryEvent.id),
+        )
+        .where(MemoryEvent.thread_id.isnot(None), MemoryEvent.timestamp.isnot(None), *conditions)
+        .group_by(MemoryEvent.thread_id)
+    )
+
+_COLUMNS = ["thread_id", "user_id", "started_at", "last_activity", "message_count", "last_event_id"]
+
+def record_event(session, event):
+    """Count a just-flushed event towards its thread's row, in the caller's transaction."""
+    updated = (
+        session.query(ThreadActivity)
+        .filter(ThreadActivity.thread_id == event.thread_id)
+        .update({
+            ThreadActivity.last_activity: event.timestamp,  # a new event is its thread's latest
+            ThreadActivity.message_count: ThreadActivity.message_count + 1,
+            ThreadActivity.last_event_id: event.id,
+        }, synchronize_session=False)
+    )
+    if not updated:
+        session.add(ThreadActivity(
+            thread_id=event.thread_id, user_id=event.user_id, started_at=event.timestamp,
+            last_activity=event.timestamp, message_count=1, last_event_id=event.id,
+        ))
+
+def refresh(session, thread_ids):
+    """Recompute the given threads' rows from their remaining events (dropping emptied threads)."""
+    for chunk in _chunks(set(thread_ids)):
+        session.query(ThreadActivity).filter(ThreadActivity.thread_id.in_(chunk)).delete(synchronize_session=False)
+        session.execute(
+            insert(ThreadActivity).from_select(_COLUMNS, _from_events(MemoryEvent.thread_id.in_(chunk)))
+        )
+
+def ensure_thread_activity(shard=None):
+    """Fill the table on a shard (default: the current one) whose events predate it."""
+    shard = current_shard() if shard is None else shard
+    with get_engine(shard).begin() as conn:
+        if conn.execute(select(ThreadActivity.thread_id).limit(1)).first() is not None:
+            return
+        if conn.execute(select(MemoryEvent.id).limit(1)).first() is None:
+            return
+        conn.execute(insert(ThreadActivity).from_select(_COLUMNS, _from_events()))
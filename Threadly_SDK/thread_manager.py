@@ -1,10 +1,14 @@
 import uuid
 import re
+import numpy as np
 from datetime import datetime, timedelta
-from .db_setup import SessionLocal
 from .models import MemoryEvent
+from .records import ThreadHead
+from .unit_of_work import read_scope
 from .similarity_utils import get_nuance_similarity, get_embedding_similarity
-from .embedding_utils import get_embedding, search_thread_signatures
+from .embedding_utils import get_embedding, search_thread_signatures, get_thread_signatures, normalize_vector
+from . import working_set
+from .deadline import stage_fits, record_degraded
 
 # ---------------------------
 # Configurable thresholds (defaults)
@@ -37,13 +41,22 @@ def get_active_thread_id(
     current_message_text: str = "",
     current_topic: str = "",
     current_subtopics: list[str] = None,
-    embedding_threshold: float = THREAD_EMBEDDING_SIMILARITY_THRESHOLD
+    embedding_threshold: float = THREAD_EMBEDDING_SIMILARITY_THRESHOLD,
+    session=None
 ) -> tuple[str, bool]:
     """
     Decide which thread a new message belongs to.
     Uses topic match → candidate gathering (FAISS + recent threads + last thread) → scoring (nuance, subtopics, embeddings).
+    Reads through `session` or the current unit of work's; otherwise a short-lived read-only session.
     """
-    session = SessionLocal()
+    with read_scope(session) as read_session:
+        return _select_thread(
+            read_session, user_id, current_nuance, dominant_emotion, debug_log,
+            current_message_text, current_topic, current_subtopics, embedding_threshold
+        )
+
+def _select_thread(session, user_id, current_nuance, dominant_emotion, debug_log,
+                   current_message_text, current_topic, current_subtopics, embedding_threshold):
     now = datetime.utcnow()
     thread_is_intensifying = False
     reference_past_issue = False
@@ -52,70 +65,69 @@ def get_active_thread_id(
     best_reason = "no prior thread matched"
 
     current_subtopics = current_subtopics or []
-    _ = get_embedding(current_message_text)  # cache side effect
+    # ⏱️ Embedding signals are skipped when the request's latency budget can't afford them
+    use_embeddings = stage_fits("routing_embeddings")
+    if use_embeddings:
+        current_vector = normalize_vector(get_embedding(current_message_text))
+    else:
+        record_degraded("routing_embeddings", "scored candidates without embedding similarity")
+
+    # 🗂️ Recent thread heads, topic recency and signatures come from the user's working set;
+    # SQL is only touched to load it, or for users with more active threads than it holds
+    ws = working_set.get(user_id, session)
+    recent_cutoff = now - timedelta(days=THREAD_MAX_DAYS_OLD)
 
     # 🧠 First: Direct topic match fallback
     if current_topic:
-        recent_cutoff = now - timedelta(days=THREAD_MAX_DAYS_OLD)
-        topic_matched_threads = (
-            session.query(MemoryEvent)
-            .filter(MemoryEvent.user_id == user_id)
-            .filter(MemoryEvent.topic == current_topic)
-            .filter(MemoryEvent.timestamp >= recent_cutoff)
-            .order_by(MemoryEvent.timestamp.desc())
-            .all()
-        )
-        if topic_matched_threads:
-            best_thread_id = topic_matched_threads[0].thread_id
+        topic_matched_thread = ws.thread_for_topic(current_topic, recent_cutoff)
+        if topic_matched_thread:
+            best_thread_id = topic_matched_thread
             best_reason = "recent thread with same topic"
             reference_past_issue = True
 
     # 🧠 Second: Build candidate set
     candidate_thread_ids = set()
     if not best_thread_id:
-        # (a) FAISS shortlist
-        matched_threads = search_thread_signatures(current_message_text, user_id=user_id, top_k=5)
+        # (a) Signature shortlist
+        if not use_embeddings:
+            matched_threads = []
+        elif ws.complete:
+            matched_threads = ws.search_signatures(current_vector, top_k=5)
+        else:
+            matched_threads = search_thread_signatures(
+                current_message_text, user_id=user_id, top_k=5, max_age_days=THREAD_MAX_DAYS_OLD
+            )
         candidate_thread_ids.update(tid for tid, _ in matched_threads)
 
         # (b) Last N recent threads
-        recent_cutoff = now - timedelta(days=THREAD_MAX_DAYS_OLD)
-        recent_events = (
-            session.query(MemoryEvent)
-            .filter(MemoryEvent.user_id == user_id)
-            .filter(MemoryEvent.timestamp >= recent_cutoff)
-            .order_by(MemoryEvent.timestamp.desc())
-            .all()
-        )
-        seen_threads = {}
-        for ev in recent_events:
-            if ev.thread_id not in seen_threads:
-                seen_threads[ev.thread_id] = ev
-            if len(seen_threads) >= RECENT_THREAD_LIMIT:
-                break
-        candidate_thread_ids.update(seen_threads.keys())
+        candidate_thread_ids.update(ws.recent_threads(recent_cutoff, RECENT_THREAD_LIMIT))
 
         # (c) Always include last event’s thread
-        last_event = (
-            session.query(MemoryEvent)
-            .filter_by(user_id=user_id)
-            .order_by(MemoryEvent.timestamp.desc())
-            .first()
-        )
-        if last_event:
-            candidate_thread_ids.add(last_event.thread_id)
+        last_thread_id = ws.last_thread_id()
+        if last_thread_id:
+            candidate_thread_ids.add(last_thread_id)
+
+    # 🔑 One signature (running centroid) per candidate thread — scoring embeds nothing further
+    signatures = {}
+    if use_embeddings:
+        signatures = ws.signature_vectors(candidate_thread_ids)
+        missing = candidate_thread_ids - signatures.keys()
+        if missing and not ws.complete:
+            signatures.update(get_thread_signatures(user_id, missing))
 
     # 🧠 Third: Score candidates
     best_emb_sim = -1.0
     candidate_debug = []  # 👈 collect debug info per candidate
     for thread_id in candidate_thread_ids:
-        recent_msg = (
-            session.query(MemoryEvent)
-            .filter_by(user_id=user_id, thread_id=thread_id)
-            .order_by(MemoryEvent.timestamp.desc())
-            .first()
-        )
+        recent_msg, recent_vector = ws.head(thread_id)
+        if recent_msg is None and not ws.complete:
+            recent_msg = ThreadHead.first(
+                ThreadHead.query(session)
+                .filter_by(user_id=user_id, thread_id=thread_id)
+                .order_by(MemoryEvent.timestamp.desc())
+            )
         if not recent_msg:
-            continue
+            continue  # not among the working set's heads: inactive for longer than the window
 
         days_old = (now - recent_msg.timestamp).days
         if days_old > THREAD_MAX_DAYS_OLD:
@@ -124,7 +136,7 @@ def get_active_thread_id(
         nuance_match = get_nuance_similarity(current_nuance, recent_msg.topic_nuance)
         emotion_shift = recent_msg.sentiment != dominant_emotion
         is_ambiguous = detect_ambiguous_reference(current_message_text)
-        past_subtopics = [s.strip() for s in recent_msg.subtopics.split(",") if s.strip()]
+        past_subtopics = [s.strip() for s in (recent_msg.subtopics or "").split(",") if s.strip()]
         subtopic_overlap = count_overlap(current_subtopics, past_subtopics)
         topic_match = (recent_msg.topic == current_topic)
 
@@ -144,8 +156,13 @@ def get_active_thread_id(
             score += 0.3
             reasons.append("ambiguous reference")
 
-        # 🔑 Embedding similarity
-        emb_sim = get_embedding_similarity(current_message_text, recent_msg.message_text)
+        # 🔑 Embedding similarity against the thread's centroid (its latest message if it has none yet)
+        if not use_embeddings:
+            emb_sim = 0.0
+        elif thread_id in signatures:
+            emb_sim = float(np.dot(current_vector, np.asarray(signatures[thread_id]).reshape(-1)))
+        else:
+            emb_sim = get_embedding_similarity(current_message_text, recent_msg.message_text, vector_b=recent_vector)
         if emb_sim > best_emb_sim:
             best_emb_sim = emb_sim
         if emb_sim >= embedding_threshold:
@@ -174,8 +191,6 @@ def get_active_thread_id(
         if recent_msg.resolved:
             reference_past_issue = True
 
-    session.close()
-
     # 🧾 Debug logging
     if debug_log is not None:
         debug_log["thread_selection_method"] = "topic + embedding scoring (FAISS + recent + last)"
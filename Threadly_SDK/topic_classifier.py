@@ -0,0 +1,189 @@
+# topic_classifier.py
+#
+# Local topic classifier trained from the topics the LLM already assigned.
+# Each topic keeps a running centroid of its messages' embeddings (from the memory vector store);
+# a new message whose embedding sits clearly closest to one centroid is classified locally
+# and never reaches classify_topic's gpt-4 call. Low-confidence messages escalate to the LLM,
+# whose answer is then folded back into the centroids. Centroids are (re)built from stored
+# labels on a background thread; until the first build finishes every message escalates.
+
+import os
+import time
+import random
+import threading
+import numpy as np
+from .db_setup import SessionLocal, use_shard
+from .sharding import shard_numbers
+from .models import MemoryEvent
+from .fallbacks import first_clause, TOPIC_KEYWORDS, PAST_REFERENCE
+
+LOCAL_TOPIC_CLASSIFIER = os.getenv("THREADLY_LOCAL_TOPIC_CLASSIFIER", "1") == "1"
+MIN_EXAMPLES_PER_TOPIC = 8      # topics with fewer labelled messages are never predicted locally
+CONFIDENT_SIMILARITY = 0.45     # cosine to the best centroid needed to skip the LLM
+CONFIDENT_MARGIN = 0.06         # ...and how far ahead of the runner-up it must be
+SHADOW_SAMPLE_RATE = 0.05       # share of confident hits still sent to the LLM to measure agreement
+REBUILD_INTERVAL_SECONDS = 600  # re-read labels so centroids include other workers' messages
+MAX_TRAINING_EVENTS = 20000
+
+
+class CentroidTopicClassifier:
+    def __init__(self):
+        self.sums = {}
+        self.counts = {}
+        self.built_at = None
+        self.rebuilding = False
+        self.lock = threading.Lock()
+        self.stats = {
+            "local_hits": 0,
+            "escalations": 0,
+            "shadow_checks": 0,
+            "agreements": 0,
+            "disagreements": 0,
+        }
+
+    def rebuild(self):
+        from .embedding_utils import get_memory_store
+
+        # Topics are shared by every user, so learn from each shard's most recent messages
+        shards = list(shard_numbers())
+        sums, counts = {}, {}
+        for shard in shards:
+            with use_shard(shard):
+                session = SessionLocal()
+                try:
+                    labelled = (
+                        session.query(MemoryEvent.id, MemoryEvent.topic)
+                        .filter(MemoryEvent.topic.isnot(None), MemoryEvent.topic != "", MemoryEvent.topic != "unknown")
+                        .order_by(MemoryEvent.id.desc())
+                        .limit(MAX_TRAINING_EVENTS // len(shards))
+                        .all()
+                    )
+                finally:
+                    session.close()
+                vectors = get_memory_store().get_many([event_id for event_id, _ in labelled])
+
+            for event_id, topic in labelled:
+                vec = vectors.get(event_id)
+                if vec is None:
+                    continue
+                sums[topic] = sums.get(topic, 0) + vec
+                counts[topic] = counts.get(topic, 0) + 1
+
+        with self.lock:
+            self.sums, self.counts = sums, counts
+            self.built_at = time.monotonic()
+        print(f"🎯 Topic centroids rebuilt: {sum(counts.values())} messages across {len(counts)} topics", flush=True)
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"[⚠️ Topic Centroid Rebuild Error] {e}", flush=True)
+            with self.lock:
+                self.built_at = time.monotonic()  # retried after the next interval
+        finally:
+            with self.lock:
+                self.rebuilding = False
+
+    def _maybe_rebuild(self):
+        # Never on the caller's thread: predictions keep using the current centroids meanwhile
+        with self.lock:
+            due = self.built_at is None or time.monotonic() - self.built_at > REBUILD_INTERVAL_SECONDS
+            if not due or self.rebuilding:
+                return
+            self.rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, name="topic-centroids", daemon=True).start()
+
+    def learn(self, vector, topic):
+        if not topic or topic == "unknown":
+            return
+        with self.lock:
+            self.sums[topic] = self.sums.get(topic, 0) + vector
+            self.counts[topic] = self.counts.get(topic, 0) + 1
+
+    def predict(self, vector):
+        """Return (topic, similarity, margin) for the closest trained centroid, or None."""
+        self._maybe_rebuild()
+        with self.lock:
+            topics = [t for t, c in self.counts.items() if c >= MIN_EXAMPLES_PER_TOPIC]
+            if not topics:
+                return None
+            centroids = np.stack([self.sums[t] for t in topics]).astype("float32")
+        centroids /= np.linalg.norm(centroids, axis=1, keepdims=True)
+        sims = centroids @ vector
+        order = np.argsort(-sims)
+        best = float(sims[order[0]])
+        runner_up = float(sims[order[1]]) if len(order) > 1 else -1.0
+        return topics[order[0]], best, best - runner_up
+
+
+_classifier = CentroidTopicClassifier()
+
+def local_topic_guess(message_text):
+    """Best local guess for the message's topic, or None when disabled/untrained/unembeddable."""
+    if not LOCAL_TOPIC_CLASSIFIER:
+        return None
+    from .embedding_utils import get_embedding, normalize_vector
+    try:
+        vector = normalize_vector(get_embedding(message_text))
+        prediction = _classifier.predict(vector)
+    except Exception as e:
+        print(f"[⚠️ Local Topic Error] {e}")
+        return None
+    if prediction is None:
+        return {"vector": vector, "topic": None, "confident": False}
+
+    topic, similarity, margin = prediction
+    return {
+        "vector": vector,
+        "topic": topic,
+        "similarity": round(similarity, 3),
+        "margin": round(margin, 3),
+        "confident": similarity >= CONFIDENT_SIMILARITY and margin >= CONFIDENT_MARGIN,
+    }
+
+def take_local_answer(guess):
+    """Decide whether a confident guess answers the message, or is shadow-checked by the LLM."""
+    if not guess or not guess["confident"]:
+        return False
+    if random.random() < SHADOW_SAMPLE_RATE:
+        with _classifier.lock:
+            _classifier.stats["shadow_checks"] += 1
+        return False
+    with _classifier.lock:
+        _classifier.stats["local_hits"] += 1
+    return True
+
+def local_classification(message_text, topic, guess=None):
+    """classify_topic-shaped result for a locally chosen topic."""
+    words = set((message_text or "").lower().split())
+    return {
+        "topic": topic,
+        "topic_nuance": first_clause(message_text),
+        "subtopics": [k for k in TOPIC_KEYWORDS.get(topic, []) if k in words][:3],
+        "reference_past_issue": bool(PAST_REFERENCE.search(message_text or "")),
+        "source": "centroid",
+        "confidence": guess.get("similarity") if guess else None,
+    }
+
+def record_llm_topic(guess, llm_topic):
+    """Fold an LLM answer back into the centroids and track agreement with the local guess."""
+    if guess is None:
+        return
+    with _classifier.lock:
+        if not guess["confident"]:
+            _classifier.stats["escalations"] += 1
+        if guess["topic"] is not None:
+            key = "agreements" if guess["topic"] == llm_topic else "disagreements"
+            _classifier.stats[key] += 1
+    _classifier.learn(guess["vector"], llm_topic)
+
+def classifier_stats():
+    with _classifier.lock:
+        stats = dict(_classifier.stats)
+        stats["trained_topics"] = sum(1 for c in _classifier.counts.values() if c >= MIN_EXAMPLES_PER_TOPIC)
+    answered = stats["local_hits"] + stats["escalations"] + stats["shadow_checks"]
+    compared = stats["agreements"] + stats["disagreements"]
+    stats["hit_rate"] = round(stats["local_hits"] / answered, 3) if answered else None
+    stats["agreement_rate"] = round(stats["agreements"] / compared, 3) if compared else None
+    return stats
@@ -0,0 +1,102 @@
+# unit_of_work.py
+#
+# Request-scoped unit of work.
+# /message opens one unit of work; ingestion, routing and the response build all pick up its
+# session implicitly (or take one via `session=`), so rows loaded by one step are already in
+# the identity map for the next, the request's writes land in a single commit, and the
+# connection is always released — on errors too.
+# Work that must only happen once the writes are durable (enqueueing jobs) registers with
+# on_commit() and runs right after the commit succeeds; a rollback discards it.
+# `memo` holds checks a step only needs to make once per unit (e.g. working_set.py's version
+# stamp), so later steps of the same request reuse the answer instead of querying again.
+
+import contextvars
+from contextlib import contextmanager
+from .db_setup import SessionLocal, ReadSessionLocal
+
+_current = contextvars.ContextVar("threadly_unit_of_work", default=None)
+
+
+class UnitOfWork:
+    def __init__(self, session=None):
+        self.owns_session = session is None
+        self.session = session if session is not None else SessionLocal()
+        self._hooks = []
+        self.memo = {}
+
+    def on_commit(self, fn, *args, **kwargs):
+        self._hooks.append((fn, args, kwargs))
+
+    def commit(self):
+        self.session.commit()
+        hooks, self._hooks = self._hooks, []
+        for fn, args, kwargs in hooks:
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f"[⚠️ On-Commit Hook Error] {getattr(fn, '__name__', fn)}: {e}", flush=True)
+
+    def release(self):
+        """
+        Commit what's pending and hand the connection back to the pool before slow non-DB work
+        (model calls); the session checks one out again on its next query.
+        """
+        self.commit()
+
+    def rollback(self):
+        self.session.rollback()
+        self._hooks = []
+
+
+@contextmanager
+def unit_of_work(session=None):
+    """
+    Join the current unit of work, or open a new one (on `session`, if given).
+    Only the outermost unit commits on a clean exit; any error rolls it back. A session this
+    opened is always closed.
+    """
+    current = _current.get()
+    if current is not None and (session is None or session is current.session):
+        yield current
+        return
+
+    uow = UnitOfWork(session)
+    token = _current.set(uow)
+    try:
+        yield uow
+        uow.commit()
+    except BaseException:
+        uow.rollback()
+        raise
+    finally:
+        _current.reset(token)
+        if uow.owns_session:
+            uow.session.close()
+
+def current_unit_of_work():
+    return _current.get()
+
+@contextmanager
+def read_scope(session=None):
+    """
+    Session for a read-only step: `session` if given, else the current unit of work's,
+    else a fresh read-only session closed on exit.
+    """
+    if session is None and _current.get() is not None:
+        session = _current.get().session
+    if session is not None:
+        yield session
+        return
+
+    session = ReadSessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+def after_commit(fn, *args, **kwargs):
+    """Run `fn` once the current unit of work commits, or right away if there is none."""
+    uow = _current.get()
+    if uow is None:
+        return fn(*args, **kwargs)
+    uow.on_commit(fn, *args, **kwargs)
@@ -0,0 +1,760 @@
+import os
+import json
+import time
+import fcntl
+import numpy as np
+from contextlib import contextmanager
+from sqlalchemy import func, update, bindparam, and_, or_, not_
+from .db_setup import SessionLocal
+from .models import VectorRow
+
+# ---------------------------
+# Storage defaults
+# ---------------------------
+VECTOR_STORE_DIR = os.getenv("THREADLY_VECTOR_DIR", "./vector_store")
+VECTOR_STORAGE = os.getenv("THREADLY_VECTOR_STORAGE", "float32")  # float32 | float16 | int8
+RERANK_OVERSAMPLE = 4  # compressed search shortlists top_k × this before the exact re-rank
+
+STORAGE_MODES = ("float32", "float16", "int8")
+
+def shard_directory(shard: int) -> str:
+    """Where a shard's stores live (see sharding.py); shard 0 keeps the top-level directory."""
+    return VECTOR_STORE_DIR if shard == 0 else os.path.join(VECTOR_STORE_DIR, f"shard{shard}")
+
+# ---------------------------
+# Segments and compaction
+# ---------------------------
+SEGMENT_SPAN = 1 << 32           # global row = segment × span + offset within the segment's files
+COMPACT_DEAD_FRACTION = float(os.getenv("THREADLY_COMPACT_DEAD_FRACTION", "0.3"))
+COMPACT_MIN_DEAD_ROWS = 256      # below this a segment isn't worth rewriting
+COMPACT_CHUNK_ROWS = 4096        # rows copied per read during compaction
+RETIRED_GRACE_SECONDS = 300      # compacted-away files outlive searches that started before
+
+# ---------------------------
+# Time partitioning
+# ---------------------------
+SEGMENT_DAYS = int(os.getenv("THREADLY_SEGMENT_DAYS", "7"))  # appends roll to a new segment per period; 0 = never
+QUANTIZE_AFTER_DAYS = int(os.getenv("THREADLY_QUANTIZE_AFTER_DAYS", "90"))  # older segments compact to int8; 0 = never
+QUANTIZED_SPEC = {"storage": "int8", "rerank": False}
+
+# ---------------------------
+# Applied-sequence watermarks (see ingest_log.py)
+# ---------------------------
+def _watermark_path(name, directory):
+    return os.path.join(directory, name + ".seq")
+
+def read_watermark(name: str, directory: str = VECTOR_STORE_DIR) -> int:
+    """Highest ingest-log sequence number at or below which every write to this store is applied."""
+    try:
+        with open(_watermark_path(name, directory)) as f:
+            return int(f.read().strip() or 0)
+    except (FileNotFoundError, ValueError):
+        return 0
+
+def write_watermark(name: str, seq: int, directory: str = VECTOR_STORE_DIR):
+    path = _watermark_path(name, directory)
+    os.makedirs(directory, exist_ok=True)
+    with open(path + ".tmp", "w") as f:
+        f.write(str(int(seq)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + ".tmp", path)  # atomic: readers see the old or the new value, never half
+
+
+class VectorStore:
+    """
+    Interface for a keyed vector store.
+    Keys are `MemoryEvent.id` values; every vector carries the user/thread it belongs to
+    so searches can be scoped without loading anything else.
+    """
+
+    def add(self, key: int, vector, user_id: str, thread_id: str) -> None:
+        raise NotImplementedError
+
+    def search(self, vector, top_k: int = 5, user_id: str = None, thread_id: str = None, since: float = None) -> list:
+        """
+        Return up to `top_k` `(key, score, vector)` tuples, best (highest cosine) first.
+        `since` (unix time) lets time-partitioned backends skip vectors last written before it.
+        """
+        raise NotImplementedError
+
+    def get(self, key: int):
+        raise NotImplementedError
+
+    def replace(self, key: int, vector, session=None) -> None:
+        """
+        Overwrite the vector stored under `key`; KeyError if there is none. With `session`, any
+        metadata change joins that session's transaction (the caller commits).
+        """
+        raise NotImplementedError
+
+    def delete(self, keys: list = None, user_id: str = None, thread_id: str = None, session=None) -> int:
+        """
+        Drop the vectors matching every given filter; returns how many. With `session` the
+        delete joins that session's transaction (the caller commits).
+        """
+        raise NotImplementedError
+
+    def compact(self) -> dict:
+        """Reclaim space left by deleted vectors; backends without dead space do nothing."""
+        return {}
+
+    def count(self) -> int:
+        raise NotImplementedError
+
+    def reset(self) -> None:
+        raise NotImplementedError
+
+    # Batched variants; backends with a cheaper bulk path override these
+    def add_many(self, items: list, session=None) -> None:
+        """
+        `items` is a list of `(key, vector, user_id, thread_id)` tuples. With `session`, the rows'
+        metadata joins that session's transaction (the caller commits) where the backend supports it.
+        """
+        for key, vector, user_id, thread_id in items:
+            self.add(key, vector, user_id, thread_id)
+
+    def search_many(self, queries: list) -> list:
+        """`queries` is a list of dicts with `vector` plus optional `top_k`, `user_id`, `thread_id`, `since`."""
+        return [self.search(**q) for q in queries]
+
+    def get_many(self, keys: list) -> dict:
+        """Map of key → vector for the keys that exist."""
+        vectors = {}
+        for key in keys:
+            vec = self.get(key)
+            if vec is not None:
+                vectors[key] = vec
+        return vectors
+
+
+class _MappedMatrix:
+    """Row matrix in a flat file, memory-mapped read-only and re-mapped as it grows."""
+
+    def __init__(self, path: str, dtype: str, width: int):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.width = width
+        self.row_bytes = width * self.dtype.itemsize
+        self._mm = None
+        self._mapped_rows = 0
+
+    def rows(self) -> int:
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // self.row_bytes
+
+    def append(self, values) -> int:
+        # Caller holds the store lock
+        with open(self.path, "ab") as f:
+            row = f.tell() // self.row_bytes
+            f.write(np.asarray(values, dtype=self.dtype).tobytes())
+        return row
+
+    def write(self, row, values):
+        # Caller holds the store lock; mapped views see the new bytes through the page cache
+        with open(self.path, "r+b") as f:
+            f.seek(row * self.row_bytes)
+            f.write(np.asarray(values, dtype=self.dtype).tobytes())
+
+    def view(self, min_rows: int = 0):
+        n = self.rows()
+        if self._mm is None or n != self._mapped_rows:
+            if n == 0:
+                self._mm = None
+                self._mapped_rows = 0
+            else:
+                self._mm = np.memmap(self.path, dtype=self.dtype, mode="r", shape=(n, self.width))
+                self._mapped_rows = n
+        if self._mapped_rows < min_rows:
+            raise RuntimeError(f"Vector file {self.path} is shorter than its metadata ({self._mapped_rows} < {min_rows})")
+        if self._mm is None:
+            return np.zeros((0, self.width), dtype=self.dtype)
+        return self._mm
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        self._mm = None
+        self._mapped_rows = 0
+
+
+class _Segment:
+    """
+    One segment's matrix files; `exact` / `scales` are None when the storage mode has none.
+    Each segment has its own storage spec, so old segments can be re-encoded more cheaply.
+    """
+
+    def __init__(self, base: str, storage: str, dim: int, rerank: bool):
+        self.storage = storage
+        self.rerank = rerank
+        self.exact = _MappedMatrix(base + ".f32", "float32", dim) if (storage == "float32" or rerank) else None
+        self.codes = self.exact if storage == "float32" else _MappedMatrix(
+            base + (".f16" if storage == "float16" else ".i8"),
+            "float16" if storage == "float16" else "int8",
+            dim
+        )
+        self.scales = _MappedMatrix(base + ".i8s", "float32", 1) if storage == "int8" else None
+
+    def files(self):
+        files = [self.codes, self.exact, self.scales]
+        return [m for i, m in enumerate(files) if m is not None and m not in files[:i]]
+
+    def encode(self, vecs):
+        """Codes (and int8 per-row scales) for a float32 (n, dim) matrix."""
+        if self.storage == "int8":
+            scales = np.abs(vecs).max(axis=1, keepdims=True) / 127.0
+            scales[scales == 0] = 1.0
+            return np.round(vecs / scales).astype("int8"), scales.astype("float32")
+        return vecs.astype(self.codes.dtype), None
+
+    def append(self, vecs, codes, scales):
+        # Caller holds the store lock (or owns the segment outright, as compaction does)
+        row = self.codes.append(codes)
+        if self.exact is not None and self.exact is not self.codes:
+            self.exact.append(vecs)
+        if self.scales is not None:
+            self.scales.append(scales)
+        return row
+
+    def read(self, local, exact=False):
+        """Float32 rows at the given offsets; exact=True reads the float32 file where there is one."""
+        min_rows = int(local.max()) + 1
+        if self.exact is not None and (exact or self.codes is self.exact):
+            return np.asarray(self.exact.view(min_rows)[local], dtype="float32")
+        codes = np.asarray(self.codes.view(min_rows)[local], dtype="float32")
+        if self.scales is not None:
+            codes *= self.scales.view(min_rows)[local]
+        return codes
+
+
+def _period(ts):
+    return int(ts // (SEGMENT_DAYS * 86400))
+
+def _in_segments(numbers):
+    # Row ranges rather than row // SEGMENT_SPAN, so the (store, row) index can serve the filter
+    return or_(*(
+        and_(VectorRow.row >= number * SEGMENT_SPAN, VectorRow.row < (number + 1) * SEGMENT_SPAN)
+        for number in numbers
+    ))
+
+
+class MmapVectorStore(VectorStore):
+    """
+    Vectors live in contiguous matrix files that every process memory-maps read-only,
+    so N gunicorn workers share a single copy through the OS page cache.
+    Row → (event_id, user_id, thread_id) metadata lives in the `vector_rows` table.
+    Appends are serialized across processes with an flock on a sidecar lock file.
+
+    storage="float16" / "int8" scans compact codes (2× / 4× smaller than float32, int8 with a
+    per-row scale). With rerank=True the exact float32 rows are also kept in a cold file that is
+    only read for the shortlisted candidates, so the final top-k order is exact.
+
+    The matrix is split into segments. A row's number in `vector_rows` is global
+    (segment × SEGMENT_SPAN + offset), so rows never move while anything refers to them:
+    deleting a vector only drops its `vector_rows` entry (searches score id-mapped rows only,
+    so the dead row is never read again), and compact() copies a dead-heavy segment's live rows
+    into a fresh segment, repoints their entries in one transaction and retires the old files.
+
+    Segments are also time partitions: appends roll over to a new segment every SEGMENT_DAYS,
+    and each segment records when it was first and last written. search(since=...) skips
+    segments last written before `since`, so routing only maps the recent ones; vectors that
+    are rewritten (thread signatures) move to the active segment, so they stay recent. Segments
+    older than QUANTIZE_AFTER_DAYS are compacted into int8 codes without the exact rows.
+    """
+
+    def __init__(self, name: str, dim: int = 1536, directory: str = VECTOR_STORE_DIR,
+                 storage: str = VECTOR_STORAGE, rerank: bool = True, reset: bool = False, shard: int = 0):
+        if storage not in STORAGE_MODES:
+            raise ValueError(f"❌ Unknown vector storage mode '{storage}' (expected one of {STORAGE_MODES}).")
+
+        self.name = name
+        self.dim = dim
+        self.directory = directory
+        self.shard = shard  # whose database holds the id map (see sharding.py)
+        self.storage = storage
+        self.rerank = rerank and storage != "float32"
+        os.makedirs(directory, exist_ok=True)
+        self.base = os.path.join(directory, name)
+        self.lock_path = self.base + ".lock"
+        self.state_path = self.base + ".segments.json"
+        self._check_meta(self.base + ".meta.json", overwrite=reset)
+        self._segments = {}
+        if reset:
+            self.reset()
+
+    def _check_meta(self, meta_path, overwrite=False):
+        meta = {"dim": self.dim, "storage": self.storage, "rerank": self.rerank}
+        if os.path.exists(meta_path) and not overwrite:
+            with open(meta_path) as f:
+                existing = json.load(f)
+            if existing != meta:
+                raise ValueError(
+                    f"❌ Vector store '{self.name}' was created with {existing}, not {meta}. "
+                    f"Use init_faiss(reset=True) to rebuild it."
+                )
+        else:
+            with open(meta_path, "w") as f:
+                json.dump(meta, f)
+
+    # ---------------------------
+    # File helpers
+    # ---------------------------
+    @contextmanager
+    def _locked(self, suffix=".lock", blocking=True):
+        with open(self.base + suffix, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _spec(self, state, number):
+        info = state["segments"].get(str(number), {})
+        return {"storage": info.get("storage", self.storage), "rerank": info.get("rerank", self.rerank)}
+
+    def _segment(self, number, state=None):
+        segment = self._segments.get(number)
+        if segment is None:
+            # A segment's spec is recorded before any row points into it, and never changes
+            spec = self._spec(state or self._read_state(), number)
+            # Segment 0 keeps the original single-file names, so existing stores are its contents
+            base = self.base if number == 0 else f"{self.base}.s{number}"
+            segment = self._segments[number] = _Segment(base, spec["storage"], self.dim, spec["rerank"])
+        return segment
+
+    def _read_state(self):
+        # {"active": segment appends go to, "next": next unused number, "retired": {segment: retired_at},
+        #  "segments": {segment: {"storage", "rerank", "min_at", "max_at"}}} — times are unix seconds
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        state.setdefault("active", 0)
+        state.setdefault("next", state["active"] + 1)
+        state.setdefault("retired", {})
+        state.setdefault("segments", {})
+        return state
+
+    def _write_state(self, state):
+        # Caller holds the store lock
+        with open(self.state_path + ".tmp", "w") as f:
+            json.dump(state, f)
+        os.replace(self.state_path + ".tmp", self.state_path)
+
+    def _active(self, state, now):
+        """Segment for appends made at `now`, rolling over to a new one when the period changes."""
+        # Caller holds the store lock and writes `state` back
+        info = state["segments"].setdefault(str(state["active"]), {})
+        if SEGMENT_DAYS and info.get("min_at") is not None and _period(info["min_at"]) != _period(now):
+            state["active"] = state["next"]
+            state["next"] += 1
+            info = state["segments"][str(state["active"])] = {}
+        info.setdefault("min_at", now)
+        info["max_at"] = max(info.get("max_at") or now, now)
+        return state["active"]
+
+    def _gather(self, rows, exact=False):
+        """Float32 matrix of the given global rows, in order; exact=True prefers the float32 files."""
+        rows = np.asarray(rows, dtype="int64")
+        out = np.empty((rows.shape[0], self.dim), dtype="float32")
+        numbers = rows // SEGMENT_SPAN
+        for number in np.unique(numbers):
+            mask = numbers == number
+            out[mask] = self._segment(int(number)).read(rows[mask] - number * SEGMENT_SPAN, exact=exact)
+        return out
+
+    def _check(self, vector):
+        vec = np.asarray(vector, dtype="float32").reshape(-1)
+        if vec.shape[0] != self.dim:
+            raise ValueError(f"❌ Expected a {self.dim}-dim vector, got {vec.shape[0]}.")
+        return vec
+
+    # ---------------------------
+    # VectorStore API
+    # ---------------------------
+    def add(self, key, vector, user_id, thread_id):
+        self.add_many([(key, vector, user_id, thread_id)])
+
+    def add_many(self, items, session=None):
+        if not items:
+            return
+        vecs = np.stack([self._check(vector) for _, vector, _, _ in items])
+
+        # One lock + one commit for the whole batch. Rows appended for a transaction that then
+        # rolls back stay in the file unreferenced, which searches never see
+        own_session = session is None
+        session = SessionLocal(shard=self.shard) if own_session else session
+        try:
+            with self._locked():
+                state = self._read_state()
+                number = self._active(state, time.time())
+                segment = self._segment(number, state)
+                first = number * SEGMENT_SPAN + segment.append(vecs, *segment.encode(vecs))
+                self._write_state(state)
+                for i, (key, _, user_id, thread_id) in enumerate(items):
+                    session.add(VectorRow(store=self.name, row=first + i, event_id=key, user_id=user_id, thread_id=thread_id))
+            if own_session:
+                session.commit()
+        finally:
+            if own_session:
+                session.close()
+
+    def _rows(self, user_id=None, thread_id=None, since=None):
+        stale = []
+        if since is not None:
+            # Segments with no write since `since` aren't read at all (nor paged in)
+            stale = [
+                int(number) for number, info in self._read_state()["segments"].items()
+                if info.get("max_at") is not None and info["max_at"] < since
+            ]
+        session = SessionLocal(shard=self.shard)
+        try:
+            query = session.query(VectorRow.row, VectorRow.event_id).filter(VectorRow.store == self.name)
+            if user_id is not None:
+                query = query.filter(VectorRow.user_id == user_id)
+            if thread_id is not None:
+                query = query.filter(VectorRow.thread_id == thread_id)
+            if stale:
+                query = query.filter(not_(_in_segments(stale)))
+            pairs = query.all()
+        finally:
+            session.close()
+        rows = np.fromiter((r for r, _ in pairs), dtype="int64", count=len(pairs))
+        keys = np.fromiter((k for _, k in pairs), dtype="int64", count=len(pairs))
+        return rows, keys
+
+    def search(self, vector, top_k=5, user_id=None, thread_id=None, since=None):
+        rows, keys = self._rows(user_id=user_id, thread_id=thread_id, since=since)
+        if rows.size == 0:
+            return []
+
+        query = np.asarray(vector, dtype="float32").reshape(-1)
+        # Compressed modes shortlist more candidates, then re-score them against exact vectors
+        shortlist = top_k * RERANK_OVERSAMPLE if self.rerank else top_k
+
+        # Each segment is scored on its own and keeps its best `shortlist` rows; the global
+        # shortlist is among them, and only one segment's candidates are in memory at a time
+        numbers = rows // SEGMENT_SPAN
+        parts = []
+        for number in np.unique(numbers):
+            mask = numbers == number
+            seg_rows, seg_keys = rows[mask], keys[mask]
+            candidates = self._gather(seg_rows)
+            scores = candidates @ query
+            k = min(shortlist, scores.shape[0])
+            best = np.argpartition(-scores, k - 1)[:k]
+            parts.append((seg_rows[best], seg_keys[best], scores[best], candidates[best]))
+        rows, keys, scores, candidates = (np.concatenate(p) for p in zip(*parts))
+
+        k = min(shortlist, scores.shape[0])
+        best = np.argpartition(-scores, k - 1)[:k]
+        if self.rerank:
+            candidates = self._gather(rows[best], exact=True)
+            scores = candidates @ query
+            keys = keys[best]
+            best = np.arange(best.shape[0])
+
+        best = best[np.argsort(-scores[best])][:top_k]
+        return [(int(keys[i]), float(scores[i]), np.array(candidates[i])) for i in best]
+
+    def get(self, key):
+        session = SessionLocal(shard=self.shard)
+        try:
+            hit = session.query(VectorRow.row).filter_by(store=self.name, event_id=key).first()
+        finally:
+            session.close()
+        if not hit:
+            return None
+        return self._gather([hit.row], exact=self.rerank)[0]
+
+    def replace(self, key, vector, session=None):
+        vecs = self._check(vector).reshape(1, -1)
+        own_session = session is None
+        session = SessionLocal(shard=self.shard) if own_session else session
+        try:
+            for _ in range(3):
+                # Looked up under the lock, so a compaction can't move the row between lookup and write
+                with self._locked():
+                    hit = session.query(VectorRow.id, VectorRow.row).filter_by(store=self.name, event_id=key).first()
+                    if not hit:
+                        raise KeyError(f"❌ No vector stored under key {key} in '{self.name}'.")
+                    number, row = divmod(hit.row, SEGMENT_SPAN)
+                    state = self._read_state()
+                    active = self._active(state, time.time())
+                    segment = self._segment(active if number != active else number, state)
+                    codes, scales = segment.encode(vecs)
+                    if number == active:
+                        segment.codes.write(row, codes)
+                        if segment.exact is not None and segment.exact is not segment.codes:
+                            segment.exact.write(row, vecs)
+                        if segment.scales is not None:
+                            segment.scales.write(row, scales)
+                        self._write_state(state)
+                        return
+                    # Rows of older segments are rewritten into the active one, so a vector that
+                    # keeps changing stays in the recent segments
+                    new_row = active * SEGMENT_SPAN + segment.append(vecs, codes, scales)
+                    self._write_state(state)
+
+                # Repointed after the store lock is released (lock order is SQLite first, then
+                # the store lock); a row moved by compaction meanwhile is looked up again
+                moved = session.execute(
+                    update(VectorRow.__table__)
+                    .where(VectorRow.__table__.c.id == hit.id)
+                    .where(VectorRow.__table__.c.row == hit.row)
+                    .values(row=new_row)
+                ).rowcount
+                if moved:
+                    if own_session:
+                        session.commit()
+                    return
+            raise RuntimeError(f"❌ Vector {key} in '{self.name}' kept moving during replace().")
+        finally:
+            if own_session:
+                session.close()
+
+    def get_many(self, keys):
+        keys = list(keys)
+        pairs = []
+        session = SessionLocal(shard=self.shard)
+        try:
+            for i in range(0, len(keys), 500):  # stay under SQLite's bound-parameter limit
+                pairs += (
+                    session.query(VectorRow.event_id, VectorRow.row)
+                    .filter(VectorRow.store == self.name, VectorRow.event_id.in_(keys[i:i + 500]))
+                    .all()
+                )
+        finally:
+            session.close()
+        if not pairs:
+            return {}
+        matrix = self._gather([r for _, r in pairs], exact=self.rerank)
+        return {key: matrix[i] for i, (key, _) in enumerate(pairs)}
+
+    def delete(self, keys=None, user_id=None, thread_id=None, session=None):
+        if keys is None and user_id is None and thread_id is None:
+            raise ValueError("❌ delete() needs keys, a user_id or a thread_id.")
+        own_session = session is None
+        session = SessionLocal(shard=self.shard) if own_session else session
+        try:
+            query = session.query(VectorRow).filter(VectorRow.store == self.name)
+            if user_id is not None:
+                query = query.filter(VectorRow.user_id == user_id)
+            if thread_id is not None:
+                query = query.filter(VectorRow.thread_id == thread_id)
+            if keys is None:
+                deleted = query.delete(synchronize_session=False)
+            else:
+                keys, deleted = list(keys), 0
+                for i in range(0, len(keys), 500):
+                    deleted += query.filter(VectorRow.event_id.in_(keys[i:i + 500])).delete(synchronize_session=False)
+            if own_session:
+                session.commit()
+            return deleted
+        finally:
+            if own_session:
+                session.close()
+
+    def count(self):
+        session = SessionLocal(shard=self.shard)
+        try:
+            return session.query(VectorRow).filter_by(store=self.name).count()
+        finally:
+            session.close()
+
+    def reset(self):
+        with self._locked():
+            session = SessionLocal(shard=self.shard)
+            try:
+                session.query(VectorRow).filter_by(store=self.name).delete()
+                session.commit()
+            finally:
+                session.close()
+            state = self._read_state()
+            for number in range(state["next"]):
+                for matrix in self._segment(number, state).files():
+                    matrix.remove()
+            self._segments = {}
+            for path in (self.state_path, _watermark_path(self.name, self.directory)):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    # ---------------------------
+    # Segments and compaction
+    # ---------------------------
+    def segment_stats(self):
+        """Per segment: rows in its files, rows still referenced, dead (deleted) rows, spec and time range."""
+        session = SessionLocal(shard=self.shard)
+        try:
+            live = dict(
+                session.query(VectorRow.row // SEGMENT_SPAN, func.count(VectorRow.id))
+                .filter(VectorRow.store == self.name)
+                .group_by(VectorRow.row // SEGMENT_SPAN)
+            )
+        finally:
+            session.close()
+        state = self._read_state()
+        stats = {}
+        for number in range(state["next"]):
+            if str(number) in state["retired"] and not live.get(number):
+                continue
+            rows = self._segment(number, state).codes.rows()
+            if rows or live.get(number):
+                info = state["segments"].get(str(number), {})
+                stats[number] = {
+                    "rows": rows,
+                    "live": live.get(number, 0),
+                    "dead": max(rows - live.get(number, 0), 0),
+                    "active": number == state["active"],
+                    "retired": str(number) in state["retired"],
+                    **self._spec(state, number),
+                    "min_at": info.get("min_at"),
+                    "max_at": info.get("max_at"),
+                }
+        return stats
+
+    def compact(self, dead_fraction=COMPACT_DEAD_FRACTION, min_dead_rows=COMPACT_MIN_DEAD_ROWS,
+                quantize_after_days=QUANTIZE_AFTER_DAYS):
+        """
+        Rewrite segments whose dead share is at least `dead_fraction` (and at least `min_dead_rows`
+        rows), and re-encode sealed segments last written more than `quantize_after_days` ago as
+        int8 without exact rows: live rows are copied into a new segment per spec and repointed in
+        one transaction, and the old files are deleted once no row refers to them and
+        RETIRED_GRACE_SECONDS have passed, so searches already holding old row numbers finish
+        against the old files.
+        Returns {"segments": [...], "quantized": [...], "moved": n, "reclaimed": rows}; one
+        compaction at a time.
+        """
+        summary = {"segments": [], "quantized": [], "moved": 0, "reclaimed": 0}
+        with self._locked(".compact.lock", blocking=False) as acquired:
+            if not acquired:
+                return summary
+            self._drop_retired()
+
+            stats = self.segment_stats()
+            cutoff = time.time() - quantize_after_days * 86400
+            quantized = [
+                number for number, s in stats.items()
+                if quantize_after_days and not s["active"] and not s["retired"] and s["live"]
+                and s["max_at"] is not None and s["max_at"] < cutoff
+                and {"storage": s["storage"], "rerank": s["rerank"]} != QUANTIZED_SPEC
+            ]
+            victims = quantized + [
+                number for number, s in stats.items()
+                # Rows left in a retired segment were committed after it was compacted
+                if number not in quantized and ((s["retired"] and s["live"]) or (
+                    not s["retired"] and s["rows"] and s["dead"] >= min_dead_rows
+                    and s["dead"] >= dead_fraction * s["rows"]
+                ))
+            ]
+            if not victims:
+                return summary
+
+            # Live rows keep their segment's spec, except the ones being quantized
+            groups = {}
+            for number in victims:
+                spec = QUANTIZED_SPEC if number in quantized else {"storage": stats[number]["storage"], "rerank": stats[number]["rerank"]}
+                groups.setdefault(tuple(spec.items()), []).append(number)
+
+            with self._locked():
+                state = self._read_state()
+                targets = []
+                for spec, numbers in groups.items():
+                    infos = [state["segments"].get(str(n), {}) for n in numbers]
+                    state["segments"][str(state["next"])] = {
+                        **dict(spec),
+                        "min_at": min((i["min_at"] for i in infos if i.get("min_at") is not None), default=None),
+                        "max_at": max((i["max_at"] for i in infos if i.get("max_at") is not None), default=None),
+                    }
+                    targets.append((numbers, state["next"]))
+                    state["next"] += 1
+                if state["active"] in victims:
+                    # Appends move to a fresh segment; any still in flight to the old one are
+                    # picked up as leftovers by the next compaction
+                    state["active"] = state["next"]
+                    state["next"] += 1
+                self._write_state(state)
+
+            moved = sum(self._move_live_rows(numbers, target) for numbers, target in targets)
+            with self._locked():
+                state = self._read_state()
+                for number in victims:
+                    state["retired"][str(number)] = time.time()
+                self._write_state(state)
+
+            summary.update(
+                segments=victims, quantized=quantized, moved=moved,
+                reclaimed=sum(stats[n]["rows"] for n in victims) - moved,
+            )
+        return summary
+
+    def _move_live_rows(self, victims, target):
+        session = SessionLocal(shard=self.shard)
+        try:
+            pairs = (
+                session.query(VectorRow.id, VectorRow.row)
+                .filter(VectorRow.store == self.name)
+                .filter(_in_segments(victims))
+                .order_by(VectorRow.row)
+                .all()
+            )
+            if not pairs:
+                return 0
+            new_rows = [target * SEGMENT_SPAN + i for i in range(len(pairs))]
+
+            # Repointing first takes SQLite's write lock: no row can be added to or deleted from
+            # the map until the copy below is committed, and the store lock keeps replace() out
+            session.execute(
+                update(VectorRow.__table__)
+                .where(VectorRow.__table__.c.id == bindparam("row_id"))
+                .where(VectorRow.__table__.c.row == bindparam("old_row"))
+                .values(row=bindparam("new_row")),
+                [{"row_id": i, "old_row": old, "new_row": new} for (i, old), new in zip(pairs, new_rows)],
+            )
+            with self._locked():
+                old_rows = np.array([row for _, row in pairs], dtype="int64")
+                segment = self._segment(target)
+                for start in range(0, len(old_rows), COMPACT_CHUNK_ROWS):
+                    chunk = old_rows[start:start + COMPACT_CHUNK_ROWS]
+                    self._copy_rows(chunk, segment)
+                session.commit()
+            return len(pairs)
+        finally:
+            session.close()
+
+    def _copy_rows(self, rows, target):
+        # Rows from a segment of the target's spec are copied as stored, so nothing is
+        # re-quantized; others are decoded (from exact rows where kept) and re-encoded
+        numbers = rows // SEGMENT_SPAN
+        for number in np.unique(numbers):
+            local = rows[numbers == number] - number * SEGMENT_SPAN
+            source = self._segment(int(number))
+            if (source.storage, source.rerank) == (target.storage, target.rerank):
+                min_rows = int(local.max()) + 1
+                for src, dst in zip(source.files(), target.files()):
+                    dst.append(np.asarray(src.view(min_rows)[local]))
+            else:
+                vecs = source.read(local, exact=True)
+                target.append(vecs, *target.encode(vecs))
+
+    def _drop_retired(self):
+        """Delete the files of retired segments no row refers to, once their grace period is over."""
+        stats = self.segment_stats()
+        with self._locked():
+            state = self._read_state()
+            now = time.time()
+            for number, retired_at in list(state["retired"].items()):
+                if now - retired_at < RETIRED_GRACE_SECONDS or stats.get(int(number), {}).get("live"):
+                    continue
+                for matrix in self._segment(int(number), state).files():
+                    matrix.remove()
+                self._segments.pop(int(number), None)
+                del state["retired"][number]
+                state["segments"].pop(number, None)
+            self._write_state(state)
@@ -0,0 +1,123 @@
+# wild_card.py
+#
+# Product recommendation ("wild card") generation with a per-user memo.
+# The recommendation depends only on the user's last five structured entries, so it is keyed by a
+# fingerprint of that list: repeat requests with an unchanged list never call the model. When the
+# list changes, prefetch() refreshes it on a background thread while the request carries on, and
+# get_wild_card() returns the fresh value if it's ready in time — otherwise the previous one.
+# A user with nothing cached yet (their first recommendation) waits for the refresh for as long
+# as the request budget allows; if it still isn't there, they get PENDING_TEXT, never a blank.
+
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from .clients import chat_completion, CHAT_TIMEOUT
+from .deadline import run_stage, call_timeout, current_deadline
+from .rate_limiter import OPTIONAL, RateLimitShed
+
+MAX_CACHED_USERS = 10000
+WAIT_FOR_REFRESH_SECONDS = 2.0   # how long a request will wait for an in-flight refresh
+REFRESH_WORKERS = 4
+PENDING_TEXT = "Your product recommendation is still on its way — it'll be here with your next entry."
+
+_cache = OrderedDict()   # user_id → (fingerprint, recommendation)
+_pending = {}            # user_id → (fingerprint, future)
+_lock = threading.Lock()
+_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="wild-card")
+
+def generate_wild_card(structured_entries, topic):
+    prompt = f"""
+The user has been journaling. Here are their last 5 entries summarized:
+
+{chr(10).join(f"- {m}" for m in structured_entries)}
+
+Topic focus: {topic}
+
+Recommend ONE real consumer product or sponsorship category that the user could realistically purchase online or in a store.
+- Base it on recurring topics, subtopics, and emotions across the 5 entries (not just the most recent one).
+- Suggest well-known, practical categories: fitness gear, creator tools, home office gadgets, kitchen tools, wellness items, travel accessories, or books.
+- Avoid novelty, joke, or fantasy products.
+- Keep the output short and simple, just the product or category name.
+
+Examples: "Adjustable dumbbells", "Noise-canceling headphones", "A standing desk mat", "Ring light kit", "Video editing software".
+Only output the product suggestion, nothing else.
+"""
+    def call_model():
+        response = chat_completion(
+            model="gpt-4o",
+            messages=[{"role": "system", "content": prompt}],
+            temperature=0.5,
+            priority=OPTIONAL,
+            timeout=call_timeout(CHAT_TIMEOUT),
+        )
+        return response.choices[0].message.content.strip()
+
+    try:
+        return run_stage("wild_card", call_model, lambda: None)
+    except RateLimitShed as e:
+        print(f"[⏸️ Wild Card Shed] {e}", flush=True)
+        return None
+    except Exception as e:
+        print(f"[⚠️ Wild Card Error] {e}", flush=True)
+        return None
+
+def fingerprint(structured_entries):
+    return hashlib.sha256("\n".join(structured_entries).encode("utf-8")).hexdigest()
+
+def _refresh(user_id, key, structured_entries, topic):
+    try:
+        recommendation = generate_wild_card(structured_entries, topic)
+        if recommendation:
+            with _lock:
+                _cache[user_id] = (key, recommendation)
+                _cache.move_to_end(user_id)
+                while len(_cache) > MAX_CACHED_USERS:
+                    _cache.popitem(last=False)
+        return recommendation
+    finally:
+        with _lock:
+            if _pending.get(user_id, (None,))[0] == key:
+                del _pending[user_id]
+
+def prefetch(user_id, structured_entries, topic):
+    """Start a background refresh unless the memo (or an in-flight refresh) already covers these entries."""
+    key = fingerprint(structured_entries)
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached and cached[0] == key:
+            return
+        pending = _pending.get(user_id)
+        if pending and pending[0] == key:
+            return
+        future = _executor.submit(_refresh, user_id, key, structured_entries, topic)
+        _pending[user_id] = (key, future)
+
+def get_wild_card(user_id, structured_entries, topic):
+    """Return (recommendation, cache_status); only a user with nothing cached waits out the request budget."""
+    key = fingerprint(structured_entries)
+    prefetch(user_id, structured_entries, topic)
+
+    with _lock:
+        cached = _cache.get(user_id)
+        pending = _pending.get(user_id)
+    if cached and cached[0] == key:
+        return cached[1], "hit"
+
+    if pending and pending[0] == key:
+        # With an older recommendation to fall back on, only wait briefly; with none, use the budget
+        deadline = current_deadline()
+        budget = deadline.remaining() if deadline is not None else CHAT_TIMEOUT
+        wait = max(0.0, min(WAIT_FOR_REFRESH_SECONDS, budget) if cached else budget)
+        try:
+            fresh = pending[1].result(timeout=wait)
+            if fresh:
+                return fresh, "fresh"
+        except FutureTimeout:
+            pass
+        except Exception as e:
+            print(f"[⚠️ Wild Card Error] {e}", flush=True)
+
+    if cached:
+        return cached[1], "stale"
+    return PENDING_TEXT, "pending"
@@ -0,0 +1,341 @@
+# working_set.py
+#
+# Per-user working set for routing and the /message response.
+# Routing a message reads the same per-user facts every time: the recently active threads
+# (latest message's features and vector, the thread's signature vector), the newest thread per
+# topic, the recent messages' near-duplicate fingerprints, and — for the response — the topic
+# histogram and the UserProfile. They're loaded once
+# per user with a few indexed queries, kept in an LRU bounded by user count and approximate
+# bytes (THREADLY_WORKING_SET_MB; 0 disables caching), and updated write-through when an ingest
+# or profile update commits, so routing an active user's message runs one indexed query.
+# Each process keeps its own copy. That query checks the user's version stamp (event count and
+# newest event id) before a cached set is served: a new message or deletion by another worker
+# process reloads it. The check runs once per unit of work; later reads in the same request
+# reuse the set it validated (this request's own writes reach it write-through). Profile and signature updates made elsewhere without a new message are
+# picked up when entries expire after WORKING_SET_TTL_SECONDS. An entry loaded from another
+# shard than the user's current one (they were moved by a rebalance) is never used.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from sqlalchemy import func
+from .models import MemoryEvent, UserProfile, MessageFingerprint
+from .records import ThreadHead
+from .db_setup import current_shard
+from .unit_of_work import current_unit_of_work
+from .near_duplicates import NEAR_DUPLICATE_WINDOW, distance
+
+WORKING_SET_MAX_USERS = int(os.getenv("THREADLY_WORKING_SET_USERS", "5000"))
+WORKING_SET_MAX_BYTES = int(float(os.getenv("THREADLY_WORKING_SET_MB", "64")) * 1024 * 1024)
+WORKING_SET_TTL_SECONDS = 300
+MAX_HEADS = 200            # users with more active threads fall back to SQL for the overflow
+HEAD_OVERHEAD_BYTES = 512  # rough per-thread cost of the record, dict slots and numpy headers
+
+PROFILE_FIELDS = (
+    "total_messages", "total_threads", "unresolved_threads", "most_common_topic",
+    "dominant_emotion", "active_topic_streak", "repetition_count",
+)
+
+
+class UserWorkingSet:
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.shard = current_shard()  # event ids below are this shard's
+        self.heads = {}            # thread_id → ThreadHead of its latest message
+        self.head_vectors = {}     # thread_id → vector of that message
+        self.signatures = {}       # thread_id → thread signature (centroid) vector
+        self.latest_by_topic = {}  # topic → (timestamp, thread_id) of its newest message
+        self.topic_counts = {}     # topic → message count, all time
+        self.fingerprints = OrderedDict()  # event_id → SimHash of the last NEAR_DUPLICATE_WINDOW messages
+        self.event_count = 0
+        self.last_event_id = 0     # with event_count, the version stamp checked before each use
+        self.profile = None        # dict of PROFILE_FIELDS, or None before the first update
+        self.complete = True       # False when the user had more than MAX_HEADS active threads
+        self.loaded_at = time.monotonic()
+        self.nbytes = 0
+        self.lock = threading.Lock()
+
+    # ---------------------------
+    # Routing reads
+    # ---------------------------
+    def thread_for_topic(self, topic, cutoff):
+        with self.lock:
+            latest = self.latest_by_topic.get(topic)
+        return latest[1] if latest and latest[0] >= cutoff else None
+
+    def recent_threads(self, cutoff, limit):
+        with self.lock:
+            heads = [h for h in self.heads.values() if h.timestamp >= cutoff]
+        heads.sort(key=lambda h: (h.timestamp, h.id), reverse=True)
+        return [h.thread_id for h in heads[:limit]]
+
+    def last_thread_id(self):
+        with self.lock:
+            if not self.heads:
+                return None
+            return max(self.heads.values(), key=lambda h: (h.timestamp, h.id)).thread_id
+
+    def head(self, thread_id):
+        with self.lock:
+            return self.heads.get(thread_id), self.head_vectors.get(thread_id)
+
+    def search_signatures(self, vector, top_k=5):
+        """Same shape as embedding_utils.search_thread_signatures, over the active threads."""
+        with self.lock:
+            items = list(self.signatures.items())
+        if not items:
+            return []
+        matrix = np.stack([v for _, v in items])
+        scores = matrix @ np.asarray(vector, dtype="float32")
+        best = np.argsort(-scores)[:top_k]
+        return [(items[i][0], items[i][1].reshape(1, -1)) for i in best]
+
+    def signature_vectors(self, thread_ids):
+        with self.lock:
+            return {tid: self.signatures[tid] for tid in thread_ids if tid in self.signatures}
+
+    def similar_fingerprints(self, fingerprint, max_distance, limit):
+        """Ids of recent messages whose fingerprint is within `max_distance` bits, closest first."""
+        with self.lock:
+            items = list(self.fingerprints.items())
+        close = [(distance(fingerprint, fp), -event_id) for event_id, fp in items]
+        return [-neg_id for d, neg_id in sorted(c for c in close if c[0] <= max_distance)[:limit]]
+
+    def topic_histogram(self):
+        with self.lock:
+            return list(self.topic_counts.items())
+
+    # ---------------------------
+    # Write-through
+    # ---------------------------
+    def _apply_event(self, head, vector, fingerprint=None):
+        if fingerprint is not None:
+            self.fingerprints[head.id] = fingerprint
+            while len(self.fingerprints) > NEAR_DUPLICATE_WINDOW:
+                self.fingerprints.popitem(last=False)
+        if vector is not None and head.thread_id not in self.signatures:
+            self.signatures[head.thread_id] = vector  # until the signature job reports the centroid
+        current = self.heads.get(head.thread_id)
+        if current is None or (head.timestamp, head.id) >= (current.timestamp, current.id):
+            self.heads[head.thread_id] = head
+            if vector is not None:
+                self.head_vectors[head.thread_id] = vector
+            else:
+                self.head_vectors.pop(head.thread_id, None)
+        current = self.latest_by_topic.get(head.topic)
+        if current is None or head.timestamp >= current[0]:
+            self.latest_by_topic[head.topic] = (head.timestamp, head.thread_id)
+        if head.topic is not None:
+            self.topic_counts[head.topic] = self.topic_counts.get(head.topic, 0) + 1
+        self.event_count += 1
+        self.last_event_id = max(self.last_event_id, head.id)
+
+    def _measure(self):
+        size = HEAD_OVERHEAD_BYTES * len(self.heads)
+        size += sum(len(h.message_text or "") + len(h.topic_nuance or "") + len(h.subtopics or "") for h in self.heads.values())
+        size += sum(v.nbytes for v in self.head_vectors.values())
+        size += sum(v.nbytes for v in self.signatures.values())
+        size += 64 * (len(self.latest_by_topic) + len(self.topic_counts)) + 96 * len(self.fingerprints)
+        self.nbytes = size
+        return size
+
+
+_cache = OrderedDict()   # user_id → UserWorkingSet, least recently used first
+_epochs = {}             # user_id → committed-write counter; a load that raced a write isn't kept
+_generation = 0          # bumped when _epochs is cleared, for the same reason
+_total_bytes = 0
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0}
+
+def _vector(value):
+    # Unit-normalized, like the stores' rows, so dot products are cosine similarities
+    if value is None:
+        return None
+    vec = np.asarray(value, dtype="float32").reshape(-1)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+def _stamp(user_id, session):
+    """(event count, newest event id) for the user; changes with every committed ingest or deletion."""
+    count, newest = (
+        session.query(func.count(MemoryEvent.id), func.max(MemoryEvent.id))
+        .filter(MemoryEvent.user_id == user_id)
+        .one()
+    )
+    return count, newest or 0
+
+def _load(user_id, session):
+    from .thread_manager import THREAD_MAX_DAYS_OLD
+    from .embedding_utils import get_memory_store, get_thread_signatures
+
+    ws = UserWorkingSet(user_id)
+    cutoff = datetime.utcnow() - timedelta(days=THREAD_MAX_DAYS_OLD)
+    recent = (MemoryEvent.user_id == user_id, MemoryEvent.timestamp >= cutoff)
+
+    # Latest message of each thread active in the routing window (ids grow with time)
+    head_ids = [
+        head_id for (head_id,) in session.query(func.max(MemoryEvent.id))
+        .filter(*recent)
+        .group_by(MemoryEvent.thread_id)
+        .order_by(func.max(MemoryEvent.id).desc())
+        .limit(MAX_HEADS + 1)
+    ]
+    ws.complete = len(head_ids) <= MAX_HEADS
+    heads = ThreadHead.all(ThreadHead.query(session).filter(MemoryEvent.id.in_(head_ids[:MAX_HEADS]))) if head_ids else []
+    ws.heads = {h.thread_id: h for h in heads}
+
+    newest_per_topic = (
+        session.query(func.max(MemoryEvent.id)).filter(*recent).group_by(MemoryEvent.topic).scalar_subquery()
+    )
+    for topic, ts, thread_id in (
+        session.query(MemoryEvent.topic, MemoryEvent.timestamp, MemoryEvent.thread_id)
+        .filter(MemoryEvent.id.in_(newest_per_topic))
+    ):
+        ws.latest_by_topic[topic] = (ts, thread_id)
+
+    for topic, count, newest in (
+        session.query(MemoryEvent.topic, func.count(MemoryEvent.id), func.max(MemoryEvent.id))
+        .filter(MemoryEvent.user_id == user_id)
+        .group_by(MemoryEvent.topic)
+    ):
+        ws.event_count += count
+        ws.last_event_id = max(ws.last_event_id, newest)
+        if topic is not None:
+            ws.topic_counts[topic] = count
+
+    recent_fingerprints = (
+        session.query(MessageFingerprint.event_id, MessageFingerprint.simhash)
+        .filter(MessageFingerprint.user_id == user_id)
+        .order_by(MessageFingerprint.event_id.desc())
+        .limit(NEAR_DUPLICATE_WINDOW)
+        .all()
+    )
+    ws.fingerprints = OrderedDict(reversed(recent_fingerprints))
+
+    profile = session.query(*[getattr(UserProfile, f) for f in PROFILE_FIELDS]).filter_by(user_id=user_id).first()
+    ws.profile = dict(zip(PROFILE_FIELDS, profile)) if profile else None
+
+    if heads:
+        vectors = get_memory_store().get_many([h.id for h in heads])
+        ws.head_vectors = {h.thread_id: _vector(vectors[h.id]) for h in heads if vectors.get(h.id) is not None}
+        ws.signatures = {tid: _vector(v) for tid, v in get_thread_signatures(user_id, ws.heads).items()}
+
+    ws._measure()
+    return ws
+
+def _admit(ws):
+    global _total_bytes
+    previous = _cache.pop(ws.user_id, None)
+    if previous is not None:
+        _total_bytes -= previous.nbytes
+    _cache[ws.user_id] = ws
+    _total_bytes += ws.nbytes
+    while _cache and (len(_cache) > WORKING_SET_MAX_USERS or _total_bytes > WORKING_SET_MAX_BYTES):
+        _, evicted = _cache.popitem(last=False)
+        _total_bytes -= evicted.nbytes
+        _stats["evictions"] += 1
+
+def _bump(user_id):
+    global _generation
+    if len(_epochs) > 4 * WORKING_SET_MAX_USERS:
+        _epochs.clear()
+        _generation += 1
+    _epochs[user_id] = _epochs.get(user_id, 0) + 1
+
+def get(user_id, session):
+    """The user's working set, loaded through `session` on a miss."""
+    uow = current_unit_of_work()
+    memo = uow.memo if uow is not None and uow.session is session else {}
+    now = time.monotonic()
+    with _lock:
+        ws = _cache.get(user_id)
+        fresh = ws is not None and now - ws.loaded_at < WORKING_SET_TTL_SECONDS and ws.shard == current_shard()
+        if fresh and memo.get(("working_set", user_id)) is ws:
+            _cache.move_to_end(user_id)
+            _stats["hits"] += 1
+            return ws
+    if fresh:
+        with ws.lock:
+            cached_stamp = (ws.event_count, ws.last_event_id)
+        if _stamp(user_id, session) == cached_stamp:
+            with _lock:
+                if _cache.get(user_id) is ws:
+                    _cache.move_to_end(user_id)
+                _stats["hits"] += 1
+            memo[("working_set", user_id)] = ws
+            return ws
+
+    with _lock:
+        _stats["stale" if fresh else "misses"] += 1  # stale: another worker wrote since it was loaded
+        version = (_generation, _epochs.get(user_id, 0))
+
+    ws = _load(user_id, session)
+    if WORKING_SET_MAX_BYTES > 0:
+        with _lock:
+            if version == (_generation, _epochs.get(user_id, 0)):
+                _admit(ws)
+                memo[("working_set", user_id)] = ws
+    return ws
+
+def record_event(user_id, head, vector=None, fingerprint=None):
+    """Write-through for a committed MemoryEvent (`head` is its ThreadHead)."""
+    global _total_bytes
+    with _lock:
+        _bump(user_id)
+        ws = _cache.get(user_id)
+        if ws is None or ws.shard != current_shard():
+            return
+        with ws.lock:
+            ws._apply_event(head, _vector(vector), fingerprint)
+            before, after = ws.nbytes, ws._measure()
+        _total_bytes += after - before
+        _admit(ws)
+
+def set_signature(user_id, thread_id, vector):
+    """Write-through for an updated thread signature."""
+    global _total_bytes
+    with _lock:
+        _bump(user_id)
+        ws = _cache.get(user_id)
+        if ws is None or ws.shard != current_shard():
+            return
+        with ws.lock:
+            ws.signatures[thread_id] = _vector(vector)
+            before, after = ws.nbytes, ws._measure()
+        _total_bytes += after - before
+
+def set_profile(user_id, profile):
+    """Write-through for a committed UserProfile update (`profile` holds PROFILE_FIELDS)."""
+    with _lock:
+        _bump(user_id)
+        ws = _cache.get(user_id)
+        if ws is not None and ws.shard == current_shard():
+            with ws.lock:
+                ws.profile = dict(profile)
+
+def invalidate(user_id=None):
+    global _total_bytes, _generation
+    with _lock:
+        if user_id is None:
+            _cache.clear()
+            _epochs.clear()
+            _generation += 1
+            _total_bytes = 0
+            return
+        _bump(user_id)
+        ws = _cache.pop(user_id, None)
+        if ws is not None:
+            _total_bytes -= ws.nbytes
+
+def working_set_stats():
+    with _lock:
+        return {
+            **_stats,
+            "users": len(_cache),
+            "bytes": _total_bytes,
+            "max_users": WORKING_SET_MAX_USERS,
+            "max_bytes": WORKING_SET_MAX_BYTES,
+        }
@@ -0,0 +1,148 @@
+# orm_overhead.py
+#
+# Per-request ORM overhead of the /message read path: full MemoryEvent entities through a
+# regular session (before) vs column projections / slotted records through a read-only
+# session (after). Runs against a throwaway SQLite file seeded with synthetic history, so no
+# API key or existing memory_data.db is needed.
+#
+#   python benchmarks/orm_overhead.py [--events 5000] [--threads 40] [--requests 200]
+
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from Threadly_SDK.db_setup import Base, ReadSessionLocal
+from Threadly_SDK.models import MemoryEvent
+from Threadly_SDK.records import ThreadHead, ContextEntry
+
+TOPICS = ["sleep", "work", "fitness", "relationships", "money"]
+LONG_TEXT = "Lorem ipsum dolor sit amet, consectetur adipiscing elit. " * 8
+
+
+def seed(session, user_id, events, threads):
+    start = datetime.utcnow() - timedelta(days=20)
+    for i in range(events):
+        session.add(MemoryEvent(
+            user_id=user_id,
+            thread_id=f"thread-{i % threads}",
+            message_text=f"entry {i} " + LONG_TEXT,
+            response_text=LONG_TEXT,
+            timestamp=start + timedelta(minutes=5 * i),
+            sentiment=random.choice(["neutral", "frustrated", "happy"]),
+            topic=TOPICS[i % len(TOPICS)],
+            topic_nuance=f"nuance {i % 17}",
+            subtopics="caffeine,late nights",
+            resolved=i % 11 == 0,
+            current_state_summary=LONG_TEXT,
+            next_step_prediction=LONG_TEXT,
+            breakthrough_description=LONG_TEXT,
+        ))
+    session.commit()
+
+
+def request_before(session, user_id, thread_id, topic):
+    # Shape of the hot reads before projection: whole entities, attributes read off them
+    recent = (
+        session.query(MemoryEvent).filter(MemoryEvent.user_id == user_id)
+        .filter(MemoryEvent.timestamp >= datetime.utcnow() - timedelta(days=30))
+        .order_by(MemoryEvent.timestamp.desc()).all()
+    )
+    candidates = list(dict.fromkeys(e.thread_id for e in recent))[:10]
+    heads = [
+        session.query(MemoryEvent).filter_by(user_id=user_id, thread_id=tid)
+        .order_by(MemoryEvent.timestamp.desc()).first()
+        for tid in candidates
+    ]
+    thread_texts = [
+        e.message_text for e in session.query(MemoryEvent)
+        .filter_by(user_id=user_id, thread_id=thread_id)
+        .order_by(MemoryEvent.timestamp.asc()).all()
+    ]
+    resolved = [
+        (e.thread_id, e.sentiment, e.topic_nuance, e.message_text) for e in session.query(MemoryEvent)
+        .filter_by(user_id=user_id, topic=topic, resolved=True)
+        .order_by(MemoryEvent.timestamp.desc()).limit(10).all()
+    ]
+    return len(heads) + len(thread_texts) + len(resolved)
+
+
+def request_after(session, user_id, thread_id, topic):
+    candidates = []
+    for (tid,) in (
+        session.query(MemoryEvent.thread_id).filter(MemoryEvent.user_id == user_id)
+        .filter(MemoryEvent.timestamp >= datetime.utcnow() - timedelta(days=30))
+        .order_by(MemoryEvent.timestamp.desc()).yield_per(100)
+    ):
+        if tid not in candidates:
+            candidates.append(tid)
+        if len(candidates) >= 10:
+            break
+    heads = [
+        ThreadHead.first(
+            ThreadHead.query(session).filter_by(user_id=user_id, thread_id=tid)
+            .order_by(MemoryEvent.timestamp.desc())
+        )
+        for tid in candidates
+    ]
+    thread_texts = [
+        text for (text,) in session.query(MemoryEvent.message_text)
+        .filter_by(user_id=user_id, thread_id=thread_id)
+        .order_by(MemoryEvent.timestamp.asc())
+    ]
+    resolved = ContextEntry.all(
+        ContextEntry.query(session).filter_by(user_id=user_id, topic=topic, resolved=True)
+        .order_by(MemoryEvent.timestamp.desc()).limit(10)
+    )
+    return len(heads) + len(thread_texts) + len(resolved)
+
+
+def measure(label, make_session, fn, requests, threads):
+    tracemalloc.start()
+    started = time.perf_counter()
+    for i in range(requests):
+        session = make_session()
+        try:
+            fn(session, "bench-user", f"thread-{i % threads}", TOPICS[i % len(TOPICS)])
+        finally:
+            session.close()
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<8} {elapsed / requests * 1000:8.2f} ms/request   peak {peak / 1024:9.1f} KiB")
+    return elapsed / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--threads", type=int, default=40)
+    parser.add_argument("--requests", type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        Base.metadata.create_all(bind=engine)
+        write_session = sessionmaker(bind=engine)
+        ReadSessionLocal.configure(bind=engine)
+
+        session = write_session()
+        seed(session, "bench-user", args.events, args.threads)
+        session.close()
+        print(f"{args.events} events across {args.threads} threads, {args.requests} requests each\n")
+
+        before = measure("before", write_session, request_before, args.requests, args.threads)
+        after = measure("after", ReadSessionLocal, request_after, args.requests, args.threads)
+        print(f"\nspeedup  {before / after:.1f}×")
+
+
+if __name__ == "__main__":
+    main()
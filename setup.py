@@ -9,7 +9,6 @@ setup(
     packages=find_packages(),
     install_requires=[
         "openai",
-        "faiss-cpu",
         "numpy",
         "sqlalchemy",
         "python-dotenv",
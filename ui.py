@@ -4,31 +4,29 @@ os.environ["WATCHFILES_DISABLE_GLOBAL_WATCHER"] = "true"
 import streamlit as st
 from datetime import datetime
 from uuid import uuid4
-import requests
 from zoneinfo import ZoneInfo
-import time
-import csv
+from concurrent.futures import wait, TimeoutError as FutureTimeout
+from Threadly_SDK.http_client import ThreadlyClient, ThreadlyAPIError
+from Threadly_SDK import activity_logger
 
 # ---------------------------
 # CONFIG
 # ---------------------------
-BACKEND_URL = "https://threadly-backend-sqvr.onrender.com/message"
-LOG_FILE = "activity_log.csv"
+BACKEND_URL = os.getenv("THREADLY_BACKEND_URL", "https://threadly-backend-sqvr.onrender.com")
+RESPONSE_TIMEOUT_SECONDS = 90  # longest a reflection waits for the backend before giving up
+
+@st.cache_resource
+def get_client():
+    # One pooled client for every session on this server, so reflections reuse warm connections
+    return ThreadlyClient(BACKEND_URL)
 
 # ---------------------------
 # LOGGING
 # ---------------------------
 def log_action(user_id, action, content="", meta=None):
+    # Queued for the process-wide background writer (see activity_logger.py); never blocks the run
     try:
-        with open(LOG_FILE, "a", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow([
-                datetime.utcnow().isoformat() + "Z",
-                user_id,
-                action,
-                content,
-                str(meta) if meta else ""
-            ])
+        activity_logger.log_action(user_id, action, content, meta)
     except Exception:
         pass
 
@@ -222,6 +220,17 @@ with left:
                 "thread_id": "pending"
             })
 
+            # The request runs while the stages show; they stop as soon as it's answered
+            pending = get_client().submit_message(
+                st.session_state.user_id,
+                user_msg,
+                tags=["demo"],
+                debug_mode=True,
+                demo_mode=True,
+                goal_label="",
+                importance_score=0.5,
+                embedding_threshold=st.session_state.embedding_threshold
+            )
             with st.empty():
                 msg_area = st.empty()
                 for stage in [
@@ -231,29 +240,21 @@ with left:
                     "Summarizing your reflection...",
                     "Weaving it into your memory threads..."
                 ]:
+                    if pending.done():
+                        break
                     msg_area.info(stage)
-                    time.sleep(2)
+                    wait([pending], timeout=2)
 
             try:
-                response = requests.post(BACKEND_URL, json={
-                    "user_id": st.session_state.user_id,
-                    "message": user_msg,
-                    "tags": ["demo"],
-                    "debug_mode": True,
-                    "demo_mode": True,
-                    "goal_label": "",
-                    "importance_score": 0.5,
-                    "embedding_threshold": st.session_state.embedding_threshold
-                })
-                if response.status_code == 200:
-                    data = response.json()
-                    context = data.get("context", {})
-                    thread_id = context.get("thread_id", "unknown")
-                    st.session_state.chat_history[-1]["thread_id"] = thread_id
-                    st.session_state.last_response = context
-                    log_action(st.session_state.user_id, "add_reflection", user_msg, context)
-                else:
-                    st.error("Backend error. Please try again later.")
+                context = pending.result(timeout=RESPONSE_TIMEOUT_SECONDS) or {}
+                thread_id = context.get("thread_id", "unknown")
+                st.session_state.chat_history[-1]["thread_id"] = thread_id
+                st.session_state.last_response = context
+                log_action(st.session_state.user_id, "add_reflection", user_msg, context)
+            except ThreadlyAPIError:
+                st.error("Backend error. Please try again later.")
+            except FutureTimeout:
+                st.error("The backend is taking too long to answer. Please try again later.")
             except Exception as e:
                 st.error(f"Request failed: {e}")
 